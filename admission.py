@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Admission Control
+Per-user concurrency caps, fair queuing and load shedding for slow routes
+
+Every admitted request holds one slot. A user may hold at most
+ADMISSION_PER_USER slots; a request past that is rejected with 429 right
+away (plus ADMISSION_PER_USER_QUEUE requests allowed to wait, default 0),
+because a waiting request still occupies a whole sync worker. When the
+server as a whole is full, requests wait in a queue that is served
+round-robin by user, so one user looping on huge pastes cannot starve the
+others. Waits are bounded, and when the queue is full the request is shed
+with a "busy, retry in N s" answer. With sync workers there is no queue by
+default: a waiting request would hold the spare worker the cap keeps free.
+
+State lives in shared memory created when main.py is imported. With
+gunicorn's preload_app that happens in the master, so all forked workers
+share one table and the limits apply to the whole server. The table lock
+is only held for a scan and taken with a timeout; waiters poll instead of
+sleeping on a shared condition, which a killed waiter could wedge. The
+master's child_exit hook releases slots of workers that died mid-request,
+and the table lock if one died holding it.
+"""
+
+import os
+import math
+import time
+import zlib
+import logging
+import multiprocessing
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Entry fields in the shared table (_EXPIRES: CLOCK_MONOTONIC ms, same in every process)
+_PID, _USER, _STATE, _TICKET, _EXPIRES = range(5)
+_FIELDS = 5
+_FREE, _WAITING, _RUNNING = 0, 1, 2
+
+# Longest wait for the table lock; it is normally held for microseconds
+LOCK_TIMEOUT = 2.0
+# How often a waiting request checks whether it is next in line
+POLL_INTERVAL = 0.02
+
+# Counters in the shared stats array
+_COUNTERS = ("admitted", "queued", "rejected_user", "rejected_busy", "timed_out")
+
+
+class AdmissionRejected(Exception):
+    """Request was not admitted"""
+
+    def __init__(self, reason: str, retry_after: int):
+        """
+        Args:
+            reason: "user" (per-user queue full) or "busy" (server saturated / wait timed out)
+            retry_after: Suggested wait in seconds before retrying
+        """
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _now_ms() -> int:
+    return int(time.monotonic() * 1000)
+
+
+def user_key(username: str) -> int:
+    """Stable non-zero integer key for a username (shared memory holds ints only)"""
+    return (zlib.crc32(username.lower().encode("utf-8")) & 0x7FFFFFFF) or 1
+
+
+class AdmissionController:
+    """Cross-process slot table with per-user caps and round-robin wait queue"""
+
+    def __init__(self, max_inflight: int = 8, per_user: int = 2, per_user_queue: int = 0,
+                 max_queue: int = 32, max_wait: float = 20.0):
+        """
+        Initialize admission controller (before forking workers)
+
+        Args:
+            max_inflight: Requests running at once across all workers
+            per_user: Requests running at once per user
+            per_user_queue: Requests a user may have waiting once at the per-user cap; more are rejected
+            max_queue: Total waiting requests; more are shed as busy
+            max_wait: Seconds a request may wait for a slot
+        """
+        self.max_inflight = max(1, max_inflight)
+        self.per_user = max(1, per_user)
+        self.per_user_queue = max(0, per_user_queue)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+
+        self._size = self.max_inflight + self.max_queue
+        self._lock = multiprocessing.Lock()
+        # pid of the process holding _lock, so child_exit can free it after a crash
+        self._holder = multiprocessing.RawValue("i", 0)
+        self._entries = multiprocessing.RawArray("q", self._size * _FIELDS)
+        self._counters = multiprocessing.RawArray("q", len(_COUNTERS))
+        # next ticket, last served user key
+        self._cursor = multiprocessing.RawArray("q", 2)
+        # EWMA of request duration in ms, for Retry-After estimates
+        self._avg_ms = multiprocessing.RawValue("d", 0.0)
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """
+        Build controller from environment variables
+
+        Returns:
+            AdmissionController: Configured controller
+        """
+        # Same default as gunicorn_config.py; keep one worker free for other routes
+        workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+        threads = int(os.getenv("GUNICORN_THREADS", 1))
+        # A sync worker waiting in the queue is the spare one: shed instead of queuing
+        default_queue = 32 if threads > 1 else 0
+        return cls(
+            max_inflight=int(os.getenv("ADMISSION_MAX_INFLIGHT", max(1, workers * threads - 1))),
+            per_user=int(os.getenv("ADMISSION_PER_USER", 2)),
+            per_user_queue=int(os.getenv("ADMISSION_PER_USER_QUEUE", 0)),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", default_queue)),
+            max_wait=float(os.getenv("ADMISSION_MAX_WAIT", 20)),
+        )
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """
+        Hold the table lock
+
+        Raises:
+            AdmissionRejected: Lock not acquired within LOCK_TIMEOUT
+        """
+        if not self._lock.acquire(timeout=LOCK_TIMEOUT):
+            logger.error("Admission table lock not acquired within %.0f s (held by pid %d)",
+                         LOCK_TIMEOUT, self._holder.value)
+            raise AdmissionRejected("busy", 1)
+        self._holder.value = os.getpid()
+        try:
+            yield
+        finally:
+            self._holder.value = 0
+            self._lock.release()
+
+    # --- table helpers (call with the lock held) ---
+
+    def _get(self, index: int, field: int) -> int:
+        return self._entries[index * _FIELDS + field]
+
+    def _set(self, index: int, pid: int, user: int, state: int, ticket: int, expires: int = 0) -> None:
+        base = index * _FIELDS
+        self._entries[base:base + _FIELDS] = [pid, user, state, ticket, expires]
+
+    def _count(self, state: int, user: Optional[int] = None) -> int:
+        return sum(1 for i in range(self._size)
+                   if self._get(i, _STATE) == state and (user is None or self._get(i, _USER) == user))
+
+    def _next_in_line(self) -> Optional[int]:
+        """
+        Entry that should be admitted next, or None
+
+        Users whose running count is below the per-user cap are served
+        round-robin after the last served user; within a user, FIFO.
+        """
+        if self._count(_RUNNING) >= self.max_inflight:
+            return None
+        last = self._cursor[1]
+        best = None
+        best_order = None
+        now = _now_ms()
+        for i in range(self._size):
+            if self._get(i, _STATE) != _WAITING:
+                continue
+            if self._get(i, _EXPIRES) < now:
+                # Its request gave up without clearing it (lock timeout); don't let it block the line
+                self._set(i, 0, 0, _FREE, 0)
+                continue
+            user = self._get(i, _USER)
+            if self._count(_RUNNING, user) >= self.per_user:
+                continue
+            # Users after the last served one come first, then wrap around
+            order = (user <= last, user, self._get(i, _TICKET))
+            if best_order is None or order < best_order:
+                best, best_order = i, order
+        return best
+
+    def _retry_after(self) -> int:
+        """Seconds until a slot is likely free, from queue depth and average duration"""
+        avg_s = (self._avg_ms.value or 5000.0) / 1000
+        depth = self._count(_WAITING) + 1
+        return max(1, math.ceil(avg_s * depth / self.max_inflight))
+
+    def _bump(self, counter: str) -> None:
+        self._counters[_COUNTERS.index(counter)] += 1
+
+    # --- public API ---
+
+    def acquire(self, username: str) -> int:
+        """
+        Wait for a slot
+
+        Args:
+            username: User the request belongs to
+
+        Returns:
+            int: Slot token for release()
+
+        Raises:
+            AdmissionRejected: User at their cap, queue full, max wait exceeded
+                or table lock not acquired
+        """
+        user = user_key(username)
+        with self._locked():
+            free = next((i for i in range(self._size) if self._get(i, _STATE) == _FREE), None)
+            if self._count(_RUNNING, user) + self._count(_WAITING, user) >= self.per_user + self.per_user_queue:
+                self._bump("rejected_user")
+                raise AdmissionRejected("user", self._retry_after())
+            if free is None:
+                self._bump("rejected_busy")
+                raise AdmissionRejected("busy", self._retry_after())
+
+            ticket = self._cursor[0]
+            self._cursor[0] = ticket + 1
+            deadline = time.monotonic() + self.max_wait
+            # Expires a little after our own deadline, in case we never come back to clear it
+            self._set(free, os.getpid(), user, _WAITING, ticket, _now_ms() + int((self.max_wait + 5) * 1000))
+            if self._admit(free, user, ticket):
+                return free
+            # Has to wait: only if the queue (ours included) has room
+            if self._count(_WAITING) > self.max_queue:
+                self._set(free, 0, 0, _FREE, 0)
+                self._bump("rejected_busy")
+                raise AdmissionRejected("busy", self._retry_after())
+            self._bump("queued")
+
+        while True:
+            time.sleep(min(POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+            with self._locked():
+                if self._admit(free, user, ticket):
+                    return free
+                if time.monotonic() >= deadline:
+                    self._set(free, 0, 0, _FREE, 0)
+                    self._bump("timed_out")
+                    raise AdmissionRejected("busy", self._retry_after())
+
+    def _admit(self, index: int, user: int, ticket: int) -> bool:
+        """Turn our waiting entry into a running one if it is next in line (lock held)"""
+        if self._get(index, _STATE) != _WAITING or self._get(index, _TICKET) != ticket:
+            # Expired (and maybe reused) while we could not get the lock
+            raise AdmissionRejected("busy", self._retry_after())
+        if self._next_in_line() != index:
+            return False
+        self._set(index, os.getpid(), user, _RUNNING, ticket)
+        self._cursor[1] = user
+        self._bump("admitted")
+        return True
+
+    def release(self, token: int, duration_ms: Optional[float] = None) -> None:
+        """
+        Free a slot
+
+        Args:
+            token: Value returned by acquire()
+            duration_ms: Time the request held the slot (updates Retry-After estimate)
+        """
+        try:
+            with self._locked():
+                if self._get(token, _PID) == os.getpid():
+                    self._set(token, 0, 0, _FREE, 0)
+                if duration_ms is not None:
+                    avg = self._avg_ms.value
+                    self._avg_ms.value = duration_ms if avg == 0 else 0.8 * avg + 0.2 * duration_ms
+        except AdmissionRejected:
+            # Lock wedged; child_exit frees the slot when this worker exits
+            logger.error("Could not release admission slot %d", token)
+
+    def release_pid(self, pid: int) -> int:
+        """
+        Free all slots held by a process (call when a worker dies)
+
+        Args:
+            pid: Worker process id
+
+        Returns:
+            int: Number of slots freed
+        """
+        if pid and self._holder.value == pid:
+            # Died inside the critical section; nobody else can ever release the lock
+            logger.error("Worker %d exited holding the admission lock, releasing it", pid)
+            self._holder.value = 0
+            self._lock.release()
+        freed = 0
+        with self._locked():
+            for i in range(self._size):
+                if self._get(i, _STATE) != _FREE and self._get(i, _PID) == pid:
+                    self._set(i, 0, 0, _FREE, 0)
+                    freed += 1
+        return freed
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Current queue state and counters since start
+
+        Returns:
+            dict: Limits, running/waiting counts, counters, avg duration and Retry-After
+        """
+        with self._locked():
+            return {
+                "limits": {
+                    "max_inflight": self.max_inflight,
+                    "per_user": self.per_user,
+                    "per_user_queue": self.per_user_queue,
+                    "max_queue": self.max_queue,
+                    "max_wait": self.max_wait,
+                },
+                "running": self._count(_RUNNING),
+                "waiting": self._count(_WAITING),
+                "counters": dict(zip(_COUNTERS, self._counters)),
+                "avg_request_ms": round(self._avg_ms.value, 1),
+                "retry_after": self._retry_after(),
+            }
+
+
+# Global singleton instance
+_admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """
+    Get global admission controller instance (singleton)
+
+    Returns:
+        AdmissionController: Global controller configured from environment
+    """
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController.from_env()
+    return _admission_controller
+
+
+def release_worker_slots(pid: int) -> None:
+    """
+    Free slots of a dead worker (gunicorn child_exit hook, runs in the master)
+
+    No-op if the controller was not created before forking.
+    """
+    if _admission_controller is not None:
+        freed = _admission_controller.release_pid(pid)
+        if freed:
+            logger.warning("Released %d admission slots of exited worker %d", freed, pid)
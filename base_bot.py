@@ -5,7 +5,53 @@ Abstract class defining common interface for all AI bots
 """
 
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from dataclasses import dataclass, asdict
+from typing import List, Dict, Any, Optional
+
+
+@dataclass
+class ChatResult:
+    """Response text plus upstream usage and timing for one completion"""
+    text: str
+    model: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    total_tokens: Optional[int] = None
+    upstream_ms: Optional[float] = None
+    ok: bool = True
+    
+    @classmethod
+    def from_usage(cls, text: str, model: str, usage: Optional[Dict[str, Any]], upstream_ms: float) -> "ChatResult":
+        """
+        Build result from an OpenAI-style "usage" block
+        
+        Args:
+            text: Response text
+            model: Model that served the request
+            usage: Dict with prompt_tokens/completion_tokens/total_tokens (may be None)
+            upstream_ms: Time spent waiting for the provider
+            
+        Returns:
+            ChatResult: Structured result
+        """
+        usage = usage or {}
+        return cls(
+            text=text,
+            model=model,
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            total_tokens=usage.get("total_tokens"),
+            upstream_ms=round(upstream_ms, 1),
+        )
+    
+    @classmethod
+    def error(cls, text: str, model: Optional[str] = None, upstream_ms: Optional[float] = None) -> "ChatResult":
+        """Failed request; text is the user-facing error message"""
+        return cls(text=text, model=model, upstream_ms=round(upstream_ms, 1) if upstream_ms else None, ok=False)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain dict (for JSON output)"""
+        return asdict(self)
 
 
 class BaseBot(ABC):
@@ -32,6 +78,25 @@ class BaseBot(ABC):
         pass
     
     @abstractmethod
+    def chat_complete_result(self, messages: List[Dict[str, str]], model: str = None,
+                             cancel=None) -> ChatResult:
+        """
+        Send chat completion request
+        
+        Args:
+            messages: List of message dicts with 'role' and 'content'
+            model: Optional model name override
+            cancel: Optional cancellation.CancelToken; when given the completion
+                is streamed and the upstream request is closed once it is cancelled
+            
+        Returns:
+            ChatResult: Response text with token usage and upstream timing
+            
+        Raises:
+            RequestCancelled: If cancel was set before the completion finished
+        """
+        pass
+    
     def chat_complete(self, messages: List[Dict[str, str]], model: str = None) -> str:
         """
         Send chat completion request
@@ -43,6 +108,16 @@ class BaseBot(ABC):
         Returns:
             str: Bot's response text
         """
+        return self.chat_complete_result(messages, model).text
+    
+    def reset_connections(self) -> None:
+        """
+        Drop per-process network clients (HTTP pools, SDK clients)
+
+        Called after gunicorn forks a worker so connections opened in the
+        master are never shared. Bots create clients lazily on first use,
+        so the default implementation has nothing to do.
+        """
         pass
     
     @property
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Batch Runner
+Runs many prompts through BotManager with per-provider concurrency limits
+Results are streamed to JSONL as they complete; reruns skip finished items
+
+/chat/batch runs a batch as a background job in the worker process and
+keeps its progress in <batch>.status.json next to the results. The job
+holds an exclusive lock on the results file while it runs, so a second
+run of the same batch is refused, and a "running" status whose lock is
+free means the process died (worker restart) and the batch can be resumed.
+
+Input (one JSON object per line):
+    {"id": "review-1", "message": "Review this function ...", "ai_model": "mistral"}
+    "id" defaults to the line number, "ai_model" to --bot, optional "system" and "model"
+
+Usage:
+    python batch_runner.py prompts.jsonl -o results.jsonl --limits mistral=4,github-copilot=2
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from base_bot import ChatResult
+from bot_manager import BotManager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYSTEM_PROMPT = "You are a helpful coding assistant. Use fenced code blocks with the language name for code."
+
+# Requests in flight per provider (per process)
+DEFAULT_LIMITS = {"mistral": 4, "github-copilot": 2}
+
+
+class BatchBusy(Exception):
+    """Another run is already writing the same results file"""
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """Parse "mistral=4,github-copilot=2" into a dict"""
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        bot_id, value = part.split("=")
+        limits[bot_id.strip()] = max(1, int(value))
+    return limits
+
+
+def load_items(lines: Iterable[str], default_bot: str) -> List[dict]:
+    """
+    Parse JSONL batch input
+
+    Args:
+        lines: Input lines
+        default_bot: Bot id for items without "ai_model"
+
+    Returns:
+        list: Items with "id", "message" and "ai_model" set
+
+    Raises:
+        ValueError: On invalid JSON, missing message or duplicate id
+    """
+    items = []
+    seen = set()
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Line {number}: invalid JSON ({e})")
+        if not isinstance(item, dict) or not item.get("message"):
+            raise ValueError(f"Line {number}: expected an object with a 'message'")
+
+        item["id"] = str(item.get("id", number))
+        item.setdefault("ai_model", default_bot)
+        if item["id"] in seen:
+            raise ValueError(f"Line {number}: duplicate id '{item['id']}'")
+        seen.add(item["id"])
+        items.append(item)
+    return items
+
+
+def load_finished_ids(path: str) -> Set[str]:
+    """
+    Read ids of successfully completed items from a results file
+
+    Failed items are not included, so a rerun retries them.
+    """
+    finished = set()
+    if not os.path.exists(path):
+        return finished
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # Partial last line from an interrupted run
+                continue
+            if result.get("ok") and "id" in result:
+                finished.add(result["id"])
+    return finished
+
+
+def status_path(results_path: str) -> str:
+    """batches/alice/<id>.jsonl -> batches/alice/<id>.status.json"""
+    return os.path.splitext(results_path)[0] + ".status.json"
+
+
+def _is_locked(path: str) -> bool:
+    """True if a ResultWriter (in any process) holds path open"""
+    try:
+        fh = open(path, "a", encoding="utf-8")
+    except OSError:
+        return False
+    with fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(fh, fcntl.LOCK_UN)
+        return False
+
+
+def write_status(results_path: str, status: dict) -> None:
+    """Replace the status file atomically, so readers never see a partial one"""
+    path = status_path(results_path)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(status, fh)
+    os.replace(tmp, path)
+
+
+def read_status(results_path: str) -> Optional[dict]:
+    """
+    Progress of a background batch
+
+    Args:
+        results_path: JSONL results file of the batch
+
+    Returns:
+        dict: batch_id, state ("running", "finished" or "interrupted"), total,
+              skipped, ok, failed, started, updated; None if never started
+    """
+    try:
+        with open(status_path(results_path), encoding="utf-8") as fh:
+            status = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if status.get("state") == "running" and not _is_locked(results_path):
+        # The process running it exited (worker restart, crash) - its lock went with it
+        status["state"] = "interrupted"
+    return status
+
+
+class ResultWriter:
+    """Thread-safe JSONL appender that flushes every line and locks the file while open"""
+
+    def __init__(self, path: str):
+        """
+        Open path for appending
+
+        Raises:
+            BatchBusy: Another ResultWriter holds the same file
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._fh = open(path, "a", encoding="utf-8")
+        try:
+            fcntl.flock(self._fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._fh.close()
+            raise BatchBusy(path)
+        self._lock = threading.Lock()
+
+    def write(self, result: dict) -> None:
+        line = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            self._fh.write(line + "\n")
+            self._fh.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._fh.close()
+
+
+class BatchRunner:
+    """Fans batch items out to bots, one bounded thread pool per provider shared by all batches"""
+
+    def __init__(self, manager: BotManager, limits: Optional[Dict[str, int]] = None):
+        """
+        Initialize batch runner
+
+        Args:
+            manager: Bot manager used for completions
+            limits: Max concurrent requests per bot id (defaults to DEFAULT_LIMITS, 1 for others)
+        """
+        self.manager = manager
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self._lock = threading.Lock()
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._pid = os.getpid()
+
+    def _executor(self, bot_id: str) -> ThreadPoolExecutor:
+        """Thread pool for bot_id, created on first use in this process"""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Inherited through fork: the pool threads stayed in the parent
+                self._executors = {}
+                self._pid = os.getpid()
+            executor = self._executors.get(bot_id)
+            if executor is None:
+                executor = self._executors[bot_id] = ThreadPoolExecutor(
+                    max_workers=self.limits.get(bot_id, 1), thread_name_prefix=f"batch-{bot_id}"
+                )
+            return executor
+
+    def _run_item(self, item: dict) -> dict:
+        """Complete one item; never raises"""
+        started = time.perf_counter()
+        messages = [
+            {"role": "system", "content": item.get("system") or DEFAULT_SYSTEM_PROMPT},
+            {"role": "user", "content": item["message"]},
+        ]
+        try:
+            result = self.manager.chat_result(bot_id=item["ai_model"], messages=messages, model=item.get("model"))
+        except Exception as e:
+            result = ChatResult.error(str(e))
+
+        return {
+            "id": item["id"],
+            "ai_model": item["ai_model"],
+            "ok": result.ok,
+            "response": result.text if result.ok else None,
+            "error": None if result.ok else result.text,
+            "model": result.model,
+            "prompt_tokens": result.prompt_tokens,
+            "completion_tokens": result.completion_tokens,
+            "total_tokens": result.total_tokens,
+            "upstream_ms": result.upstream_ms,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    def iter_results(self, items: List[dict], skip_ids: Optional[Set[str]] = None) -> Iterator[dict]:
+        """
+        Run items concurrently and yield results in completion order
+
+        Args:
+            items: Parsed batch items
+            skip_ids: Ids already completed in a previous run
+
+        Yields:
+            dict: Result per item (id, ai_model, ok, response, error, token usage, duration_ms)
+        """
+        skip_ids = skip_ids or set()
+        futures = [self._executor(item["ai_model"]).submit(self._run_item, item)
+                   for item in items if item["id"] not in skip_ids]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # Reached early when the consumer stops; the pools are shared, so only drop our queued items
+            for future in futures:
+                future.cancel()
+
+    def run_to_file(self, items: List[dict], output_path: str, progress=None) -> Dict[str, int]:
+        """
+        Run a batch, appending results to output_path and resuming from it
+
+        Args:
+            items: Parsed batch items
+            output_path: JSONL results file (created or appended)
+            progress: Optional callback(result, done, total)
+
+        Returns:
+            dict: Counts (total, skipped, ok, failed)
+
+        Raises:
+            BatchBusy: The results file is being written by another run
+        """
+        writer = ResultWriter(output_path)
+        finished = load_finished_ids(output_path)
+        skipped = sum(1 for item in items if item["id"] in finished)
+        counts = {"total": len(items), "skipped": skipped, "ok": 0, "failed": 0}
+
+        try:
+            for result in self.iter_results(items, finished):
+                writer.write(result)
+                counts["ok" if result["ok"] else "failed"] += 1
+                if progress:
+                    progress(result, skipped + counts["ok"] + counts["failed"], len(items))
+        finally:
+            writer.close()
+        return counts
+
+    def start(self, batch_id: str, items: List[dict], results_path: str,
+              on_result: Optional[Callable[[dict], None]] = None) -> dict:
+        """
+        Run a batch in a background thread of this process
+
+        Progress goes to the status file (read_status()), results are
+        appended to results_path. Items already finished there are skipped.
+
+        Args:
+            batch_id: Id reported in the status
+            items: Parsed batch items
+            results_path: JSONL results file (created or appended)
+            on_result: Optional callback(result), called in the job thread
+
+        Returns:
+            dict: Initial status
+
+        Raises:
+            BatchBusy: The batch is already running
+        """
+        writer = ResultWriter(results_path)
+        try:
+            finished = load_finished_ids(results_path)
+            now = time.time()
+            status = {
+                "batch_id": batch_id, "state": "running", "total": len(items),
+                "skipped": sum(1 for item in items if item["id"] in finished),
+                "ok": 0, "failed": 0, "started": now, "updated": now,
+            }
+            write_status(results_path, status)
+        except BaseException:
+            writer.close()
+            raise
+
+        def job():
+            state = "interrupted"
+            try:
+                for result in self.iter_results(items, finished):
+                    writer.write(result)
+                    status["ok" if result["ok"] else "failed"] += 1
+                    status["updated"] = time.time()
+                    write_status(results_path, status)
+                    if on_result:
+                        on_result(result)
+                state = "finished"
+            except Exception:
+                logger.exception("Batch %s stopped", batch_id)
+            finally:
+                status["state"] = state
+                status["updated"] = time.time()
+                write_status(results_path, status)
+                writer.close()
+                logger.info("Batch %s %s: %d ok, %d failed", batch_id, state, status["ok"], status["failed"])
+
+        # Daemon: a worker that exits mid-batch drops it (status then reads "interrupted")
+        threading.Thread(target=job, name=f"batch-{batch_id}", daemon=True).start()
+        return dict(status)
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Run a JSONL batch of prompts through the bots")
+    parser.add_argument("input", help="JSONL input file ('-' for stdin)")
+    parser.add_argument("-o", "--output", required=True, help="JSONL results file (reruns resume it)")
+    parser.add_argument("--bot", default="mistral", help="bot id for items without ai_model")
+    parser.add_argument("--limits", default="", help="per-bot concurrency, e.g. mistral=4,github-copilot=2")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from bot_manager import get_bot_manager
+    load_dotenv()
+
+    try:
+        if args.input == "-":
+            items = load_items(sys.stdin, args.bot)
+        else:
+            with open(args.input, encoding="utf-8") as fh:
+                items = load_items(fh, args.bot)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    manager = get_bot_manager()
+    unknown = sorted({item["ai_model"] for item in items} - set(manager.bots))
+    if unknown:
+        print(f"❌ Bots not available: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+
+    runner = BatchRunner(manager, parse_limits(args.limits))
+    started = time.time()
+
+    def progress(result, done, total):
+        mark = "✓" if result["ok"] else "✗"
+        print(f"[{done}/{total}] {mark} {result['id']} ({result['duration_ms']:.0f} ms)", file=sys.stderr)
+
+    try:
+        counts = runner.run_to_file(items, args.output, progress)
+    except BatchBusy:
+        print(f"❌ {args.output} is being written by another run", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print("\nInterrupted - rerun the same command to resume.", file=sys.stderr)
+        return 130
+
+    print(f"\nDone in {time.time() - started:.1f}s: {counts['ok']} ok, {counts['failed']} failed, "
+          f"{counts['skipped']} skipped (already finished)", file=sys.stderr)
+    return 0 if counts["failed"] == 0 else 2
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Import Time Report
+Measures how long `import main` takes (module imports + app initialization)
+using python -X importtime, and lists the most expensive imports
+
+Usage:
+    python benchmarks/import_time.py --runs 5 --top 15
+    python benchmarks/import_time.py --json > before.json
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module: str, env: Dict[str, str]) -> Dict[str, dict]:
+    """
+    Import module once in a fresh interpreter
+
+    Returns:
+        dict: module name -> {"self_us", "cumulative_us", "depth"}
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        # "import time:       123 |        456 |   package.module"
+        self_part, cumulative, name = line[len("import time:"):].split("|", 2)
+        self_us = int(self_part)
+        name = name[1:]  # single separator space, the rest is nesting indent
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        modules[name.strip()] = {"self_us": self_us, "cumulative_us": int(cumulative), "depth": depth}
+    return modules
+
+
+def report(module: str, runs: int) -> dict:
+    """
+    Measure several runs and keep the median per imported module
+
+    Returns:
+        dict: {"module", "runs", "total_ms", "imports": [{name, cumulative_ms, self_ms}]}
+    """
+    env = dict(os.environ)
+    # main.py refuses to start without an LDAP host or any bot credentials
+    env.setdefault("LDAP_HOST", "localhost")
+    env.setdefault("LDAP_BASE_DN", "DC=example,DC=local")
+    if not env.get("MISTRAL_API_KEY") and not env.get("GITHUB_TOKEN"):
+        env["MISTRAL_API_KEY"] = "import-time-report"
+
+    samples: List[Dict[str, dict]] = [measure(module, env) for _ in range(runs)]
+    names = set().union(*(s.keys() for s in samples))
+
+    imports = []
+    for name in names:
+        cumulative = [s[name]["cumulative_us"] for s in samples if name in s]
+        own = [s[name]["self_us"] for s in samples if name in s]
+        depth = min(s[name]["depth"] for s in samples if name in s)
+        imports.append({
+            "name": name,
+            "depth": depth,
+            "cumulative_ms": round(statistics.median(cumulative) / 1000, 2),
+            "self_ms": round(statistics.median(own) / 1000, 2),
+        })
+    imports.sort(key=lambda i: i["cumulative_ms"], reverse=True)
+
+    total = next((i["cumulative_ms"] for i in imports if i["name"] == module), 0.0)
+    return {"module": module, "runs": runs, "total_ms": total, "imports": imports}
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Measure import/initialization time")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    args = parser.parse_args()
+
+    result = report(args.module, args.runs)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+
+    print(f"import {result['module']}: {result['total_ms']:.1f} ms (median of {result['runs']} runs)\n")
+    print(f"  {'cumulative':>11} {'self':>9}  module")
+    # Direct children of the measured module show where the time goes
+    top = [i for i in result["imports"] if i["depth"] <= 1][:args.top]
+    for item in top:
+        print(f"  {item['cumulative_ms']:>9.1f}ms {item['self_ms']:>7.1f}ms  {item['name']}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
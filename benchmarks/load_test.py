@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Load Test Harness
+Drives /chat, /upload and /history through the real gunicorn_config.py
+against a local stub LLM server and writes a JSON latency/throughput report
+
+Usage:
+    python benchmarks/load_test.py run --stages 5:20,20:30 --mix chat=6,history=3,upload=1
+    python benchmarks/load_test.py compare old.json new.json
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import random
+import secrets
+import argparse
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List, Tuple
+
+import requests
+
+from stub_llm_server import start_server, add_stub_arguments, stub_config_from_args
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+# Smallest valid PNG (1x1 transparent pixel)
+TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d00000000"
+    "49454e44ae426082"
+)
+
+ENDPOINTS = ("chat", "history", "upload")
+
+
+def parse_stages(spec: str) -> List[Tuple[int, float]]:
+    """
+    Parse concurrency profile "5:20,20:30" into [(5, 20.0), (20, 30.0)]
+
+    Each stage is <concurrent clients>:<duration seconds>.
+    """
+    stages = []
+    for part in spec.split(","):
+        clients, duration = part.split(":")
+        stages.append((int(clients), float(duration)))
+    return stages
+
+
+def parse_mix(spec: str) -> Dict[str, int]:
+    """Parse endpoint weights "chat=6,history=3,upload=1" """
+    mix = {}
+    for part in spec.split(","):
+        name, weight = part.split("=")
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}'. Choose from: {', '.join(ENDPOINTS)}")
+        mix[name] = int(weight)
+    return mix
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples: List[Tuple[str, int, float, bool]], duration: float) -> Dict[str, dict]:
+    """
+    Aggregate samples into per-endpoint stats
+
+    Args:
+        samples: (endpoint, http status, latency seconds, ok) tuples
+        duration: Wall-clock seconds the samples were collected over
+
+    Returns:
+        dict: endpoint -> stats, plus an "all" entry
+    """
+    groups: Dict[str, List[Tuple[str, int, float, bool]]] = {"all": samples}
+    for sample in samples:
+        groups.setdefault(sample[0], []).append(sample)
+
+    result = {}
+    for name, group in groups.items():
+        latencies = sorted(s[2] * 1000 for s in group)
+        errors = sum(1 for s in group if not s[3])
+        statuses: Dict[str, int] = {}
+        for s in group:
+            statuses[str(s[1])] = statuses.get(str(s[1]), 0) + 1
+        result[name] = {
+            "requests": len(group),
+            "errors": errors,
+            "error_rate": round(errors / len(group), 4) if group else 0.0,
+            "throughput_rps": round(len(group) / duration, 3) if duration else 0.0,
+            "latency_ms": {
+                "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+                "p50": round(percentile(latencies, 50), 2),
+                "p95": round(percentile(latencies, 95), 2),
+                "p99": round(percentile(latencies, 99), 2),
+                "max": round(latencies[-1], 2) if latencies else 0.0,
+            },
+            "status_codes": statuses,
+        }
+    return result
+
+
+def session_cookie(secret_key: str, user_dn: str) -> str:
+    """
+    Build a signed Flask-Login session cookie for a synthetic user
+
+    The benchmark has no LDAP server, so it signs the session with the
+    SECRET_KEY it passes to gunicorn instead of going through /login.
+    """
+    from flask import Flask
+    from flask.sessions import SecureCookieSessionInterface
+
+    app = Flask("load_test")
+    app.secret_key = secret_key
+    serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+    return serializer.dumps({"_user_id": user_dn, "_fresh": True})
+
+
+def free_port() -> int:
+    """Ask the OS for an unused TCP port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_app(base_url: str, proc: subprocess.Popen, timeout: float = 60.0) -> None:
+    """Block until gunicorn answers /login or raise"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {proc.returncode} (see logs/gunicorn-error.log)")
+        try:
+            if requests.get(f"{base_url}/login", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"App did not come up within {timeout:.0f}s")
+
+
+class VirtualUser(threading.Thread):
+    """One client looping over weighted endpoints until the stage ends"""
+
+    def __init__(self, index: int, base_url: str, cookie: str, mix: Dict[str, int],
+                 bot_id: str, message: str, stop_at: float, samples: list, lock: threading.Lock):
+        super().__init__(name=f"vu-{index}", daemon=True)
+        self.index = index
+        self.base_url = base_url
+        self.mix_names = list(mix.keys())
+        self.mix_weights = list(mix.values())
+        self.bot_id = bot_id
+        self.message = message
+        self.stop_at = stop_at
+        self.samples = samples
+        self.lock = lock
+        self.session = requests.Session()
+        self.session.cookies.set("session", cookie)
+        self.rng = random.Random(index)
+
+    def _request(self, endpoint: str) -> requests.Response:
+        if endpoint == "chat":
+            return self.session.post(f"{self.base_url}/chat", json={
+                "message": f"{self.message} (#{self.rng.randint(0, 1_000_000)})",
+                "ai_model": self.bot_id,
+            }, timeout=300)
+        if endpoint == "upload":
+            name = f"bench-{self.index}-{self.rng.randint(0, 1_000_000)}.png"
+            return self.session.post(f"{self.base_url}/upload",
+                                     files={"screendump": (name, TINY_PNG, "image/png")}, timeout=120)
+        return self.session.get(f"{self.base_url}/history", timeout=60)
+
+    def run(self):
+        while time.time() < self.stop_at:
+            endpoint = self.rng.choices(self.mix_names, weights=self.mix_weights)[0]
+            started = time.perf_counter()
+            try:
+                response = self._request(endpoint)
+                status = response.status_code
+                ok = status == 200 and "❌" not in response.text
+            except requests.RequestException:
+                status, ok = 0, False
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.samples.append((endpoint, status, elapsed, ok))
+
+
+def run_stage(base_url: str, secret_key: str, clients: int, duration: float,
+              mix: Dict[str, int], bot_id: str, message: str) -> Dict[str, dict]:
+    """Run one concurrency stage and return its summary"""
+    samples: list = []
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+    users = [
+        VirtualUser(i, base_url, session_cookie(secret_key, f"CN=bench{i},CN=Users,DC=bench,DC=local"),
+                    mix, bot_id, message, stop_at, samples, lock)
+        for i in range(clients)
+    ]
+    started = time.perf_counter()
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    return summarize(samples, time.perf_counter() - started)
+
+
+def git_revision() -> str:
+    """Current commit hash, or 'unknown' outside a git checkout"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_summary(stats: Dict[str, dict], title: str) -> None:
+    """Print a compact latency table"""
+    print(f"\n{title}")
+    print(f"  {'endpoint':<10} {'reqs':>6} {'err%':>6} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name in ("all",) + ENDPOINTS:
+        if name not in stats:
+            continue
+        s = stats[name]
+        lat = s["latency_ms"]
+        print(f"  {name:<10} {s['requests']:>6} {s['error_rate'] * 100:>5.1f}% {s['throughput_rps']:>8.2f} "
+              f"{lat['p50']:>7.1f}ms {lat['p95']:>7.1f}ms {lat['p99']:>7.1f}ms")
+
+
+def cmd_run(args: argparse.Namespace) -> int:
+    """Start stub + gunicorn, drive the load profile, write the report"""
+    stages = parse_stages(args.stages)
+    mix = parse_mix(args.mix)
+
+    stub = start_server("127.0.0.1", 0, stub_config_from_args(args))
+    stub_url = f"http://127.0.0.1:{stub.server_address[1]}"
+    port = args.port or free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    secret_key = secrets.token_hex(32)
+    workdir = tempfile.mkdtemp(prefix="azikiai-bench-")
+
+    env = dict(os.environ)
+    env.update({
+        "MISTRAL_API_KEY": "bench",
+        "GITHUB_TOKEN": "bench",
+        "MISTRAL_API_URL": stub_url,
+        "GITHUB_MODELS_URL": stub_url,
+        "SECRET_KEY": secret_key,
+        "LDAP_HOST": env.get("LDAP_HOST") or "localhost",
+        "LDAP_BASE_DN": env.get("LDAP_BASE_DN") or "DC=bench,DC=local",
+        "CHAT_DB_PATH": os.path.join(workdir, "chat_history.db"),
+        "UPLOAD_FOLDER": os.path.join(workdir, "uploads"),
+        "RATELIMIT_ENABLED": "false",
+        "GUNICORN_BIND": f"127.0.0.1:{port}",
+        "GUNICORN_NO_TLS": "true",
+    })
+    if args.workers:
+        env["GUNICORN_WORKERS"] = str(args.workers)
+
+    print(f"Stub LLM server: {stub_url}")
+    print(f"Starting gunicorn on {base_url} (workdir {workdir})")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn_config.py", "main:app"],
+        cwd=REPO_ROOT, env=env,
+        stdout=subprocess.DEVNULL if not args.verbose else None,
+        stderr=subprocess.DEVNULL if not args.verbose else None,
+    )
+
+    message = ("Explain this snippet and suggest improvements: " + "x = compute(y) " * 50)[:args.message_chars]
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_revision": git_revision(),
+            "bot": args.bot,
+            "gunicorn_workers": args.workers or "config default",
+            "mix": mix,
+            "message_chars": len(message),
+            "stub": vars(stub.stub_config),
+        },
+        "stages": [],
+    }
+
+    try:
+        wait_for_app(base_url, proc)
+        if args.warmup > 0:
+            run_stage(base_url, secret_key, 1, args.warmup, mix, args.bot, message)
+
+        for clients, duration in stages:
+            print(f"Stage: {clients} clients for {duration:.0f}s ...")
+            stats = run_stage(base_url, secret_key, clients, duration, mix, args.bot, message)
+            report["stages"].append({"clients": clients, "duration_s": duration, "endpoints": stats})
+            print_summary(stats, f"{clients} clients")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        report["stub_counts"] = stub.stub_state.snapshot()
+        stub.shutdown()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"report-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as fh:
+        json.dump(report, fh, indent=2, sort_keys=True)
+    print(f"\nReport written to {output}")
+    return 0
+
+
+def cmd_compare(args: argparse.Namespace) -> int:
+    """Print per-stage/endpoint deltas between two reports"""
+    with open(args.base) as fh:
+        base = json.load(fh)
+    with open(args.new) as fh:
+        new = json.load(fh)
+
+    print(f"base: {args.base} ({base['meta'].get('git_revision')})")
+    print(f"new:  {args.new} ({new['meta'].get('git_revision')})")
+    base_stages = {s["clients"]: s for s in base["stages"]}
+    for stage in new["stages"]:
+        old = base_stages.get(stage["clients"])
+        if not old:
+            continue
+        print(f"\n{stage['clients']} clients")
+        print(f"  {'endpoint':<10} {'rps':>18} {'p50':>22} {'p95':>22} {'p99':>22}")
+        for name, stats in stage["endpoints"].items():
+            before = old["endpoints"].get(name)
+            if not before:
+                continue
+            cols = [_delta(before["throughput_rps"], stats["throughput_rps"])]
+            cols += [_delta(before["latency_ms"][p], stats["latency_ms"][p]) for p in ("p50", "p95", "p99")]
+            print(f"  {name:<10} {cols[0]:>18} {cols[1]:>22} {cols[2]:>22} {cols[3]:>22}")
+    return 0
+
+
+def _delta(before: float, after: float) -> str:
+    """Format 'after (+x%)' for the compare table"""
+    if not before:
+        return f"{after:.1f}"
+    return f"{after:.1f} ({(after - before) / before * 100:+.1f}%)"
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="AzikiAI load test harness")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run a load test against a local gunicorn")
+    run.add_argument("--stages", default="1:10,5:20,20:30",
+                     help="concurrency profile <clients>:<seconds>[,...]")
+    run.add_argument("--mix", default="chat=6,history=3,upload=1", help="endpoint weights")
+    run.add_argument("--bot", default="mistral", choices=["mistral", "github-copilot"])
+    run.add_argument("--workers", type=int, default=0, help="gunicorn workers (0 = config default)")
+    run.add_argument("--port", type=int, default=0, help="app port (0 = pick a free port)")
+    run.add_argument("--message-chars", type=int, default=400)
+    run.add_argument("--warmup", type=float, default=3.0, help="single-client warmup seconds")
+    run.add_argument("--output", help="report path (default benchmarks/results/report-<ts>.json)")
+    run.add_argument("--verbose", action="store_true", help="show gunicorn output")
+    add_stub_arguments(run)
+    run.set_defaults(func=cmd_run)
+
+    compare = sub.add_parser("compare", help="diff two reports")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    exit(main())
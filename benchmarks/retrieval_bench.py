@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Retrieval Benchmark
+Measures top-k similarity search over one user's history for different sizes
+
+Builds a throwaway store with N messages of one user (vectors written like
+the message writer does), then times the first query of a fresh index
+(vectors loaded from SQLite) and warm queries against the worker cache,
+with the k that /chat asks for (RETRIEVAL_TOP_K plus the excluded recent
+messages).
+
+Usage:
+    python benchmarks/retrieval_bench.py --sizes 1000,5000,50000 --queries 200
+    python benchmarks/retrieval_bench.py --json > retrieval.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import statistics
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from chat_store import SQLiteStore
+from retrieval import VectorIndex
+
+USER_DN = "CN=bench,CN=Users,DC=bench,DC=local"
+
+WORDS = ("vlan trunk interface switchport access port channel ospf bgp neighbor route map acl permit deny "
+         "python function class import return list dict loop exception logging thread queue socket "
+         "database index query transaction commit shard cache memory worker gunicorn flask request "
+         "docker image container volume network kubernetes pod service deployment ingress").split()
+
+
+def message(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 60)))
+
+
+def build(path: str, size: int, rng: random.Random) -> SQLiteStore:
+    """Store with size messages of USER_DN, each with its vector"""
+    store = SQLiteStore(path)
+    store.init()
+    index = VectorIndex(store)
+    conn = store.connect(0)
+    with conn:
+        cursor = conn.cursor()
+        for start in range(0, size, 1000):
+            rows = []
+            for _ in range(min(1000, size - start)):
+                content = message(rng)
+                cursor.execute("INSERT INTO messages (role, content, user_dn) VALUES ('user', ?, ?)",
+                               (content, USER_DN))
+                rows.append((cursor.lastrowid, content, USER_DN))
+            index.messages_inserted(cursor, rows)
+    conn.close()
+    return store
+
+
+def run(size: int, queries: int, k: int, workdir: str) -> Dict[str, float]:
+    """
+    Time one history size
+
+    Returns:
+        dict: size, first-query ms (cold cache) and warm p50/p95 ms
+    """
+    rng = random.Random(size)
+    store = build(os.path.join(workdir, f"bench-{size}.db"), size, rng)
+    index = VectorIndex(store)
+    texts = [message(rng) for _ in range(queries)]
+
+    started = time.perf_counter()
+    index.search(USER_DN, texts[0], k)
+    cold_ms = (time.perf_counter() - started) * 1000
+
+    # The first query queued a backfill, after which the cache is reloaded once
+    deadline = time.monotonic() + 30
+    while not index._backfill_queue.empty() or USER_DN not in index._stale:
+        if time.monotonic() > deadline:
+            break
+        time.sleep(0.01)
+    index.search(USER_DN, texts[0], k)
+
+    timings: List[float] = []
+    for text in texts:
+        started = time.perf_counter()
+        index.search(USER_DN, text, k)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "messages": size,
+        "first_query_ms": round(cold_ms, 1),
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 2),
+    }
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Retrieval top-k latency per history size")
+    parser.add_argument("--sizes", default="1000,5000,50000", help="comma-separated message counts")
+    parser.add_argument("--queries", type=int, default=200, help="warm queries per size")
+    parser.add_argument("-k", type=int, default=53, help="results per query (top_k + recent messages)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="retrieval-bench-")
+    try:
+        results = [run(int(n), args.queries, args.k, workdir) for n in args.sizes.split(",")]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({"k": args.k, "queries": args.queries, "results": results}, indent=2))
+        return 0
+
+    print(f"k={args.k}, {args.queries} warm queries per size\n")
+    print(f"{'messages':>9}  {'first query ms':>14}  {'p50 ms':>7}  {'p95 ms':>7}")
+    for r in results:
+        print(f"{r['messages']:>9}  {r['first_query_ms']:>14.1f}  {r['p50_ms']:>7.2f}  {r['p95_ms']:>7.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Shard Write Benchmark
+Measures message write throughput of the chat store for different shard counts
+
+Each writer process plays a set of users and commits one exchange (user
+message + assistant answer + usage row) per transaction, like a gunicorn
+worker flushing for one user. With one shard every commit takes the same
+database lock; with N shards users spread over N files.
+
+Usage:
+    python benchmarks/shard_write_bench.py --shards 1,2,4,8 --writers 8 --seconds 5
+    python benchmarks/shard_write_bench.py --json > shards.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from base_bot import ChatResult
+from chat_store import ShardedSQLiteStore, SQLiteStore
+from usage_store import insert_usage, usage_row
+
+
+def writer(store, users: List[str], seconds: float, start_at: float, result_queue) -> None:
+    """Commit exchanges round-robin over users until the time is up"""
+    conns = {}
+    result = ChatResult(text="", model="stub", prompt_tokens=50, completion_tokens=120, total_tokens=170)
+    exchanges = 0
+    waits = 0.0
+    while time.time() < start_at:
+        time.sleep(0.001)
+    deadline = start_at + seconds
+    while time.time() < deadline:
+        user_dn = users[exchanges % len(users)]
+        shard = store.shard_for(user_dn)
+        conn = conns.get(shard) or conns.setdefault(shard, store.connect(shard))
+        started = time.perf_counter()
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO messages (role, content, provider, user_dn) VALUES (?, ?, ?, ?)",
+            [("user", "How do I configure a trunk port? " * 8, None, user_dn),
+             ("assistant", "Use `switchport mode trunk` on the interface. " * 20, "mistral", user_dn)],
+        )
+        insert_usage(cursor, [usage_row(user_dn.split(",")[0][3:], "chat", "mistral", result, user_dn=user_dn)])
+        conn.commit()
+        waits += time.perf_counter() - started
+        exchanges += 1
+    for conn in conns.values():
+        conn.close()
+    result_queue.put((exchanges, waits))
+
+
+def run(shards: int, writers: int, users: int, seconds: float, workdir: str) -> Dict[str, float]:
+    """
+    Run one configuration against fresh database files
+
+    Returns:
+        dict: shards, exchanges/s, rows/s and mean commit latency
+    """
+    base = os.path.join(workdir, f"bench-{shards}.db")
+    store = SQLiteStore(base) if shards == 1 else ShardedSQLiteStore(shards, base)
+    store.init()
+
+    user_dns = [f"CN=user{i:03d},CN=Users,DC=bench,DC=local" for i in range(users)]
+    queue = multiprocessing.Queue()
+    start_at = time.time() + 0.5
+    procs = [
+        multiprocessing.Process(target=writer, args=(store, user_dns[i::writers], seconds, start_at, queue))
+        for i in range(writers)
+    ]
+    for proc in procs:
+        proc.start()
+    totals = [queue.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+
+    exchanges = sum(t[0] for t in totals)
+    commit_s = sum(t[1] for t in totals)
+    return {
+        "shards": shards,
+        "exchanges_per_s": round(exchanges / seconds, 1),
+        # 2 messages + 1 usage row per exchange
+        "rows_per_s": round(exchanges * 3 / seconds, 1),
+        "mean_commit_ms": round(commit_s / exchanges * 1000, 2) if exchanges else None,
+    }
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Chat store write throughput per shard count")
+    parser.add_argument("--shards", default="1,2,4,8", help="comma-separated shard counts")
+    parser.add_argument("--writers", type=int, default=8, help="concurrent writer processes")
+    parser.add_argument("--users", type=int, default=64, help="distinct users")
+    parser.add_argument("--seconds", type=float, default=5.0, help="duration per shard count")
+    parser.add_argument("--dir", help="directory for database files (default: temp dir, deleted)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    workdir = args.dir or tempfile.mkdtemp(prefix="shard-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        results = [run(int(n), args.writers, args.users, args.seconds, workdir) for n in args.shards.split(",")]
+    finally:
+        if not args.dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({"writers": args.writers, "users": args.users, "results": results}, indent=2))
+        return 0
+
+    baseline = results[0]["exchanges_per_s"] or 1
+    print(f"{args.writers} writers, {args.users} users, {args.seconds:.0f}s each\n")
+    print(f"{'shards':>6}  {'exchanges/s':>12}  {'rows/s':>9}  {'commit ms':>9}  {'speedup':>7}")
+    for r in results:
+        print(f"{r['shards']:>6}  {r['exchanges_per_s']:>12.1f}  {r['rows_per_s']:>9.1f}  "
+              f"{r['mean_commit_ms']:>9.2f}  {r['exchanges_per_s'] / baseline:>6.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
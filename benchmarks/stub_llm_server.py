@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Stub LLM Server
+Local stand-in for the Mistral and GitHub Models chat APIs used by the bots
+Serves canned completions with configurable latency, token rate, streaming and errors
+
+Endpoints:
+    POST /v1/chat/completions   Mistral chat + Pixtral vision (MISTRAL_API_URL)
+    POST /chat/completions      GitHub Models (GITHUB_MODELS_URL)
+    GET  /stats                 Request counters
+
+Usage:
+    python benchmarks/stub_llm_server.py --port 8088 --latency-ms 300 --token-rate 80
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+WORDS = ("the", "router", "function", "returns", "config", "interface", "value",
+         "python", "request", "vlan", "loop", "cache", "error", "list", "server")
+
+
+@dataclass
+class StubConfig:
+    """Behaviour knobs for the stub server"""
+    latency_ms: float = 200.0        # time to first token
+    jitter_ms: float = 50.0          # +/- uniform jitter on latency
+    token_rate: float = 100.0        # completion tokens per second (0 = instant)
+    completion_tokens: int = 120     # tokens per answer
+    error_rate: float = 0.0          # fraction of requests answered with error_status
+    error_status: int = 500
+    code_block: bool = True          # include a fenced code block in answers
+
+
+class StubState:
+    """Thread-safe request counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+
+    def incr(self, key: str) -> None:
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+
+def _estimate_tokens(messages) -> int:
+    """Rough prompt token count (4 chars per token)"""
+    chars = 0
+    for msg in messages or []:
+        content = msg.get("content", "")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        chars += len(str(content))
+    return max(1, chars // 4)
+
+
+def _make_tokens(config: StubConfig):
+    """Generate completion text split into pseudo-tokens"""
+    rng = random.Random()
+    tokens = [rng.choice(WORDS) + " " for _ in range(config.completion_tokens)]
+    if config.code_block:
+        tokens[len(tokens) // 2:len(tokens) // 2] = [
+            "\n```python\n", "def handler(x):\n", "    return x * 2\n", "```\n"
+        ]
+    return tokens
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """HTTP handler mimicking OpenAI-style /chat/completions"""
+
+    server_version = "StubLLM/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Quiet by default; the load test reports its own numbers
+        pass
+
+    @property
+    def config(self) -> StubConfig:
+        return self.server.stub_config
+
+    @property
+    def state(self) -> StubState:
+        return self.server.stub_state
+
+    def _send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json(200, {"config": asdict(self.config), "counts": self.state.snapshot()})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path not in ("/v1/chat/completions", "/chat/completions"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": "invalid json"})
+            return
+
+        provider = "mistral" if self.path.startswith("/v1/") else "github"
+        self.state.incr(f"{provider}_requests")
+
+        cfg = self.config
+        latency = max(0.0, cfg.latency_ms + random.uniform(-cfg.jitter_ms, cfg.jitter_ms)) / 1000
+        time.sleep(latency)
+
+        if cfg.error_rate and random.random() < cfg.error_rate:
+            self.state.incr(f"{provider}_errors")
+            self._send_json(cfg.error_status, {"error": {"message": "injected stub error"}})
+            return
+
+        tokens = _make_tokens(cfg)
+        model = payload.get("model", "stub")
+        usage = {
+            "prompt_tokens": _estimate_tokens(payload.get("messages")),
+            "completion_tokens": len(tokens),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        delay = 1.0 / cfg.token_rate if cfg.token_rate > 0 else 0.0
+
+        if payload.get("stream"):
+            self._stream(model, tokens, usage, delay)
+        else:
+            time.sleep(delay * len(tokens))
+            self._send_json(200, {
+                "id": f"stub-{random.getrandbits(32):08x}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+    def _stream(self, model: str, tokens, usage: dict, delay: float) -> None:
+        """Send tokens as server-sent events at the configured rate"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        chunk_id = f"stub-{random.getrandbits(32):08x}"
+        try:
+            for i, token in enumerate(tokens):
+                time.sleep(delay)
+                chunk = {
+                    "id": chunk_id,
+                    "object": "chat.completion.chunk",
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": token},
+                                 "finish_reason": "stop" if i == len(tokens) - 1 else None}],
+                }
+                if i == len(tokens) - 1:
+                    chunk["usage"] = usage
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.state.incr("client_disconnects")
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0,
+                 config: Optional[StubConfig] = None) -> ThreadingHTTPServer:
+    """
+    Start stub server in a background thread
+
+    Args:
+        host: Interface to bind
+        port: Port (0 picks a free port, see server.server_address)
+        config: Behaviour configuration
+
+    Returns:
+        ThreadingHTTPServer: Running server (call shutdown() to stop)
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.stub_config = config or StubConfig()
+    server.stub_state = StubState()
+    thread = threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True)
+    thread.start()
+    return server
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    """Register StubConfig options on an argument parser"""
+    defaults = StubConfig()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=defaults.jitter_ms)
+    parser.add_argument("--token-rate", type=float, default=defaults.token_rate,
+                        help="completion tokens per second (0 = instant)")
+    parser.add_argument("--completion-tokens", type=int, default=defaults.completion_tokens)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+
+
+def stub_config_from_args(args: argparse.Namespace) -> StubConfig:
+    """Build StubConfig from parsed arguments"""
+    return StubConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        token_rate=args.token_rate,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+
+
+def main():
+    """Run stub server in the foreground"""
+    parser = argparse.ArgumentParser(description="Stub Mistral/GitHub Models server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_server(args.host, args.port, stub_config_from_args(args))
+    host, port = server.server_address[:2]
+    print(f"Stub LLM server on http://{host}:{port}")
+    print(f"  MISTRAL_API_URL=http://{host}:{port}")
+    print(f"  GITHUB_MODELS_URL=http://{host}:{port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
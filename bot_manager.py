@@ -6,10 +6,12 @@ Initializes and manages multiple bot instances
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
-from base_bot import BaseBot
+from base_bot import BaseBot, ChatResult
+from cancellation import RequestCancelled, request_task
 from mistral_bot import MistralBot
 from github_copilot_bot import GitHubCopilotBot
 
@@ -121,12 +123,75 @@ class BotManager:
         Raises:
             ValueError: If bot not available
         """
+        return self.chat_result(bot_id, messages, model).text
+    
+    def chat_result(self, bot_id: str, messages: List[Dict[str, str]], model: str = None,
+                    cancel=None) -> ChatResult:
+        """
+        Send chat request to specific bot and keep usage/timing
+        
+        Args:
+            bot_id: Bot identifier
+            messages: Message history
+            model: Optional model override
+            cancel: Optional CancelToken that aborts the upstream request
+            
+        Returns:
+            ChatResult: Response text with token usage and upstream timing
+            
+        Raises:
+            ValueError: If bot not available
+            RequestCancelled: If cancel was set before the completion finished
+        """
         bot = self.get_bot(bot_id)
         if not bot:
             available = ', '.join(self.bots.keys())
             raise ValueError(f"Bot '{bot_id}' not available. Available: {available}")
         
-        return bot.chat_complete(messages, model)
+        return bot.chat_complete_result(messages, model, cancel)
+    
+    def chat_many(self, histories: Dict[str, List[Dict[str, str]]], model: str = None,
+                  cancel=None, models: Optional[Dict[str, str]] = None) -> Dict[str, ChatResult]:
+        """
+        Send chat requests to several bots concurrently
+        
+        Args:
+            histories: Bot identifier -> message history for that bot
+            model: Optional model override
+            cancel: Optional CancelToken that aborts all upstream requests
+            models: Optional bot identifier -> model (takes precedence over model)
+            
+        Returns:
+            dict: Bot identifier -> ChatResult (exceptions become error results)
+            
+        Raises:
+            RequestCancelled: If cancel was set before all completions finished
+        """
+        if not histories:
+            return {}
+        models = models or {}
+        
+        chat_result = request_task(self.chat_result)
+        with ThreadPoolExecutor(max_workers=len(histories), thread_name_prefix="chat-many") as executor:
+            futures = {
+                bot_id: executor.submit(chat_result, bot_id, messages, models.get(bot_id, model), cancel)
+                for bot_id, messages in histories.items()
+            }
+        
+        results = {}
+        for bot_id, future in futures.items():
+            try:
+                results[bot_id] = future.result()
+            except RequestCancelled:
+                raise
+            except Exception as e:
+                results[bot_id] = ChatResult.error(f"❌ Error: {str(e)}")
+        return results
+    
+    def reset_connections(self) -> None:
+        """Drop network clients of all bots (call in each forked worker)"""
+        for bot in self.bots.values():
+            bot.reset_connections()
 
 
 # Global singleton instance
@@ -147,6 +212,16 @@ def get_bot_manager() -> BotManager:
     return _bot_manager
 
 
+def reset_bot_connections() -> None:
+    """
+    Reset bot network clients after a fork
+    
+    No-op if the bot manager has not been created in this process.
+    """
+    if _bot_manager is not None:
+        _bot_manager.reset_connections()
+
+
 def main():
     """Main function for testing bot manager"""
     try:
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Cancellation
+Stop upstream LLM calls when the browser goes away
+
+A DisconnectWatcher polls the client socket while a request waits on a
+provider. When the client closes the connection (tab closed, fetch aborted)
+the request's CancelToken is set:
+- the request thread stops waiting and returns at once, skipping
+  post-processing and database writes;
+- bots stream completions when given a token and close the upstream
+  stream at the next chunk, so the provider stops generating.
+
+Cancellation counts live in shared memory created at import (in the
+gunicorn master with preload_app), so they cover all workers.
+"""
+
+import os
+import json
+import time
+import select
+import socket
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from base_bot import ChatResult
+from server_timing import bind
+from request_profiler import profile_task
+
+logger = logging.getLogger(__name__)
+
+# Seconds between client socket checks
+POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+# Poll events meaning the peer closed or reset the connection (POLLRDHUP is Linux-only)
+_POLLRDHUP = getattr(select, "POLLRDHUP", 0)
+_HANGUP = _POLLRDHUP | getattr(select, "POLLHUP", 0) | getattr(select, "POLLERR", 0) | getattr(select, "POLLNVAL", 0)
+
+COUNTERS = ("chat", "upload", "upstream_streams_closed")
+_counts = multiprocessing.RawArray("q", len(COUNTERS))
+_counts_lock = multiprocessing.Lock()
+
+
+class RequestCancelled(Exception):
+    """The client disconnected; the result is no longer wanted"""
+
+
+class CancelToken:
+    """Thread-safe cancellation flag shared by a request and its upstream calls"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason: Optional[str] = None
+
+    def cancel(self, reason: str) -> None:
+        """Mark as cancelled (first reason wins) and run on_cancel callbacks"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback: Callable[[], None]) -> None:
+        """Call callback when cancelled (immediately if already cancelled)"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until cancelled or timeout; True if cancelled"""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self) -> None:
+        """
+        Raises:
+            RequestCancelled: If the token is cancelled
+        """
+        if self._event.is_set():
+            raise RequestCancelled(self.reason)
+
+
+def count(counter: str) -> None:
+    """Increment a cancellation counter (see COUNTERS)"""
+    with _counts_lock:
+        _counts[COUNTERS.index(counter)] += 1
+
+
+def cancellation_stats() -> Dict[str, int]:
+    """
+    Cancellation counters since server start (all workers)
+
+    Returns:
+        dict: Cancelled requests per endpoint and upstream streams closed early
+    """
+    with _counts_lock:
+        return dict(zip(COUNTERS, _counts))
+
+
+def _client_socket(environ: Dict[str, Any]) -> Optional[socket.socket]:
+    """
+    Duplicate the client connection's socket from the WSGI environ
+
+    Works for gunicorn (sync and gthread) and the Werkzeug dev server. The
+    duplicate is a plain TCP socket even behind TLS, so it can be polled
+    without touching the TLS stream.
+    """
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if sock is None:
+        return None
+    try:
+        return socket.fromfd(sock.fileno(), sock.family, sock.type)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class DisconnectWatcher:
+    """Background thread that cancels a token when the client disconnects"""
+
+    def __init__(self, environ: Dict[str, Any], token: CancelToken, interval: float = POLL_INTERVAL):
+        """
+        Args:
+            environ: WSGI environ of the current request
+            token: Token cancelled on disconnect
+            interval: Seconds between checks
+        """
+        self.token = token
+        self.interval = interval
+        self._sock = _client_socket(environ)
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def client_gone(self) -> bool:
+        """
+        True if the peer closed the connection
+
+        Only used once the request body has been read, when the client has
+        nothing more to send until it gets the response. Behind TLS a
+        closing browser first sends a close_notify alert, so the socket is
+        readable with data rather than at EOF. On Linux POLLRDHUP reports
+        the FIN behind that data; elsewhere any readable byte counts as the
+        client leaving.
+        """
+        try:
+            if _POLLRDHUP:
+                poller = select.poll()
+                poller.register(self._sock, select.POLLIN | _POLLRDHUP)
+                return any(events & _HANGUP for _, events in poller.poll(0))
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            return bool(readable)
+        except (OSError, ValueError):
+            return True
+
+    def _run(self) -> None:
+        while not self._done.wait(self.interval):
+            if self.client_gone():
+                self.token.cancel("client disconnected")
+                return
+
+    def __enter__(self) -> "DisconnectWatcher":
+        if self._sock is not None:
+            self._thread = threading.Thread(target=self._run, name="disconnect-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._sock is not None:
+            self._sock.close()
+
+
+# Upstream calls run here so the request thread can stop waiting on cancel
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Executor for the current process (threads do not survive a fork)"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=int(os.getenv("UPSTREAM_THREADS", 32)),
+                                           thread_name_prefix="upstream")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def request_task(func: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Wrap func for a helper thread so it still counts toward the current request
+
+    Its spans land in the request's Server-Timing header and, when the
+    request is being profiled, its calls in the capture.
+    """
+    return profile_task(bind(func))
+
+
+def run_cancellable(token: CancelToken, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run func in a helper thread and wait for it unless the token is cancelled
+
+    Args:
+        token: Cancellation token (func should receive it too, to stop its upstream call)
+        func: Callable to run
+
+    Returns:
+        Whatever func returns
+
+    Raises:
+        RequestCancelled: If the token was cancelled before func finished
+    """
+    wake = threading.Event()
+    token.on_cancel(wake.set)
+    future = _get_executor().submit(request_task(func), *args, **kwargs)
+    future.add_done_callback(lambda _: wake.set())
+    wake.wait()
+    if not future.done():
+        # func notices the token at its next chunk and closes the upstream stream
+        raise RequestCancelled(token.reason)
+    return future.result()
+
+
+def read_sse_completion(response, model: str, cancel: CancelToken, started: float) -> ChatResult:
+    """
+    Collect an OpenAI-style streamed completion, aborting when cancelled
+
+    Args:
+        response: requests.Response opened with stream=True
+        model: Requested model (if chunks don't name one)
+        cancel: Token checked between chunks
+        started: perf_counter() value when the request was sent
+
+    Returns:
+        ChatResult: Joined text with usage from the final chunk (if sent)
+
+    Raises:
+        RequestCancelled: If cancelled; the upstream connection is closed
+    """
+    parts: List[str] = []
+    usage = None
+    try:
+        for line in response.iter_lines():
+            if cancel.cancelled:
+                count("upstream_streams_closed")
+                raise RequestCancelled(cancel.reason)
+            if not line or not line.startswith(b"data:"):
+                continue
+            data = line[len(b"data:"):].strip()
+            if data == b"[DONE]":
+                break
+            chunk = json.loads(data)
+            model = chunk.get("model") or model
+            usage = chunk.get("usage") or usage
+            for choice in chunk.get("choices") or []:
+                parts.append((choice.get("delta") or {}).get("content") or "")
+    finally:
+        # Closing mid-stream drops the connection, which stops generation upstream
+        response.close()
+    return ChatResult.from_usage("".join(parts), model, usage, (time.perf_counter() - started) * 1000)
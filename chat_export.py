@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Chat Export
+Stream chat history out of and into the chat store as NDJSON
+
+One JSON object per line, messages first, then usage rows:
+    {"type": "message", "role": "user", "content": "...", "provider": null,
+     "timestamp": "2025-01-31 12:00:00", "user_dn": "CN=alice,..."}
+    {"type": "usage", "timestamp": "...", "user": "alice", "bot": "mistral", ...}
+
+Export reads each shard with a cursor in batches and import inserts in
+batched transactions, so memory use does not grow with history size.
+Files ending in .gz are (de)compressed on the fly.
+
+Usage:
+    python chat_export.py export -o history.ndjson.gz
+    python chat_export.py export --user "CN=alice,CN=Users,DC=example,DC=local" -o alice.ndjson
+    python chat_export.py import history.ndjson.gz
+"""
+
+import io
+import sys
+import gzip
+import json
+import time
+import zlib
+import sqlite3
+import argparse
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from chat_store import MESSAGE_COLUMNS, USAGE_COLUMNS, ChatStore, table_counts
+
+# Record type -> (table, columns)
+TABLES = {
+    "message": ("messages", MESSAGE_COLUMNS),
+    "usage": ("usage", USAGE_COLUMNS),
+}
+
+
+def export_records(store: ChatStore, user_dn: Optional[str] = None, types: Iterable[str] = ("message", "usage"),
+                   batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    """
+    Yield stored rows as export records, shard by shard in id order
+
+    Args:
+        store: Chat store to read
+        user_dn: Only this user's rows (reads only the user's shard)
+        types: Record types to export ("message", "usage")
+        batch_size: Rows fetched per round trip
+
+    Yields:
+        dict: {"type": ..., **columns}
+    """
+    shards = [store.shard_for(user_dn)] if user_dn else range(len(store.paths))
+    for record_type in types:
+        table, columns = TABLES[record_type]
+        sql = f"SELECT {', '.join(columns)} FROM {table}"
+        params: Tuple[Any, ...] = ()
+        if user_dn:
+            sql += " WHERE user_dn = ?"
+            params = (user_dn,)
+        sql += " ORDER BY id"
+        for shard in shards:
+            conn = store.connect(shard)
+            try:
+                cursor = conn.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield {"type": record_type, **dict(zip(columns, row))}
+            finally:
+                conn.close()
+
+
+def ndjson_chunks(records: Iterable[Dict[str, Any]], chunk_bytes: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Encode records as NDJSON, yielding about chunk_bytes at a time
+
+    Args:
+        records: Dicts to encode
+        chunk_bytes: Approximate size of each yielded chunk
+
+    Yields:
+        bytes: Complete lines
+    """
+    buffer: List[bytes] = []
+    size = 0
+    for record in records:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """
+    Compress a byte stream into gzip format without buffering it
+
+    Yields:
+        bytes: gzip data (a complete .gz file when concatenated)
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 = gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def open_input(path: str) -> IO[str]:
+    """Open an export file for reading as text, decompressing gzip (by magic bytes)"""
+    stream = sys.stdin.buffer if path == "-" else open(path, "rb")
+    if stream.peek(2)[:2] == b"\x1f\x8b":
+        stream = gzip.GzipFile(fileobj=stream)
+    return io.TextIOWrapper(stream, encoding="utf-8")
+
+
+def import_records(store: ChatStore, lines: Iterable[str], batch_size: int = 1000,
+                   progress: Optional[Callable[[int], None]] = None) -> Dict[str, int]:
+    """
+    Insert exported records, one transaction per batch and shard
+
+    Rows go to the shard of their user_dn in the target store, in file
+    order, so per-user history order is preserved.
+
+    Args:
+        store: Target chat store (schema is created if missing)
+        lines: NDJSON lines (blank lines are skipped)
+        batch_size: Records per transaction
+        progress: Called with the number of records imported after each batch
+
+    Returns:
+        dict: Rows imported per record type
+
+    Raises:
+        ValueError: On a malformed line (rows of earlier batches stay imported)
+    """
+    store.init()
+    conns = [store.connect(shard) for shard in range(len(store.paths))]
+    inserts = {record_type: f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+               for record_type, (table, columns) in TABLES.items()}
+    counts = dict.fromkeys(TABLES, 0)
+    batch: Dict[Tuple[int, str], List[tuple]] = {}
+    pending = 0
+
+    def write_batch() -> None:
+        nonlocal batch, pending
+        for shard in {shard for shard, _ in batch}:
+            conn = conns[shard]
+            with conn:  # one transaction per shard
+                for record_type in TABLES:
+                    rows = batch.get((shard, record_type))
+                    if rows:
+                        conn.executemany(inserts[record_type], rows)
+                        counts[record_type] += len(rows)
+        batch, pending = {}, 0
+        if progress:
+            progress(sum(counts.values()))
+
+    try:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                _, columns = TABLES[record["type"]]
+                row = tuple(record.get(column) for column in columns)
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"Line {number}: not an export record ({e})") from e
+            batch.setdefault((store.shard_for(record.get("user_dn")), record["type"]), []).append(row)
+            pending += 1
+            if pending >= batch_size:
+                write_batch()
+        if pending:
+            write_batch()
+    finally:
+        for conn in conns:
+            conn.close()
+    return counts
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Export or import chat history as NDJSON")
+    sub = parser.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export", help="write messages and usage rows as NDJSON")
+    exp.add_argument("-o", "--output", default="-", help="output file, .gz compresses (default: stdout)")
+    exp.add_argument("--user", help="only this user's rows (LDAP DN)")
+    exp.add_argument("--messages-only", action="store_true", help="skip usage rows")
+    imp = sub.add_parser("import", help="insert an export into the configured store (server stopped)")
+    imp.add_argument("input", help="NDJSON file, optionally gzip ('-' for stdin)")
+    imp.add_argument("--batch-size", type=int, default=1000, help="records per transaction")
+    imp.add_argument("--append", action="store_true", help="import even if the store already has rows")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from chat_store import store_from_env
+    load_dotenv()
+    store = store_from_env()
+    started = time.time()
+
+    if args.command == "export":
+        types = ("message",) if args.messages_only else ("message", "usage")
+        chunks = ndjson_chunks(export_records(store, args.user, types))
+        if args.output.endswith(".gz"):
+            chunks = gzip_chunks(chunks)
+        out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+        written = 0
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        print(f"Exported {written / 1024 / 1024:.1f} MB from {store.describe()} in {time.time() - started:.1f}s",
+              file=sys.stderr)
+        return 0
+
+    store.init()
+    if not args.append and any(c["messages"] or c["usage"] for c in table_counts(store)):
+        print(f"❌ {store.describe()} already contains rows; use --append to add to them", file=sys.stderr)
+        return 1
+
+    def progress(done: int) -> None:
+        elapsed = max(time.time() - started, 1e-6)
+        print(f"\r{done:,} records ({done / elapsed:,.0f}/s)", end="", file=sys.stderr, flush=True)
+
+    try:
+        with open_input(args.input) as lines:
+            counts = import_records(store, lines, args.batch_size, progress)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"\n❌ {e}", file=sys.stderr)
+        return 1
+    print(f"\nImported {counts['message']:,} messages and {counts['usage']:,} usage rows into "
+          f"{store.describe()} in {time.time() - started:.1f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+Chat Store
+Storage backends for chat messages and usage rows
+
+A backend maps a user (LDAP DN) to one SQLite database file. The default
+"sqlite" backend keeps everything in CHAT_DB_PATH. The "sharded" backend
+spreads users over CHAT_SHARDS files by hash of their DN, so writers for
+different users hold different database locks and never wait on each other.
+
+Usage:
+    python chat_store.py info
+    python chat_store.py rebalance --to sharded:8
+    python chat_store.py rebalance --from sharded:8 --to sqlite
+"""
+
+import os
+import sys
+import zlib
+import sqlite3
+import argparse
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from usage_store import init_usage_table
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), "chat_history.db")
+
+# Columns copied by rebalance(), in insert order
+MESSAGE_COLUMNS = ("role", "content", "provider", "timestamp", "user_dn")
+USAGE_COLUMNS = ("timestamp", "user", "user_dn", "endpoint", "bot", "model", "prompt_tokens",
+                 "completion_tokens", "total_tokens", "history_messages", "history_chars", "upstream_ms", "ok", "tier")
+
+
+def init_schema(cursor: sqlite3.Cursor) -> None:
+    """
+    Create tables and indexes, migrating databases created by older versions
+
+    Args:
+        cursor: Cursor on one database file
+    """
+    # WAL lets readers (history) run while the writer commits
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(messages)")}
+    if "provider" not in columns:
+        # Bot id that produced an assistant message (NULL for user messages)
+        cursor.execute("ALTER TABLE messages ADD COLUMN provider TEXT")
+    if "user_dn" not in columns:
+        # Owner of the conversation; NULL for rows written before per-user history
+        cursor.execute("ALTER TABLE messages ADD COLUMN user_dn TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_dn, id)")
+    # Hashing-trick vector per message for relevance retrieval (see retrieval.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS message_vectors (
+        message_id INTEGER PRIMARY KEY,
+        user_dn TEXT,
+        vector BLOB NOT NULL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_message_vectors_user ON message_vectors (user_dn, message_id)")
+    init_usage_table(cursor)
+
+
+def shard_key(user_dn: Optional[str]) -> int:
+    """Stable hash of a DN (case-insensitive, like LDAP); 0 for rows without a user"""
+    if not user_dn:
+        return 0
+    return zlib.crc32(user_dn.strip().lower().encode("utf-8"))
+
+
+class ChatStore(ABC):
+    """Maps users to SQLite database files"""
+
+    name = "abstract"
+
+    @property
+    @abstractmethod
+    def paths(self) -> List[str]:
+        """Database file per shard, index = shard number"""
+
+    @abstractmethod
+    def shard_for(self, user_dn: Optional[str]) -> int:
+        """
+        Shard holding a user's rows
+
+        Args:
+            user_dn: LDAP distinguished name (None for rows without a user)
+
+        Returns:
+            int: Index into paths
+        """
+
+    def connect(self, shard: int) -> sqlite3.Connection:
+        """
+        Open a new connection to one shard
+
+        Args:
+            shard: Shard index
+
+        Returns:
+            sqlite3.Connection: Connection with sqlite3.Row rows
+        """
+        # Wait for another process's write lock instead of failing at once
+        conn = sqlite3.connect(self.paths[shard], timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def connect_for_user(self, user_dn: Optional[str]) -> sqlite3.Connection:
+        """Open a new connection to the shard holding a user's rows"""
+        return self.connect(self.shard_for(user_dn))
+
+    def connections(self) -> Iterator[sqlite3.Connection]:
+        """
+        Open each shard in turn (for admin queries over all users)
+
+        Yields:
+            sqlite3.Connection: Connection, closed when the next one is opened
+        """
+        for shard in range(len(self.paths)):
+            conn = self.connect(shard)
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+    def init(self) -> None:
+        """Create or migrate the schema in every shard"""
+        for path in self.paths:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+        for conn in self.connections():
+            init_schema(conn.cursor())
+            conn.commit()
+
+    def describe(self) -> str:
+        """Spec string accepted by store_from_spec()"""
+        return self.name
+
+
+class SQLiteStore(ChatStore):
+    """All users in one database file"""
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        """
+        Args:
+            db_path: Database file
+        """
+        self.db_path = db_path
+
+    @property
+    def paths(self) -> List[str]:
+        return [self.db_path]
+
+    def shard_for(self, user_dn: Optional[str]) -> int:
+        return 0
+
+
+class ShardedSQLiteStore(ChatStore):
+    """Users spread over N database files by hash of their DN"""
+
+    name = "sharded"
+
+    def __init__(self, shards: int, db_path: str = DEFAULT_DB_PATH):
+        """
+        Args:
+            shards: Number of database files
+            db_path: Base path; shard i of n is <base>.shard<i>of<n><ext>
+
+        Raises:
+            ValueError: If shards < 1
+        """
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        self.shards = shards
+        self.db_path = db_path
+        root, ext = os.path.splitext(db_path)
+        # The shard count is part of the name, so a rebalance to another
+        # count writes new files and leaves the old ones untouched
+        self._paths = [f"{root}.shard{i}of{shards}{ext}" for i in range(shards)]
+
+    @property
+    def paths(self) -> List[str]:
+        return self._paths
+
+    def shard_for(self, user_dn: Optional[str]) -> int:
+        return shard_key(user_dn) % self.shards
+
+    def describe(self) -> str:
+        return f"{self.name}:{self.shards}"
+
+
+# Backend name -> factory(argument, db_path); register new backends here
+BACKENDS = {
+    "sqlite": lambda arg, db_path: SQLiteStore(db_path),
+    "sharded": lambda arg, db_path: ShardedSQLiteStore(int(arg or 4), db_path),
+}
+
+
+def store_from_spec(spec: str, db_path: str = DEFAULT_DB_PATH) -> ChatStore:
+    """
+    Build a store from a spec string
+
+    Args:
+        spec: "sqlite" or "sharded:<n>"
+        db_path: Database file (sqlite) or base path (sharded)
+
+    Returns:
+        ChatStore: Configured store
+
+    Raises:
+        ValueError: On unknown backend
+    """
+    name, _, arg = spec.partition(":")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown chat store '{name}'. Choose from: {', '.join(BACKENDS)}")
+    return BACKENDS[name](arg, db_path)
+
+
+def store_from_env() -> ChatStore:
+    """
+    Build the store configured by environment variables
+
+    Environment:
+        CHAT_STORE: "sqlite" (default) or "sharded"
+        CHAT_SHARDS: Number of shards for "sharded" (default 4)
+        CHAT_DB_PATH: Database file / shard base path
+    """
+    name = os.getenv("CHAT_STORE", "sqlite")
+    arg = os.getenv("CHAT_SHARDS", "4") if name == "sharded" else ""
+    return store_from_spec(f"{name}:{arg}" if arg else name, os.getenv("CHAT_DB_PATH", DEFAULT_DB_PATH))
+
+
+def table_counts(store: ChatStore) -> List[Dict[str, int]]:
+    """
+    Row counts per shard
+
+    Returns:
+        list: {"path", "messages", "usage", "users"} per shard
+    """
+    counts = []
+    for path, conn in zip(store.paths, store.connections()):
+        counts.append({
+            "path": path,
+            "messages": conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+            "usage": conn.execute("SELECT COUNT(*) FROM usage").fetchone()[0],
+            "users": conn.execute("SELECT COUNT(DISTINCT user_dn) FROM messages").fetchone()[0],
+        })
+    return counts
+
+
+def _copy_table(source: ChatStore, target: ChatStore, targets: List[sqlite3.Connection],
+                table: str, columns: Tuple[str, ...], batch_size: int) -> List[int]:
+    """Copy one table shard by shard in id order; returns rows written per target shard"""
+    written = [0] * len(targets)
+    dn_index = columns.index("user_dn")
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    for conn in source.connections():
+        cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            grouped: Dict[int, List[tuple]] = {}
+            for row in rows:
+                grouped.setdefault(target.shard_for(row[dn_index]), []).append(tuple(row))
+            for shard, shard_rows in grouped.items():
+                targets[shard].executemany(insert, shard_rows)
+                targets[shard].commit()
+                written[shard] += len(shard_rows)
+    return written
+
+
+def rebalance(source: ChatStore, target: ChatStore, batch_size: int = 1000) -> Dict[str, List[int]]:
+    """
+    Copy all rows from one store layout into another
+
+    Each user's rows live in exactly one source shard and are copied in id
+    order, so per-user history order is preserved. Run with the server
+    stopped; the source files are left untouched.
+
+    Args:
+        source: Current store
+        target: New store (its files must be empty or missing)
+        batch_size: Rows per read/commit
+
+    Returns:
+        dict: Rows written per target shard for "messages" and "usage"
+
+    Raises:
+        ValueError: If source and target share a file or the target has data
+    """
+    if set(map(os.path.abspath, source.paths)) & set(map(os.path.abspath, target.paths)):
+        raise ValueError("Source and target use the same database file")
+
+    source.init()  # adds user_dn to databases from older versions
+    target.init()
+    if any(c["messages"] or c["usage"] for c in table_counts(target)):
+        raise ValueError(f"Target {target.describe()} already contains rows")
+
+    targets = [target.connect(shard) for shard in range(len(target.paths))]
+    try:
+        return {
+            "messages": _copy_table(source, target, targets, "messages", MESSAGE_COLUMNS, batch_size),
+            "usage": _copy_table(source, target, targets, "usage", USAGE_COLUMNS, batch_size),
+        }
+    finally:
+        for conn in targets:
+            conn.close()
+
+
+def _set_owner(store: ChatStore, conns: List[sqlite3.Connection], shard: int, table: str,
+               columns: Tuple[str, ...], condition: str, params: tuple, owner_dn: str, batch_size: int) -> int:
+    """Give ownerless rows of one shard matching condition an owner, moving them to the owner's shard"""
+    source = conns[shard]
+    where = f"user_dn IS NULL AND {condition}"
+    target_shard = store.shard_for(owner_dn)
+    if target_shard == shard:
+        with source:
+            if table == "messages":
+                source.execute(f"UPDATE message_vectors SET user_dn = ? WHERE message_id IN "
+                               f"(SELECT id FROM messages WHERE {where})", (owner_dn,) + params)
+            return source.execute(f"UPDATE {table} SET user_dn = ? WHERE {where}", (owner_dn,) + params).rowcount
+
+    # Copied in id order, then deleted; vectors are rebuilt for the new ids (retrieval.py)
+    target = conns[target_shard]
+    dn_index = columns.index("user_dn")
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    moved = 0
+    while True:
+        rows = source.execute(f"SELECT id, {', '.join(columns)} FROM {table} WHERE {where} ORDER BY id LIMIT ?",
+                              params + (batch_size,)).fetchall()
+        if not rows:
+            return moved
+        with target:
+            target.executemany(insert, [tuple(row[1:dn_index + 1]) + (owner_dn,) + tuple(row[dn_index + 2:])
+                                        for row in rows])
+        ids = [(row[0],) for row in rows]
+        with source:
+            source.executemany(f"DELETE FROM {table} WHERE id = ?", ids)
+            if table == "messages":
+                source.executemany("DELETE FROM message_vectors WHERE message_id = ?", ids)
+        moved += len(rows)
+
+
+def claim_legacy_rows(store: ChatStore, dn_for_user: Callable[[str], str], owner_dn: Optional[str] = None,
+                      batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Give rows written before per-user history an owner
+
+    Usage rows name their user, so their DN is rebuilt with dn_for_user.
+    Messages were one history shared by everybody; they go to owner_dn
+    (LEGACY_HISTORY_OWNER) if given, and otherwise stay ownerless and out
+    of every user's history. Rows whose owner lives in another shard are
+    moved there. Only rows without user_dn are touched, so running this
+    on every start is a no-op once done.
+
+    Args:
+        store: Chat store (schema already initialized)
+        dn_for_user: Builds the DN a username logs in with
+        owner_dn: DN that receives the ownerless messages, or None
+        batch_size: Rows per transaction when moving between shards
+
+    Returns:
+        dict: Rows given an owner, for "messages" and "usage"
+    """
+    claimed = {"messages": 0, "usage": 0}
+    conns = [store.connect(shard) for shard in range(len(store.paths))]
+    try:
+        for shard, conn in enumerate(conns):
+            users = [row[0] for row in conn.execute(
+                "SELECT DISTINCT user FROM usage WHERE user_dn IS NULL AND user IS NOT NULL AND user != ''")]
+            for user in users:
+                claimed["usage"] += _set_owner(store, conns, shard, "usage", USAGE_COLUMNS, "user = ?", (user,),
+                                               dn_for_user(user), batch_size)
+            if owner_dn:
+                claimed["messages"] += _set_owner(store, conns, shard, "messages", MESSAGE_COLUMNS, "1", (),
+                                                  owner_dn, batch_size)
+    finally:
+        for conn in conns:
+            conn.close()
+    return claimed
+
+
+# Global singleton instance
+_chat_store: Optional[ChatStore] = None
+
+
+def get_chat_store() -> ChatStore:
+    """
+    Get global chat store instance (singleton)
+
+    Returns:
+        ChatStore: Store configured from environment
+    """
+    global _chat_store
+    if _chat_store is None:
+        _chat_store = store_from_env()
+    return _chat_store
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Inspect or rebalance chat history storage")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("info", help="row counts per shard of the configured store")
+    reb = sub.add_parser("rebalance", help="copy all rows into another layout (server stopped)")
+    reb.add_argument("--from", dest="source", help="source spec (default: CHAT_STORE/CHAT_SHARDS)")
+    reb.add_argument("--to", dest="target", required=True, help='target spec, e.g. "sharded:8" or "sqlite"')
+    reb.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    db_path = os.getenv("CHAT_DB_PATH", DEFAULT_DB_PATH)
+
+    if args.command == "info":
+        store = store_from_env()
+        print(f"Store: {store.describe()}")
+        for counts in table_counts(store):
+            print(f"  {counts['path']}: {counts['messages']} messages, {counts['usage']} usage rows, "
+                  f"{counts['users']} users")
+        return 0
+
+    try:
+        source = store_from_spec(args.source, db_path) if args.source else store_from_env()
+        target = store_from_spec(args.target, db_path)
+        written = rebalance(source, target, args.batch_size)
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    for table, per_shard in written.items():
+        print(f"{table}: {sum(per_shard)} rows -> " + ", ".join(
+            f"{os.path.basename(path)}={n}" for path, n in zip(target.paths, per_shard)))
+    print(f"\nDone. Set CHAT_STORE/CHAT_SHARDS for {target.describe()} and restart the server.")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
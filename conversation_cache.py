@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Conversation Cache
+Per-worker LRU cache of each user's recent messages in front of SQLite
+
+Every /chat turn and /history load needs the user's last messages. The
+cache keeps a window of recent (role, content, provider) rows per user,
+updated when this worker queues new messages, so the hot path never
+touches the database.
+
+Other workers write too, so every user has a version in shared memory
+(created at import, i.e. in the gunicorn master with preload_app). Any
+worker bumps it when it queues messages for a user and again once they
+are committed. A cached window is only served if it was stored at the
+current version; otherwise the caller reloads from SQLite.
+
+Without preload_app every worker imports the app, and so creates its own
+versions, after forking; no worker would see another's writes. The
+post_fork hook reports that through app_loaded_per_worker(), and the
+cache is then disabled.
+"""
+
+import os
+import sys
+import zlib
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Row = Tuple[str, str, Optional[str]]
+
+# Rough per-row overhead (tuple, provider/role strings) added to the content size
+_ROW_OVERHEAD = 120
+
+# Set in gunicorn workers that import the app themselves (preload_app off)
+_loaded_per_worker = False
+
+
+def app_loaded_per_worker() -> None:
+    """
+    Note that this worker imports the app after forking (gunicorn post_fork hook)
+
+    Versions created afterwards are private to the worker, so a cache built
+    from the environment afterwards is disabled.
+    """
+    global _loaded_per_worker
+    _loaded_per_worker = True
+
+
+class _Entry:
+    """Cached window of one user"""
+
+    __slots__ = ("rows", "complete", "version", "size")
+
+    def __init__(self, rows: List[Row], complete: bool, version: int):
+        self.rows = rows
+        # True if rows is the user's whole history (fewer rows than the window)
+        self.complete = complete
+        self.version = version
+        self.size = sum(_row_size(row) for row in rows)
+
+
+def _row_size(row: Row) -> int:
+    return sys.getsizeof(row[1]) + _ROW_OVERHEAD
+
+
+class ConversationCache:
+    """LRU of recent message windows, bounded by total size, versioned across workers"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, window: int = 50, slots: int = 4096):
+        """
+        Initialize conversation cache (before forking workers)
+
+        Args:
+            max_bytes: Approximate memory budget per worker; 0 disables the cache
+            window: Messages kept per user (largest limit served from memory)
+            slots: Shared version counters; users hashing to the same slot
+                invalidate each other, which only costs a reload
+        """
+        self.max_bytes = max_bytes
+        self.window = window
+        self.slots = max(1, slots)
+        self._versions = multiprocessing.RawArray("q", self.slots)
+        self._versions_lock = multiprocessing.Lock()
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._pid = os.getpid()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @classmethod
+    def from_env(cls) -> "ConversationCache":
+        """
+        Build cache from environment variables
+
+        Returns:
+            ConversationCache: Configured cache (disabled if workers don't share its versions)
+        """
+        max_bytes = int(float(os.getenv("CONVERSATION_CACHE_MB", 64)) * 1024 * 1024)
+        if max_bytes and _loaded_per_worker:
+            logger.warning("Conversation cache disabled: it needs gunicorn preload_app (GUNICORN_PRELOAD=true) "
+                           "to see other workers' writes")
+            max_bytes = 0
+        return cls(
+            max_bytes=max_bytes,
+            window=int(os.getenv("CONVERSATION_CACHE_WINDOW", 50)),
+            slots=int(os.getenv("CONVERSATION_CACHE_SLOTS", 4096)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _slot(self, user_dn: Optional[str]) -> int:
+        return zlib.crc32((user_dn or "").lower().encode("utf-8")) % self.slots
+
+    def _local(self) -> None:
+        """Drop entries inherited through fork (call with self._lock held)"""
+        if self._pid != os.getpid():
+            self._entries.clear()
+            self._bytes = 0
+            self._pid = os.getpid()
+            self._stats = dict.fromkeys(self._stats, 0)
+
+    def version(self, user_dn: Optional[str]) -> int:
+        """Current cross-worker version of a user's conversation (pass to put())"""
+        with self._versions_lock:
+            return self._versions[self._slot(user_dn)]
+
+    def _bump(self, user_dn: Optional[str]) -> Tuple[int, int]:
+        """Increment a user's version; returns (old, new)"""
+        slot = self._slot(user_dn)
+        with self._versions_lock:
+            old = self._versions[slot]
+            self._versions[slot] = old + 1
+            return old, old + 1
+
+    def _remove(self, user_dn: str) -> None:
+        entry = self._entries.pop(user_dn, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self._stats["evictions"] += 1
+
+    def get(self, user_dn: Optional[str], limit: int) -> Optional[List[Row]]:
+        """
+        Last `limit` messages of a user, if cached and current
+
+        Args:
+            user_dn: Owner of the conversation
+            limit: Number of messages wanted
+
+        Returns:
+            list: (role, content, provider) rows, oldest first; None on a miss
+        """
+        if not self.enabled:
+            return None
+        current = self.version(user_dn)
+        with self._lock:
+            self._local()
+            entry = self._entries.get(user_dn)
+            if entry is not None and entry.version != current:
+                # Another worker wrote for this user (or a colliding one)
+                self._remove(user_dn)
+                self._stats["invalidations"] += 1
+                entry = None
+            if entry is None or (len(entry.rows) < limit and not entry.complete):
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(user_dn)
+            self._stats["hits"] += 1
+            return entry.rows[-limit:]
+
+    def put(self, user_dn: Optional[str], rows: List[Row], complete: bool, version: int) -> None:
+        """
+        Store a window loaded from the database
+
+        Args:
+            user_dn: Owner of the conversation
+            rows: Last messages (committed plus queued), oldest first
+            complete: True if rows is the whole history
+            version: version() read before loading; stale loads are dropped
+        """
+        if not self.enabled:
+            return
+        entry = _Entry(list(rows[-self.window:]), complete and len(rows) <= self.window, version)
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            self._local()
+            if self.version(user_dn) != version:
+                return
+            self._remove(user_dn)
+            self._entries[user_dn] = entry
+            self._bytes += entry.size
+            self._evict()
+
+    def messages_queued(self, user_dn: Optional[str], rows: List[Row]) -> None:
+        """
+        New messages of a user were queued in this worker
+
+        Bumps the shared version so other workers reload, and appends the
+        rows to this worker's window if it was current. The message writer
+        calls this while holding its queue lock, so readers see the rows in
+        either the cache or the queue, never both or neither.
+        """
+        old, new = self._bump(user_dn)
+        if not self.enabled:
+            return
+        with self._lock:
+            self._local()
+            entry = self._entries.get(user_dn)
+            if entry is None:
+                return
+            if entry.version != old:
+                self._remove(user_dn)
+                return
+            entry.rows.extend(rows)
+            entry.size += sum(_row_size(row) for row in rows)
+            self._bytes += sum(_row_size(row) for row in rows)
+            if len(entry.rows) > self.window:
+                dropped = entry.rows[:-self.window]
+                del entry.rows[:-self.window]
+                removed = sum(_row_size(row) for row in dropped)
+                entry.size -= removed
+                self._bytes -= removed
+                entry.complete = False
+            entry.version = new
+            self._entries.move_to_end(user_dn)
+            self._evict()
+
+    def messages_committed(self, user_dns: Iterable[Optional[str]]) -> None:
+        """
+        Messages queued in this worker were committed
+
+        Bumps the versions again so workers that read the database while
+        the rows were still queued here drop what they cached. This
+        worker's own windows already contain the rows and stay valid.
+        """
+        for user_dn in set(user_dns):
+            old, new = self._bump(user_dn)
+            if not self.enabled:
+                continue
+            with self._lock:
+                entry = self._entries.get(user_dn)
+                if entry is not None and entry.version == old and self._pid == os.getpid():
+                    entry.version = new
+
+    def messages_dropped(self, user_dns: Iterable[Optional[str]]) -> None:
+        """
+        Messages queued in this worker could not be written
+
+        The cached windows of these users still hold the discarded rows,
+        so drop them here and make other workers reload as well.
+        """
+        for user_dn in set(user_dns):
+            self._bump(user_dn)
+            if not self.enabled:
+                continue
+            with self._lock:
+                self._local()
+                self._remove(user_dn)
+                self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Counters of this worker since it started
+
+        Returns:
+            dict: pid, entries, bytes, limits, hits/misses/evictions/invalidations
+        """
+        with self._lock:
+            self._local()
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "pid": os.getpid(),
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "window": self.window,
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else None,
+            }
+
+
+# Global singleton instance
+_conversation_cache: Optional[ConversationCache] = None
+
+
+def get_conversation_cache() -> ConversationCache:
+    """
+    Get global conversation cache instance (singleton)
+
+    Returns:
+        ConversationCache: Global cache configured from environment
+    """
+    global _conversation_cache
+    if _conversation_cache is None:
+        _conversation_cache = ConversationCache.from_env()
+    return _conversation_cache
@@ -5,9 +5,11 @@ Handles all GitHub Copilot specific logic and API communication
 """
 
 import os
-import requests
+import time
 from typing import List, Dict, Optional
-from base_bot import BaseBot
+from base_bot import BaseBot, ChatResult
+from cancellation import RequestCancelled, read_sse_completion
+from server_timing import span
 
 
 class GitHubCopilotBot(BaseBot):
@@ -23,8 +25,16 @@ class GitHubCopilotBot(BaseBot):
         super().__init__("GitHub Copilot")
         self.github_token = github_token or os.getenv("GITHUB_TOKEN")
         # Use GitHub Models API directly (works with PAT)
-        self.base_url = "https://models.inference.ai.azure.com"
+        # Override to point at a proxy or the local benchmark stub server
+        self.base_url = os.getenv("GITHUB_MODELS_URL", "https://models.inference.ai.azure.com").rstrip("/")
         self.default_model = "gpt-4o"
+        # Model per tier, picked per request by model_router.py
+        self.models = {
+            "fast": os.getenv("GITHUB_MODEL_FAST", "gpt-4o-mini"),
+            "large": os.getenv("GITHUB_MODEL_LARGE", self.default_model),
+        }
+        self._session = None
+        self._session_pid = None
         
         # Try to initialize immediately
         self.initialize()
@@ -48,6 +58,24 @@ class GitHubCopilotBot(BaseBot):
             self._is_available = False
             return False
     
+    def _get_session(self):
+        """
+        Get a keep-alive HTTP session for the current process
+        
+        Returns:
+            requests.Session: Session created lazily, recreated after a fork
+        """
+        if self._session is None or self._session_pid != os.getpid():
+            import requests
+            self._session = requests.Session()
+            self._session_pid = os.getpid()
+        return self._session
+    
+    def reset_connections(self) -> None:
+        """Forget the HTTP session so the worker opens its own connections"""
+        self._session = None
+        self._session_pid = None
+    
     def _get_headers(self) -> Dict[str, str]:
         """Get HTTP headers for API requests"""
         return {
@@ -68,6 +96,9 @@ class GitHubCopilotBot(BaseBot):
         Returns:
             str: GitHub-compatible model name
         """
+        # Tier models from our own catalog are used as-is
+        if model in self.models.values():
+            return model
         model_mapping = {
             "mistral-small-latest": "gpt-4o",
             "mistral-medium-latest": "gpt-4o",
@@ -77,7 +108,8 @@ class GitHubCopilotBot(BaseBot):
         }
         return model_mapping.get(model, self.default_model)
     
-    def _chat_request(self, url: str, messages: List[Dict[str, str]], model: str) -> Optional[str]:
+    def _chat_request(self, url: str, messages: List[Dict[str, str]], model: str,
+                      cancel=None) -> Optional[ChatResult]:
         """
         Make chat completion request to specific endpoint
         
@@ -85,9 +117,13 @@ class GitHubCopilotBot(BaseBot):
             url: API endpoint URL
             messages: Message history
             model: Model name
+            cancel: Optional CancelToken; streams the completion and stops when cancelled
             
         Returns:
-            str: Response text, or None if failed
+            ChatResult: Response text with usage, or None if failed
+            
+        Raises:
+            RequestCancelled: If cancel was set before the completion finished
         """
         payload = {
             "messages": messages,
@@ -97,32 +133,49 @@ class GitHubCopilotBot(BaseBot):
             "max_tokens": 4096
         }
         
+        if cancel is not None:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+        
+        started = time.perf_counter()
         try:
-            response = requests.post(
-                f"{url}/chat/completions",
-                headers=self._get_headers(),
-                json=payload,
-                timeout=60
+            with span("upstream", f"{self.name} {model}"):
+                response = self._get_session().post(
+                    f"{url}/chat/completions",
+                    headers=self._get_headers(),
+                    json=payload,
+                    timeout=60,
+                    stream=cancel is not None
+                )
+                response.raise_for_status()
+                if cancel is not None:
+                    return read_sse_completion(response, model, cancel, started)
+                data = response.json()
+            return ChatResult.from_usage(
+                data["choices"][0]["message"]["content"], data.get("model") or model,
+                data.get("usage"), (time.perf_counter() - started) * 1000
             )
-            response.raise_for_status()
-            data = response.json()
-            return data["choices"][0]["message"]["content"]
+        except RequestCancelled:
+            raise
         except Exception as e:
             return None
     
-    def chat_complete(self, messages: List[Dict[str, str]], model: str = None) -> str:
+    def chat_complete_result(self, messages: List[Dict[str, str]], model: str = None,
+                             cancel=None) -> ChatResult:
         """
         Send chat completion request to GitHub Models
         
         Args:
             messages: List of message dicts with 'role' and 'content'
             model: Model name (uses default if None)
+            cancel: Optional CancelToken; streams the completion and stops when cancelled
             
         Returns:
-            str: Bot's response text
+            ChatResult: Response text with token usage and upstream timing
             
         Raises:
             RuntimeError: If bot is not initialized
+            RequestCancelled: If cancel was set before the completion finished
         """
         if not self.is_available:
             raise RuntimeError(f"{self.name} is not available. Check GitHub token.")
@@ -131,13 +184,13 @@ class GitHubCopilotBot(BaseBot):
         github_model = self._map_model_name(model or self.default_model)
         
         # Use GitHub Models API directly
-        result = self._chat_request(self.base_url, messages, github_model)
-        if result:
+        result = self._chat_request(self.base_url, messages, github_model, cancel)
+        if result and result.text:
             return result
         
         # Failed
         error_msg = f"{self.name} request failed. Check token permissions."
-        return f"❌ {error_msg}"
+        return ChatResult.error(f"❌ {error_msg}", github_model)
     
     def get_model_info(self) -> Dict[str, any]:
         """Get GitHub Copilot model information"""
@@ -149,9 +202,11 @@ class GitHubCopilotBot(BaseBot):
             "icon": "💻",
             "supported_models": [
                 "gpt-4o",
+                "gpt-4o-mini",
                 "gpt-4-turbo",
                 "gpt-3.5-turbo"
-            ]
+            ],
+            "models": dict(self.models)
         }
     
     def get_display_name(self) -> str:
@@ -7,23 +7,44 @@ import os
 import multiprocessing
 
 # Server socket
-bind = "0.0.0.0:5000"
+# GUNICORN_BIND / GUNICORN_WORKERS let benchmarks/ run this exact config on another port
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
 backlog = 2048
 
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# GUNICORN_THREADS > 1 switches to threaded workers, so requests waiting in
+# the admission queue (admission.py) hold a thread instead of a whole process
+threads = int(os.getenv("GUNICORN_THREADS", 1))
+worker_class = "gthread" if threads > 1 else "sync"
 worker_connections = 1000
 timeout = 120
 keepalive = 5
 
+# Worker recycling
+# Restart each worker after this many requests (jitter spreads the restarts);
+# WORKER_MAX_MEMORY_MB (memory_monitor.py) also recycles workers that grow too large
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+# Application preloading
+# main.py (bots, LDAP manager, init_db, compiled patterns) is imported once in
+# the master and inherited copy-on-write by every worker, so workers start
+# immediately. Network clients are created lazily per worker (see post_fork).
+# Note: with preloading, HUP does not reload code - use a full restart.
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
 # SSL/TLS Configuration
-certfile = os.path.join(os.path.dirname(__file__), "cert.pem")
-keyfile = os.path.join(os.path.dirname(__file__), "key.pem")
+# GUNICORN_NO_TLS=true serves plain HTTP (local benchmarks without certificates)
+if os.getenv("GUNICORN_NO_TLS", "false").lower() != "true":
+    certfile = os.path.join(os.path.dirname(__file__), "cert.pem")
+    keyfile = os.path.join(os.path.dirname(__file__), "key.pem")
 
 # Logging
-accesslog = os.path.join(os.path.dirname(__file__), "logs", "gunicorn-access.log")
-errorlog = os.path.join(os.path.dirname(__file__), "logs", "gunicorn-error.log")
+log_dir = os.getenv("LOG_DIR", os.path.join(os.path.dirname(__file__), "logs"))
+os.makedirs(log_dir, exist_ok=True)
+accesslog = os.path.join(log_dir, "gunicorn-access.log")
+errorlog = os.path.join(log_dir, "gunicorn-error.log")
 loglevel = "info"
 access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"'
 
@@ -42,3 +63,57 @@ tmp_upload_dir = None
 limit_request_line = 4094
 limit_request_fields = 100
 limit_request_field_size = 8190
+
+
+# Server hooks
+def on_starting(server):
+    """Start the log writer in the master, before the app is loaded or workers fork"""
+    # Workers inherit the queue and only enqueue; main.py's setup_logging()
+    # call is then a no-op, with or without preload_app
+    from log_config import setup_logging
+    setup_logging(log_dir)
+
+
+def when_ready(server):
+    """Master finished loading the app: freeze it so forks share pages"""
+    import gc
+    # Moves all existing objects to a permanent generation, so garbage
+    # collections in the workers don't walk (and copy) the inherited pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Give each worker its own network connections and memory tracking"""
+    from bot_manager import reset_bot_connections
+    from memory_monitor import get_memory_monitor
+    reset_bot_connections()
+    get_memory_monitor().worker_started()
+    if not server.cfg.preload_app and server.cfg.workers > 1:
+        # The worker imports main.py after this; shared memory created then is its own
+        from conversation_cache import app_loaded_per_worker
+        app_loaded_per_worker()
+
+
+def post_request(worker, req, environ, resp):
+    """Recycle the worker gracefully once its private memory passes WORKER_MAX_MEMORY_MB"""
+    from memory_monitor import get_memory_monitor
+    if get_memory_monitor().request_finished() and worker.alive:
+        worker.log.warning("Worker %s exceeded WORKER_MAX_MEMORY_MB, restarting after current requests", worker.pid)
+        # Same mechanism as max_requests: the worker exits after finishing in-flight requests
+        worker.alive = False
+
+
+def child_exit(server, worker):
+    """Free admission slots a crashed or timed-out worker still held"""
+    from admission import release_worker_slots
+    from memory_monitor import forget_worker
+    release_worker_slots(worker.pid)
+    forget_worker(worker.pid)
+
+
+def worker_exit(server, worker):
+    """Write queued chat messages, then hand buffered log records to the master"""
+    from message_writer import shutdown_message_writer
+    from log_config import flush_logging
+    shutdown_message_writer()
+    flush_logging()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Large Input
+Map-reduce processing for messages too large for one completion
+
+Oversized pastes (log dumps, source files, device configs) are split on
+structural boundaries, the chunks are completed concurrently within the
+per-provider concurrency limits, and the partial answers are merged in a
+reduce step. Wall time is roughly one chunk plus the reduce, instead of
+one huge prompt that is slow or exceeds the model context.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from base_bot import ChatResult
+from bot_manager import BotManager
+from cancellation import RequestCancelled, request_task
+from batch_runner import DEFAULT_LIMITS, parse_limits
+
+logger = logging.getLogger(__name__)
+
+# Characters per chunk; GitHub Models has the smaller context window
+DEFAULT_CHUNK_CHARS = {"mistral": 48000, "github-copilot": 24000}
+
+# Boundaries tried in order: config sections ("!" lines), blank-line runs, paragraphs, lines, words
+SEPARATORS = ("\n!\n", "\n\n\n", "\n\n", "\n", " ")
+
+# Paragraphs at the start/end of a paste up to this size are treated as the user's instructions
+INSTRUCTION_MAX_CHARS = 1000
+
+# Partial answers are never clipped below this when they have to be shortened for the reduce
+MIN_PARTIAL_CHARS = 200
+
+MAP_PROMPT = (
+    "You are analysing part {index} of {total} of a large input the user pasted. "
+    "Other parts are analysed separately and the answers are merged afterwards.\n"
+    "Answer the user's request for this part only. Be concise, quote exact lines, "
+    "names and values that matter, and reply 'Nothing relevant in this part.' if there is nothing."
+)
+
+REDUCE_PROMPT = (
+    "The user's input ({chars:,} characters) was too large for one request and was analysed "
+    "in {total} parts. Below are the answers for each part.\n\n"
+    "User's request:\n{instruction}\n\n{partials}\n\n"
+    "Combine these into one answer to the user's request. Merge duplicates, keep exact "
+    "identifiers and line quotes, and ignore parts with nothing relevant."
+)
+
+
+def split_text(text: str, max_chars: int, separators=SEPARATORS) -> List[str]:
+    """
+    Split text into chunks of at most max_chars on the strongest boundary available
+
+    Args:
+        text: Text to split
+        max_chars: Maximum chunk size
+        separators: Boundaries to try, strongest first
+
+    Returns:
+        list: Chunks in order; joined they reproduce the input
+    """
+    if len(text) <= max_chars:
+        return [text]
+
+    for position, sep in enumerate(separators):
+        if sep not in text:
+            continue
+        parts = text.split(sep)
+        # Keep the separator with the preceding piece so nothing is lost
+        pieces = [part + sep for part in parts[:-1]] + [parts[-1]]
+
+        chunks: List[str] = []
+        current = ""
+        for piece in pieces:
+            if len(piece) > max_chars:
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.extend(split_text(piece, max_chars, separators[position + 1:]))
+            elif len(current) + len(piece) > max_chars:
+                chunks.append(current)
+                current = piece
+            else:
+                current += piece
+        if current:
+            chunks.append(current)
+        return chunks
+
+    # No boundary left (e.g. minified data): hard cut
+    return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+
+
+def extract_instruction(text: str) -> str:
+    """
+    Guess the user's request inside a large paste
+
+    People write their question before or after the pasted content, so short
+    first/last paragraphs are taken as the instruction.
+
+    Args:
+        text: Full user message
+
+    Returns:
+        str: Instruction text (a generic one if nothing short is found)
+    """
+    paragraphs = [p.strip() for p in text.strip().split("\n\n") if p.strip()]
+    found = []
+    if paragraphs and len(paragraphs[0]) <= INSTRUCTION_MAX_CHARS:
+        found.append(paragraphs[0])
+    if len(paragraphs) > 1 and len(paragraphs[-1]) <= INSTRUCTION_MAX_CHARS:
+        found.append(paragraphs[-1])
+    return "\n...\n".join(found) or "Analyse this input and summarize the important findings."
+
+
+def clip_message(content: str, max_chars: int) -> str:
+    """
+    Shorten an old message for use as conversation history
+
+    Args:
+        content: Message text
+        max_chars: Maximum length kept (head and tail)
+
+    Returns:
+        str: Content, or head + omission marker + tail
+    """
+    if len(content) <= max_chars:
+        return content
+    half = max(max_chars, 0) // 2
+    tail = content[len(content) - half:]
+    return f"{content[:half]}\n[... {len(content) - 2 * half:,} characters omitted ...]\n{tail}"
+
+
+def _pack_sections(partials: List[str], max_chars: int) -> List[str]:
+    """Number partial answers and pack them into as few groups of max_chars as possible"""
+    groups: List[str] = []
+    current = ""
+    for index, text in enumerate(partials, start=1):
+        section = f"### Part {index}\n{clip_message(text, max_chars - 80)}\n\n"
+        if current and len(current) + len(section) > max_chars:
+            groups.append(current)
+            current = ""
+        current += section
+    groups.append(current)
+    return groups
+
+
+def _sum_tokens(results: List[ChatResult], field: str) -> Optional[int]:
+    values = [getattr(r, field) for r in results if getattr(r, field) is not None]
+    return sum(values) if values else None
+
+
+class LargeInputProcessor:
+    """Runs oversized messages through a bot as concurrent chunks plus a reduce step"""
+
+    def __init__(self, manager: BotManager, limits: Optional[Dict[str, int]] = None,
+                 chunk_chars: Optional[Dict[str, int]] = None):
+        """
+        Initialize large input processor
+
+        Args:
+            manager: Bot manager used for completions
+            limits: Max concurrent chunk requests per bot id, shared by all requests in this process
+            chunk_chars: Chunk size per bot id (defaults to DEFAULT_CHUNK_CHARS, 24000 for others)
+        """
+        self.manager = manager
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self.chunk_chars = dict(DEFAULT_CHUNK_CHARS)
+        self.chunk_chars.update(chunk_chars or {})
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._semaphores_lock = threading.Lock()
+
+    def chunk_size(self, bot_id: str) -> int:
+        """Characters per chunk for a bot"""
+        return self.chunk_chars.get(bot_id, 24000)
+
+    def needs_split(self, bot_id: str, text: str) -> bool:
+        """True if text is too large to send to the bot in one request"""
+        return len(text) > self.chunk_size(bot_id)
+
+    def _complete(self, bot_id: str, messages: List[Dict[str, str]], model: Optional[str], cancel=None) -> ChatResult:
+        """One completion, waiting for a free slot in the bot's quota"""
+        with self._semaphores_lock:
+            semaphore = self._semaphores.setdefault(
+                bot_id, threading.BoundedSemaphore(self.limits.get(bot_id, 1))
+            )
+        with semaphore:
+            if cancel is not None:
+                # Chunks still queued for a slot are dropped, not sent
+                cancel.raise_if_cancelled()
+            try:
+                return self.manager.chat_result(bot_id=bot_id, messages=messages, model=model, cancel=cancel)
+            except RequestCancelled:
+                raise
+            except Exception as e:
+                return ChatResult.error(f"❌ Error: {str(e)}")
+
+    def _map(self, bot_id: str, chunks: List[str], instruction: str, model: Optional[str],
+             cancel=None) -> List[ChatResult]:
+        """Complete all chunks concurrently, results in chunk order"""
+        def run(index: int, chunk: str) -> ChatResult:
+            messages = [
+                {"role": "system", "content": MAP_PROMPT.format(index=index, total=len(chunks))},
+                {"role": "user", "content": f"User's request:\n{instruction}\n\n"
+                                            f"Part {index} of {len(chunks)}:\n{chunk}"},
+            ]
+            return self._complete(bot_id, messages, model, cancel)
+
+        with ThreadPoolExecutor(max_workers=min(len(chunks), self.limits.get(bot_id, 1)),
+                                thread_name_prefix=f"large-{bot_id}") as executor:
+            return list(executor.map(request_task(run), range(1, len(chunks) + 1), chunks))
+
+    def _reduce(self, bot_id: str, history: List[Dict[str, str]], partials: List[str], instruction: str,
+                chars: int, total: int, model: Optional[str], spent: List[ChatResult], cancel=None) -> ChatResult:
+        """
+        Merge partial answers; groups that don't fit in one request are merged first
+
+        Every round sends fewer requests than it has partials, so this ends
+        with one reduce prompt that covers every partial answer.
+        """
+        limit = self.chunk_size(bot_id)
+        while True:
+            groups = _pack_sections(partials, limit)
+            if len(groups) == 1:
+                break
+            if len(groups) == len(partials):
+                # Partials too long to pair up: shorten them so a merge round combines several
+                budget = max(MIN_PARTIAL_CHARS, limit // len(partials) - 80)
+                partials = [clip_message(p, budget) for p in partials]
+                groups = _pack_sections(partials, limit)
+                if len(groups) == 1:
+                    break
+                if len(groups) == len(partials):
+                    # Chunk size below two shortened partials: send them all in one oversized prompt
+                    logger.warning("Reducing %d partial answers in one prompt larger than %d characters",
+                                   len(partials), limit)
+                    groups = ["".join(groups)]
+                    break
+            # Too many partial answers for one request: merge them group-wise first
+            merged = self._map(bot_id, groups, instruction, model, cancel)
+            spent.extend(merged)
+            partials = [r.text if r.ok else "(merge failed)" for r in merged]
+
+        prompt = REDUCE_PROMPT.format(chars=chars, total=total, instruction=instruction, partials=groups[0])
+        result = self._complete(bot_id, history + [{"role": "user", "content": prompt}], model, cancel)
+        spent.append(result)
+        return result
+
+    def run(self, bot_id: str, history: List[Dict[str, str]], model: Optional[str] = None,
+            cancel=None) -> ChatResult:
+        """
+        Complete a conversation whose last message is oversized
+
+        Args:
+            bot_id: Bot identifier
+            history: Messages (system prompt, earlier turns, oversized user message last)
+            model: Optional model override
+            cancel: Optional CancelToken; stops all chunk requests when set
+
+        Returns:
+            ChatResult: Merged answer; token counts are summed over all requests
+            and upstream_ms is the wall time of the whole map-reduce
+        """
+        started = time.perf_counter()
+        text = history[-1]["content"]
+        instruction = extract_instruction(text)
+        chunks = split_text(text, self.chunk_size(bot_id))
+
+        mapped = self._map(bot_id, chunks, instruction, model, cancel)
+        spent = list(mapped)
+        failed = [i for i, r in enumerate(mapped, start=1) if not r.ok]
+        if len(failed) == len(mapped):
+            return ChatResult.error(mapped[0].text, upstream_ms=(time.perf_counter() - started) * 1000)
+
+        partials = [f"(part could not be analysed: {r.text})" if not r.ok else r.text for r in mapped]
+        reduced = self._reduce(bot_id, history[:-1], partials, instruction, len(text), len(chunks), model,
+                               spent, cancel)
+
+        answer = reduced.text
+        if reduced.ok:
+            note = f"ℹ️ Large input ({len(text):,} characters) was processed in {len(chunks)} parts"
+            if failed:
+                note += f"; parts {', '.join(map(str, failed))} failed and are missing"
+            answer = f"{note}.\n\n{answer}"
+        return ChatResult(
+            text=answer,
+            model=reduced.model,
+            prompt_tokens=_sum_tokens(spent, "prompt_tokens"),
+            completion_tokens=_sum_tokens(spent, "completion_tokens"),
+            total_tokens=_sum_tokens(spent, "total_tokens"),
+            upstream_ms=round((time.perf_counter() - started) * 1000, 1),
+            ok=reduced.ok,
+        )
+
+    def run_many(self, histories: Dict[str, List[Dict[str, str]]], model: Optional[str] = None,
+                 cancel=None, models: Optional[Dict[str, str]] = None) -> Dict[str, ChatResult]:
+        """
+        Map-reduce the same oversized message on several bots concurrently
+
+        Args:
+            histories: Bot identifier -> message history for that bot
+            model: Optional model override
+            cancel: Optional CancelToken; stops all chunk requests when set
+            models: Optional bot identifier -> model (takes precedence over model)
+
+        Returns:
+            dict: Bot identifier -> merged ChatResult
+        """
+        if not histories:
+            return {}
+        models = models or {}
+        run = request_task(self.run)
+        with ThreadPoolExecutor(max_workers=len(histories), thread_name_prefix="large-many") as executor:
+            futures = {bot_id: executor.submit(run, bot_id, history, models.get(bot_id, model), cancel)
+                       for bot_id, history in histories.items()}
+        return {bot_id: future.result() for bot_id, future in futures.items()}
+
+
+def processor_from_env(manager: BotManager) -> LargeInputProcessor:
+    """
+    Build a processor from environment variables
+
+    Environment:
+        LARGE_INPUT_LIMITS: Concurrent chunk requests per bot, e.g. "mistral=4,github-copilot=2"
+        LARGE_INPUT_CHUNK_CHARS: Chunk size per bot, e.g. "mistral=48000,github-copilot=24000"
+    """
+    return LargeInputProcessor(
+        manager,
+        limits=parse_limits(os.getenv("LARGE_INPUT_LIMITS", "")),
+        chunk_chars=parse_limits(os.getenv("LARGE_INPUT_CHUNK_CHARS", "")),
+    )
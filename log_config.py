@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Logging Configuration
+Queue-based, non-blocking logging pipeline
+
+Request threads only enqueue records. A single listener thread formats them,
+writes logs/azikiai.log as JSON lines, rotates by size and gzips old files.
+The listener runs in the gunicorn master (on_starting hook in
+gunicorn_config.py, before the app is loaded), so the master process is the
+only writer, with or without preload_app.
+
+Each process queues its records in memory and a forwarder thread sends them
+to the master as datagrams over a Unix socket pair inherited by every
+worker. A datagram arrives whole or not at all and no lock is shared
+between processes, so a worker killed mid-send (timeout, memory recycle,
+OOM) cannot block logging in the others.
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import queue
+import pickle
+import shutil
+import socket
+import atexit
+import logging
+import logging.handlers
+import threading
+from typing import Any, Dict, Optional
+
+# Attributes every LogRecord has; anything else came in through extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
+
+# Largest record sent to the writer; longer messages are truncated
+MAX_DATAGRAM = 64 * 1024
+
+_handler: Optional["ForwardingHandler"] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_writer_pid: Optional[int] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+                  + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        # Context fields (request_id, user, bot, duration_ms, ...)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_") and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Attach request id and user to records logged inside a Flask request
+
+    Runs in the calling thread (before the record is queued), which is the
+    only place the request context is available.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        try:
+            from flask import g, has_request_context
+            from flask_login import current_user
+        except ImportError:
+            return True
+
+        if has_request_context():
+            if not hasattr(record, "request_id"):
+                record.request_id = g.get("request_id")
+            if not hasattr(record, "user"):
+                record.user = getattr(current_user, "username", None)
+            if not hasattr(record, "bot") and g.get("bot"):
+                record.bot = g.get("bot")
+        return True
+
+
+def _gzip_namer(name: str) -> str:
+    """azikiai.log.1 -> azikiai.log.1.gz"""
+    return name + ".gz"
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    """Compress the rotated file and remove the original"""
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _plain(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Record fields with values that may not pickle (extra={...}) turned into text"""
+    return {key: value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+            for key, value in fields.items()}
+
+
+def pickle_record(record: logging.LogRecord) -> bytes:
+    """
+    Datagram for a record prepared by QueueHandler (message formatted, args and exc_info cleared)
+
+    Args:
+        record: Prepared log record
+
+    Returns:
+        bytes: Pickled record attributes, at most about MAX_DATAGRAM bytes
+    """
+    fields = dict(vars(record))
+    try:
+        data = pickle.dumps(fields)
+    except Exception:
+        data = pickle.dumps(_plain(fields))
+    if len(data) > MAX_DATAGRAM:
+        fields["msg"] = f"{str(record.msg)[:MAX_DATAGRAM // 2]} [... truncated]"
+        fields["exc_text"] = None
+        data = pickle.dumps(_plain(fields))
+    return data
+
+
+class ForwardingHandler(logging.handlers.QueueHandler):
+    """
+    Queue records in this process; a forwarder thread sends them to the writer
+
+    Queue and thread are per process: a forked worker starts its own with its
+    first record.
+    """
+
+    def __init__(self, sender: socket.socket):
+        """
+        Initialize forwarding handler
+
+        Args:
+            sender: Sending end of the socket pair (shared by all processes)
+        """
+        super().__init__(queue.SimpleQueue())
+        self.sender = sender
+        self._pid = os.getpid()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self._thread is None or self._pid != os.getpid():
+            self._start()
+        self.queue.put(record)
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # Inherited through fork: the parent's thread and queued records stayed behind
+                self.queue = queue.SimpleQueue()
+                self._thread = None
+                self._pid = os.getpid()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._forward, name="log-forwarder", daemon=True)
+                self._thread.start()
+
+    def _forward(self) -> None:
+        """Forwarder thread: send queued records until the None sentinel"""
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            try:
+                self.sender.send(pickle_record(record))
+            except Exception:
+                # One bad record must not stop the thread
+                self.handleError(record)
+
+    def flush_queue(self, timeout: float = 5.0) -> None:
+        """
+        Send everything queued in this process and stop its forwarder thread
+
+        Args:
+            timeout: Longest wait for the thread (the writer may be gone)
+        """
+        with self._start_lock:
+            thread = self._thread if self._pid == os.getpid() else None
+            self._thread = None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join(timeout)
+
+
+class _DatagramQueue:
+    """Receiving end of the socket pair, read by the writer's QueueListener"""
+
+    def __init__(self, receiver: socket.socket, sender: socket.socket):
+        self.receiver = receiver
+        self.sender = sender
+
+    def get(self, block: bool = True) -> Optional[logging.LogRecord]:
+        data = self.receiver.recv(MAX_DATAGRAM * 2)
+        if not data:
+            return None
+        return logging.makeLogRecord(pickle.loads(data))
+
+    def put_nowait(self, item: None) -> None:
+        # QueueListener.stop(): an empty datagram ends the listener thread
+        self.sender.send(b"")
+
+
+def setup_logging(log_dir: str, level: int = logging.INFO) -> None:
+    """
+    Configure root logger with a forwarding handler and start the writer thread
+
+    Only the first call in a process tree does anything: a worker forked
+    after the call inherits the handler and only forwards.
+
+    Args:
+        log_dir: Directory for azikiai.log and its rotated .gz files
+        level: Root log level
+
+    Environment:
+        LOG_FORMAT: "json" (default) or "text" for the log file
+        LOG_MAX_BYTES: Rotate when the file exceeds this size (default 10 MB)
+        LOG_BACKUP_COUNT: Number of compressed files to keep (default 10)
+    """
+    global _handler, _listener, _writer_pid
+    if _listener is not None:
+        return
+
+    os.makedirs(log_dir, exist_ok=True)
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        os.path.join(log_dir, "azikiai.log"),
+        maxBytes=int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+        backupCount=int(os.getenv("LOG_BACKUP_COUNT", 10)),
+        encoding="utf-8",
+    )
+    file_handler.namer = _gzip_namer
+    file_handler.rotator = _gzip_rotator
+    if os.getenv("LOG_FORMAT", "json").lower() == "json":
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    # Datagrams keep records of different workers apart without a shared lock
+    receiver, sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    _handler = ForwardingHandler(sender)
+    _handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+
+    _listener = logging.handlers.QueueListener(
+        _DatagramQueue(receiver, sender), file_handler, console_handler, respect_handler_level=True
+    )
+    _listener.start()
+    _writer_pid = os.getpid()
+    atexit.register(stop_logging)
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _after_fork_in_child() -> None:
+    """Close the inherited receiving socket in a forked worker; it only sends"""
+    if _listener is not None and os.getpid() != _writer_pid:
+        _listener.queue.receiver.close()
+
+
+def flush_logging() -> None:
+    """
+    Send records still queued in this process to the writer
+
+    Call before a forked worker exits; its forwarder thread may still hold
+    records the writer has not received.
+    """
+    if _handler is not None and os.getpid() != _writer_pid:
+        _handler.flush_queue()
+
+
+def stop_logging() -> None:
+    """Drain the queue and stop the writer thread (writer process only)"""
+    global _listener
+    if os.getpid() != _writer_pid:
+        # atexit handlers are inherited by forked workers; they are not the writer
+        flush_logging()
+        return
+    if _listener is not None:
+        # The writer's own records go through its forwarder as well
+        _handler.flush_queue()
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+    _listener = None
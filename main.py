@@ -1,33 +1,49 @@
 #!/usr/bin/env python3
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+from flask import Flask, request, jsonify, render_template, redirect, url_for, send_file, abort, g, Response, session, copy_current_request_context
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_ldap3_login import LDAP3LoginManager
-from flask_ldap3_login.forms import LDAPLoginForm
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 import os
-import sqlite3
 import logging
+import re
+import json
+import sqlite3
+import time
+import uuid
+from functools import wraps
 
 # --- Load .env FIRST before any other imports that need environment variables ---
 load_dotenv()
 
 # Import Bot Manager AFTER loading .env
 from bot_manager import get_bot_manager
+from request_profiler import get_request_profiler
+from log_config import setup_logging
+from batch_runner import BatchRunner, BatchBusy, load_items, parse_limits, read_status as read_batch_status
+from base_bot import ChatResult
+from usage_store import usage_row, aggregate_usage
+from message_writer import get_message_writer
+from conversation_cache import get_conversation_cache
+from retrieval import get_vector_index, context_block
+from message_renderer import get_fragment_cache
+from memory_monitor import get_memory_monitor
+from chat_store import get_chat_store, claim_legacy_rows
+from chat_export import export_records, ndjson_chunks, gzip_chunks
+from large_input import processor_from_env, clip_message
+from model_router import ModelRouter
+from admission import get_admission_controller, AdmissionRejected
+import server_timing
+from server_timing import span
+from cancellation import (CancelToken, DisconnectWatcher, RequestCancelled, run_cancellable,
+                          count as count_cancelled, cancellation_stats)
 
 # --- Configure Logging ---
-log_dir = os.path.join(os.path.dirname(__file__), 'logs')
-os.makedirs(log_dir, exist_ok=True)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(log_dir, 'azikiai.log')),
-        logging.StreamHandler()
-    ]
-)
+# Records are queued and written by a single listener (see log_config.py)
+log_dir = os.getenv('LOG_DIR', os.path.join(os.path.dirname(__file__), 'logs'))
+setup_logging(log_dir)
 logger = logging.getLogger(__name__)
 
 # --- Initialize Bot Manager (handles all AI bots) ---
@@ -35,12 +51,14 @@ try:
     bot_manager = get_bot_manager()
     logger.info("Bot manager initialized successfully")
 except Exception as e:
-    logger.critical(f"Failed to initialize bot manager: {e}")
+    logger.critical("Failed to initialize bot manager: %s", e)
     raise
 
 # --- Flask app ---
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'change-this-secret-key-in-production')
+# Allows load tests (benchmarks/) to switch off per-IP limits
+app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', 'true').lower() == 'true'
 
 # --- Rate Limiting ---
 limiter = Limiter(
@@ -50,6 +68,37 @@ limiter = Limiter(
     storage_uri="memory://"
 )
 
+# --- Server-Timing (see server_timing.py) ---
+# Routes whose responses carry a per-stage Server-Timing header
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING', 'true').lower() == 'true'
+TIMED_ENDPOINTS = {'chat', 'upload', 'history'}
+
+# --- Request context for structured logs ---
+@app.before_request
+def start_request_context():
+    # Honour an upstream proxy's id so log lines can be correlated end to end
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+    # Sync workers reuse one thread: drop whatever a previous request left behind
+    server_timing.finish()
+    if SERVER_TIMING_ENABLED and request.endpoint in TIMED_ENDPOINTS:
+        server_timing.start()
+        with span("auth", "session and user load"):
+            # Decodes the session cookie and runs the user loader; login_required reuses the result
+            current_user.is_authenticated
+
+@app.after_request
+def log_request(response):
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    timings = server_timing.finish()
+    if timings is not None:
+        response.headers['Server-Timing'] = timings.header()
+    if request.endpoint != 'static' and g.get('request_started') is not None:
+        duration_ms = round((time.perf_counter() - g.request_started) * 1000, 1)
+        logger.info("%s %s %s", request.method, request.path, response.status_code,
+                    extra={"status": response.status_code, "duration_ms": duration_ms})
+    return response
+
 # --- LDAP Configuration ---
 app.config['LDAP_HOST'] = os.getenv('LDAP_HOST')
 app.config['LDAP_BASE_DN'] = os.getenv('LDAP_BASE_DN')
@@ -98,35 +147,180 @@ def save_user(dn, username, data, memberships):
     # Create and return user object after successful LDAP authentication
     return User(dn, username, data)
 
+# --- Admin access ---
+# Comma-separated sAMAccountNames allowed to use admin/diagnostic endpoints
+ADMIN_USERS = {u.strip().lower() for u in os.getenv('ADMIN_USERS', '').split(',') if u.strip()}
+
+def is_admin(user) -> bool:
+    """Check if the given user is listed in ADMIN_USERS"""
+    return bool(getattr(user, 'is_authenticated', False)) and getattr(user, 'username', '').lower() in ADMIN_USERS
+
+def admin_required(view):
+    """Restrict a route to ADMIN_USERS (use after @login_required)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin(current_user):
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapper
+
+# --- Worker memory (shared table created here, before workers fork; see memory_monitor.py) ---
+memory_monitor = get_memory_monitor()
+
+# --- Request profiling (opt-in, see request_profiler.py) ---
+request_profiler = get_request_profiler()
+
+def profiled(view):
+    """
+    Run a route under cProfile when sampled or when an admin sends
+    the X-Profile: 1 header / ?profile=1 query flag.
+    Returns the view unchanged when profiling is disabled.
+    """
+    if not request_profiler.enabled:
+        return view
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        flag = request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1'
+        if request_profiler.should_profile(flag and is_admin(current_user)):
+            return request_profiler.run(request.path, view, *args, **kwargs)
+        return view(*args, **kwargs)
+    return wrapper
+
+# --- Admission control (see admission.py) ---
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+admission = get_admission_controller() if ADMISSION_ENABLED else None
+
+def admitted(view):
+    """
+    Hold an admission slot while the view runs (use after @login_required).
+    Over-limit requests get 429/503 with Retry-After instead of a worker.
+    Returns the view unchanged when admission control is disabled.
+    """
+    if admission is None:
+        return view
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        queued_at = time.perf_counter()
+        try:
+            token = admission.acquire(current_user.username)
+        except AdmissionRejected as e:
+            logger.warning("Admission rejected (%s), retry after %ss", e.reason, e.retry_after)
+            if e.reason == "user":
+                message = f"⏳ You already have requests running. Please retry in {e.retry_after} s."
+            else:
+                message = f"⏳ The server is busy. Please retry in {e.retry_after} s."
+            response = jsonify({"response": message, "retry_after": e.retry_after})
+            response.status_code = 429 if e.reason == "user" else 503
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response
+
+        started = time.perf_counter()
+        wait_ms = (started - queued_at) * 1000
+        server_timing.record("queue", wait_ms, "admission")
+        if wait_ms >= 100:
+            logger.info("Admitted after %.0f ms in queue", wait_ms, extra={"queue_wait_ms": round(wait_ms, 1)})
+        try:
+            return view(*args, **kwargs)
+        finally:
+            admission.release(token, (time.perf_counter() - started) * 1000)
+    return wrapper
+
 # --- SQLite setup ---
-db_path = os.path.join(os.path.dirname(__file__), "chat_history.db")
+# Backend chosen by CHAT_STORE (single file or sharded by user, see chat_store.py)
+chat_store = get_chat_store()
+
+def get_db_connection(user_dn=None):
+    """Create a new connection to the database holding the user's rows"""
+    return chat_store.connect_for_user(user_dn)
 
-def get_db_connection():
-    """Create a new database connection"""
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+def user_dn_for(username):
+    """DN a username logs in with (see login())"""
+    return f"CN={username},CN=Users,{os.getenv('LDAP_BASE_DN')}"
 
 def init_db():
-    """Initialize database schema"""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        conn.commit()
-    finally:
-        conn.close()
+    """Initialize database schema in every shard and give legacy rows an owner"""
+    chat_store.init()
+    # Rows from before per-user history: usage rows name their user; the old shared
+    # message history only shows up again if LEGACY_HISTORY_OWNER says whose it is
+    legacy_owner = os.getenv('LEGACY_HISTORY_OWNER')
+    if legacy_owner and '=' not in legacy_owner:
+        legacy_owner = user_dn_for(legacy_owner)
+    claimed = claim_legacy_rows(chat_store, user_dn_for, legacy_owner)
+    if claimed["messages"] or claimed["usage"]:
+        logger.info("Assigned owners to %d legacy messages and %d usage rows",
+                    claimed["messages"], claimed["usage"])
 
 # Initialize database on startup
 init_db()
 
+# --- Write-behind persistence (see message_writer.py) ---
+message_writer = get_message_writer(chat_store)
+
+# Recent messages per user in worker memory, kept current by the writer (see conversation_cache.py)
+conversation_cache = get_conversation_cache()
+message_writer.add_listener(conversation_cache)
+
+# Rendered /history fragments by content hash, per worker
+fragment_cache = get_fragment_cache()
+
+# Hashing-trick vectors of every message, written with them (see retrieval.py)
+vector_index = get_vector_index(chat_store)
+message_writer.add_listener(vector_index)
+
+def note_queued_write():
+    """Remember in the session that this worker has unflushed rows for the user"""
+    session['queued_write'] = [os.getpid(), time.time() + message_writer.flush_interval]
+
+def wait_for_queued_writes():
+    """
+    Read-your-writes across workers: if the user's last write is still
+    queued in another worker, wait until its next flush (at most one
+    flush interval). Rows queued in this worker come from read_view().
+    """
+    pid, visible_at = session.get('queued_write') or (None, 0)
+    if pid is not None and pid != os.getpid():
+        delay = visible_at - time.time()
+        if delay > 0:
+            time.sleep(min(delay, 1.0))
+
+def load_recent_messages(limit: int) -> list:
+    """
+    Last `limit` messages of the current user, including rows still queued for writing
+    
+    Served from the conversation cache when it is current; on a miss a
+    full cache window is loaded from SQLite and cached.
+    
+    Returns:
+        list: (role, content, provider) tuples, oldest first
+    """
+    user_dn = current_user.dn
+    cached = conversation_cache.get(user_dn, limit)
+    if cached is not None:
+        return cached
+    
+    wait_for_queued_writes()
+    window = max(limit, conversation_cache.window)
+    # Taken before reading: any write that races with the read bumps it and put() drops the stale window
+    version = conversation_cache.version(user_dn)
+    with message_writer.read_view(user_dn) as view:
+        conn = get_db_connection(user_dn)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, role, content, provider FROM messages WHERE user_dn = ? "
+                           "ORDER BY id DESC LIMIT ?", (user_dn, window))
+            fetched = cursor.fetchall()
+        finally:
+            conn.close()
+        # Rows committed during the read are in one of the two, never both
+        queued = view.queued(row[0] for row in fetched)
+    rows = [tuple(row)[1:] for row in reversed(fetched)]
+    complete = len(rows) < window
+    rows += queued
+    conversation_cache.put(user_dn, rows, complete, version)
+    return rows[-limit:]
+
 # --- Helper Functions ---
 def detect_language(code: str) -> str:
     """
@@ -155,8 +349,138 @@ def detect_language(code: str) -> str:
     
     return 'plaintext'
 
+# Line patterns used to auto-wrap unfenced code in bot responses.
+# Compiled once at import so preloaded workers share them.
+HTML_TAG_LINE = re.compile(r'^\s*<[^>]+>')
+CODE_KEYWORD_LINE = re.compile(r'^\s*(def|class|function|const|let|var|if|for|while|import|from|#include|public|private)\s')
+ASSIGNMENT_OR_CALL = re.compile(r'^[a-zA-Z_]\w*\s*[=\(]')
+
+def wrap_code_blocks(bot_msg: str) -> str:
+    """
+    Wrap unfenced code in a bot response in ``` fences
+    
+    Args:
+        bot_msg: Response text from a bot
+        
+    Returns:
+        str: Response with detected code blocks fenced
+    """
+    # Auto-detect and wrap code blocks if not already wrapped
+    # Look for common code patterns (indented blocks, function definitions, etc.)
+    # If response doesn't contain triple-backticks but has code-like content
+    if '```' not in bot_msg:
+        # Pattern: Multiple lines starting with common code keywords or significant indentation
+        lines = bot_msg.split('\n')
+        in_code_block = False
+        result_lines = []
+        code_buffer = []
+        
+        for i, line in enumerate(lines):
+            # Detect code: starts with 4+ spaces, HTML tags, regex patterns, or has code keywords at start
+            stripped = line.strip()
+            is_code_line = (
+                line.startswith('    ') or 
+                line.startswith('\t') or
+                HTML_TAG_LINE.match(line) or  # HTML tags
+                (stripped and ('regex' in stripped.lower() or '=/.*/' in stripped or r'\n' in stripped or r'\s' in stripped)) or  # Regex patterns
+                CODE_KEYWORD_LINE.match(line) or
+                (stripped and ASSIGNMENT_OR_CALL.match(stripped))  # assignment or function call
+            )
+            
+            if is_code_line and not in_code_block:
+                # Start code block
+                in_code_block = True
+                code_buffer = [line]
+            elif is_code_line and in_code_block:
+                # Continue code block
+                code_buffer.append(line)
+            elif not is_code_line and in_code_block:
+                # End code block if we have 3+ lines of code
+                if len(code_buffer) >= 3:
+                    # Detect language using helper function
+                    lang = detect_language('\n'.join(code_buffer))
+                    result_lines.append(f'```{lang}')
+                    result_lines.extend(code_buffer)
+                    result_lines.append('```')
+                else:
+                    # Too short, keep as regular text
+                    result_lines.extend(code_buffer)
+                
+                code_buffer = []
+                in_code_block = False
+                result_lines.append(line)
+            else:
+                # Regular text line
+                result_lines.append(line)
+        
+        # Handle any remaining code at end
+        if in_code_block and len(code_buffer) >= 3:
+            lang = detect_language('\n'.join(code_buffer))
+            result_lines.append(f'```{lang}')
+            result_lines.extend(code_buffer)
+            result_lines.append('```')
+        elif code_buffer:
+            result_lines.extend(code_buffer)
+        
+        bot_msg = '\n'.join(result_lines)
+    
+    return bot_msg
+
+# History window per bot - GitHub Models has a smaller context window
+HISTORY_LIMITS = {
+    "github-copilot": 6,  # Only last 3 exchanges (6 messages)
+    "mistral": 20,  # Mistral can handle more
+}
+
+def history_limit_for(bot_id: str) -> int:
+    """Number of past messages sent to the given bot"""
+    return HISTORY_LIMITS.get(bot_id, 20)
+
+# Earlier messages longer than this are shortened in the history (e.g. old pastes)
+HISTORY_MESSAGE_MAX_CHARS = int(os.getenv("HISTORY_MESSAGE_MAX_CHARS", 8000))
+
+# Longer messages are cut; anything over a bot's chunk size goes through map-reduce
+MAX_MESSAGE_CHARS = int(os.getenv("LARGE_INPUT_MAX_CHARS", 1000000))
+large_input = processor_from_env(bot_manager)
+
+# Picks each bot's fast or large model per request (see model_router.py)
+model_router = ModelRouter.from_env(detect_language)
+
+def system_prompt(ai_provider: str) -> str:
+    """System prompt that enforces fenced code blocks"""
+    return f"You are {ai_provider}, a helpful coding assistant. When showing code, you MUST ALWAYS use fenced code blocks with triple backticks (```) and the language name. Example:\n```python\nprint('hello')\n```"
+
+def build_history(rows, bot_id: str, limit: int) -> list:
+    """
+    Build the message history sent to one bot
+    
+    Compare mode stores one answer per bot after the same question. Of
+    such consecutive assistant rows only this bot's own answer (or the
+    first one) is kept, so roles keep alternating. All but the last
+    message are clipped to HISTORY_MESSAGE_MAX_CHARS.
+    
+    Args:
+        rows: (role, content, provider) rows, oldest first
+        bot_id: Bot the history is for
+        limit: Maximum number of messages returned
+        
+    Returns:
+        list: Message dicts with 'role' and 'content'
+    """
+    history = []
+    for role, content, provider in rows:
+        if role == "assistant" and history and history[-1]["role"] == "assistant":
+            if provider == bot_id:
+                history[-1] = {"role": role, "content": content}
+            continue
+        history.append({"role": role, "content": content})
+    history = history[-limit:]
+    for message in history[:-1]:
+        message["content"] = clip_message(message["content"], HISTORY_MESSAGE_MAX_CHARS)
+    return history
+
 # --- Upload folder ---
-UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), "static", "uploads")
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", os.path.join(os.path.dirname(__file__), "static", "uploads"))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 @app.route("/")
@@ -188,7 +512,6 @@ def login():
             # LDAP server configuration from environment
             ldap_host = os.getenv('LDAP_HOST')
             ldap_port = int(os.getenv('LDAP_PORT', 636))
-            base_dn = os.getenv('LDAP_BASE_DN')
             validate_ssl = os.getenv('LDAP_VALIDATE_SSL', 'false').lower() == 'true'
             
             # Create TLS configuration
@@ -197,7 +520,7 @@ def login():
             server = Server(ldap_host, port=ldap_port, use_ssl=True, tls=tls, get_info=ALL)
             
             # Try to authenticate user with full DN
-            user_dn = f"CN={username},CN=Users,{base_dn}"
+            user_dn = user_dn_for(username)
             
             try:
                 # Attempt to bind with user credentials
@@ -209,20 +532,20 @@ def login():
                 # Create user object and log them in
                 user = User(user_dn, username, {})
                 login_user(user)
-                logger.info(f"User {username} logged in successfully")
+                logger.info("User %s logged in successfully", username)
                 return redirect(url_for('index'))
                 
             except LDAPBindError:
                 # Authentication failed
-                logger.warning(f"Failed login attempt for user {username}")
+                logger.warning("Failed login attempt for user %s", username)
                 error_msg = "Invalid username or password"
                 return render_template("login.html", error=error_msg)
                 
         except LDAPException as e:
-            logger.error(f"LDAP connection error: {e}")
+            logger.error("LDAP connection error: %s", e)
             return render_template("login.html", error=f"LDAP Connection Error: {str(e)}")
         except ValueError as e:
-            logger.error(f"Configuration error in login: {e}")
+            logger.error("Configuration error in login: %s", e)
             return render_template("login.html", error=f"Configuration Error: {str(e)}")
     
     return render_template("login.html")
@@ -230,160 +553,253 @@ def login():
 @app.route("/logout")
 @login_required
 def logout():
-    logger.info(f"User {current_user.username if hasattr(current_user, 'username') else 'unknown'} logged out")
+    logger.info("User %s logged out", getattr(current_user, 'username', 'unknown'))
     logout_user()
     return redirect(url_for('login'))
 
+# --- Client disconnects (see cancellation.py) ---
+def client_gone(endpoint: str):
+    """Count a request abandoned by the client; nothing is stored or sent back"""
+    count_cancelled(endpoint)
+    logger.info("Client disconnected, cancelled %s request", endpoint)
+    # 499 = client closed request (nginx convention); the client never sees it
+    return Response(status=499)
+
 @app.route("/chat", methods=["POST"])
 @login_required
 @limiter.limit("30 per minute")
+@admitted
+@profiled
 def chat():
     data = request.get_json()
     user_msg = data.get("message", "")
     ai_model = data.get("ai_model", "mistral")  # Get selected AI model
+    compare = bool(data.get("compare"))  # Ask every available bot at once
+    tier_override = data.get("tier", "auto")  # "auto", "fast" or "large"
     
     if not user_msg:
         return jsonify({"response": "No message sent."})
     
-    # Check if selected bot is available
-    if not bot_manager.is_bot_available(ai_model):
-        bot_names = {"mistral": "Mistral AI", "github-copilot": "GitHub Copilot"}
-        bot_name = bot_names.get(ai_model, ai_model)
-        logger.warning(f"User attempted to use unavailable bot: {ai_model}")
-        return jsonify({
-            "response": f"⚠️ {bot_name} is not configured. Please check your .env file."
-        })
-    
-    # Get the selected bot
-    selected_bot = bot_manager.get_bot(ai_model)
-    ai_provider = selected_bot.name
-    
-    if not user_msg:
-        return jsonify({"response": "No message sent."})
+    if compare:
+        # Only initialized bots are registered in the manager
+        bot_ids = list(bot_manager.bots.keys())
+    else:
+        # Check if selected bot is available
+        if not bot_manager.is_bot_available(ai_model):
+            bot_names = {"mistral": "Mistral AI", "github-copilot": "GitHub Copilot"}
+            bot_name = bot_names.get(ai_model, ai_model)
+            logger.warning("User attempted to use unavailable bot: %s", ai_model)
+            return jsonify({
+                "response": f"⚠️ {bot_name} is not configured. Please check your .env file."
+            })
+        bot_ids = [ai_model]
+    g.bot = ",".join(bot_ids)
     
-    # Warn if message is very long but allow up to 100k chars (Mistral can handle ~32k tokens)
+    # Oversized messages are split and map-reduced below; only absurd sizes are cut
     truncated = False
-    if len(user_msg) > 100000:
-        user_msg = user_msg[:100000]
+    if len(user_msg) > MAX_MESSAGE_CHARS:
+        user_msg = user_msg[:MAX_MESSAGE_CHARS]
         truncated = True
     
-    # Save user message WITHOUT HTML-escaping
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO messages (role, content) VALUES (?, ?)", ("user", user_msg))
-        conn.commit()
-    
-        # Limit history based on AI model
-        # GitHub Models has smaller context window
-        if ai_model == "github-copilot":
-            history_limit = 6  # Only last 3 exchanges (6 messages)
-        else:
-            history_limit = 20  # Mistral can handle more
+    # Queue user message WITHOUT HTML-escaping (written by the background writer)
+    message_writer.enqueue_messages(current_user.dn, [("user", user_msg, None)])
+    note_queued_write()
     
-        cursor.execute("SELECT role, content FROM messages ORDER BY id DESC LIMIT ?", (history_limit,))
-        history = [{"role": role, "content": content} for role, content in reversed(cursor.fetchall())]
-    finally:
-        conn.close()
+    # Fetch extra rows: compare rounds store several answers per question
+    fetch_limit = max(history_limit_for(bot_id) for bot_id in bot_ids) * 2
+    with span("db-read", "recent messages"):
+        rows = load_recent_messages(fetch_limit)
     
-    # Add system prompt to ensure proper code formatting
-    if not history or history[0].get("role") != "system":
-        history.insert(0, {
-            "role": "system",
-            "content": f"You are {ai_provider}, a helpful coding assistant. When showing code, you MUST ALWAYS use fenced code blocks with triple backticks (```) and the language name. Example:\n```python\nprint('hello')\n```"
-        })
+    # Older messages relevant to the question, beyond the recent window
+    retrieved = []
+    if vector_index.enabled:
+        try:
+            with span("db-read", "retrieval"):
+                retrieved = vector_index.retrieve(current_user.dn, user_msg[:4000], exclude={row[1] for row in rows})
+        except sqlite3.Error as e:
+            logger.warning("History retrieval failed: %s", e)
+        if retrieved:
+            logger.info("Retrieved %d older messages", len(retrieved),
+                        extra={"retrieved_scores": [m["score"] for m in retrieved]})
+    context = context_block(retrieved)
     
-    # Use bot manager to get response
-    try:
-        logger.info(f"Chat request using {ai_model} - message length: {len(user_msg)}")
-        bot_msg = bot_manager.chat(
-            bot_id=ai_model,
-            messages=history,
-            model="mistral-small-latest"
-        )
-    except Exception as e:
-        logger.error(f"Error in chat with {ai_model}: {e}")
-        bot_msg = f"❌ Error: {str(e)}"
+    # Per-bot history with a system prompt to ensure proper code formatting
+    histories = {}
+    for bot_id in bot_ids:
+        history = build_history(rows, bot_id, history_limit_for(bot_id))
+        prompt = system_prompt(bot_manager.get_bot(bot_id).name)
+        history.insert(0, {"role": "system", "content": prompt + "\n\n" + context if context else prompt})
+        histories[bot_id] = history
     
-    # Add truncation warning if message was cut
-    if truncated:
-        bot_msg = "⚠️ Your message was truncated to 100,000 characters due to length limits.\n\n" + bot_msg
+    # Pick a model tier per bot from message size, code and history (system prompt and current message excluded)
+    routes = {}
+    for bot_id in bot_ids:
+        route = model_router.classify(user_msg, histories[bot_id][1:-1])
+        routes[bot_id] = model_router.select(bot_manager.get_bot(bot_id), route, tier_override)
+    models = {bot_id: route.model for bot_id, route in routes.items()}
     
-    # Auto-detect and wrap code blocks if not already wrapped
-    # Look for common code patterns (indented blocks, function definitions, etc.)
-    import re
+    # Use bot manager to get response(s)
+    logger.info("Chat request using %s - message length: %d", g.bot, len(user_msg))
+    for bot_id, route in routes.items():
+        logger.info("Routed %s to %s tier (%s)%s", bot_id, route.tier, route.model or "default model",
+                    " by user override" if route.overridden else "",
+                    extra={"tier": route.tier, "model": route.model, "tier_reasons": route.reasons,
+                           "tier_overridden": route.overridden})
+    large = {bot_id: histories[bot_id] for bot_id in bot_ids if large_input.needs_split(bot_id, user_msg)}
     
-    # If response doesn't contain triple-backticks but has code-like content
-    if '```' not in bot_msg:
-        # Pattern: Multiple lines starting with common code keywords or significant indentation
-        lines = bot_msg.split('\n')
-        in_code_block = False
-        result_lines = []
-        code_buffer = []
-        
-        for i, line in enumerate(lines):
-            # Detect code: starts with 4+ spaces, HTML tags, regex patterns, or has code keywords at start
-            stripped = line.strip()
-            is_code_line = (
-                line.startswith('    ') or 
-                line.startswith('\t') or
-                re.match(r'^\s*<[^>]+>', line) or  # HTML tags
-                (stripped and ('regex' in stripped.lower() or '=/.*/' in stripped or r'\n' in stripped or r'\s' in stripped)) or  # Regex patterns
-                re.match(r'^\s*(def|class|function|const|let|var|if|for|while|import|from|#include|public|private)\s', line) or
-                (stripped and re.match(r'^[a-zA-Z_]\w*\s*[=\(]', stripped))  # assignment or function call
-            )
-            
-            if is_code_line and not in_code_block:
-                # Start code block
-                in_code_block = True
-                code_buffer = [line]
-            elif is_code_line and in_code_block:
-                # Continue code block
-                code_buffer.append(line)
-            elif not is_code_line and in_code_block:
-                # End code block if we have 3+ lines of code
-                if len(code_buffer) >= 3:
-                    # Detect language using helper function
-                    lang = detect_language('\n'.join(code_buffer))
-                    result_lines.append(f'```{lang}')
-                    result_lines.extend(code_buffer)
-                    result_lines.append('```')
-                else:
-                    # Too short, keep as regular text
-                    result_lines.extend(code_buffer)
-                
-                code_buffer = []
-                in_code_block = False
-                result_lines.append(line)
-            else:
-                # Regular text line
-                result_lines.append(line)
-        
-        # Handle any remaining code at end
-        if in_code_block and len(code_buffer) >= 3:
-            lang = detect_language('\n'.join(code_buffer))
-            result_lines.append(f'```{lang}')
-            result_lines.extend(code_buffer)
-            result_lines.append('```')
-        elif code_buffer:
-            result_lines.extend(code_buffer)
-        
-        bot_msg = '\n'.join(result_lines)
+    def complete(cancel):
+        if large:
+            # Chunks run concurrently within per-bot limits, then one reduce request each
+            logger.info("Large input mode for %s", ",".join(large))
+            results = large_input.run_many(large, cancel=cancel, models=models)
+            rest = {bot_id: history for bot_id, history in histories.items() if bot_id not in large}
+            results.update(bot_manager.chat_many(rest, cancel=cancel, models=models))
+            return {bot_id: results[bot_id] for bot_id in bot_ids}
+        if compare:
+            # Concurrent fan-out: total latency is the slowest bot, not the sum
+            return bot_manager.chat_many(histories, cancel=cancel, models=models)
+        try:
+            return {ai_model: bot_manager.chat_result(
+                bot_id=ai_model,
+                messages=histories[ai_model],
+                model=models[ai_model],
+                cancel=cancel
+            )}
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            logger.error("Error in chat with %s: %s", ai_model, e)
+            return {ai_model: ChatResult.error(f"❌ Error: {str(e)}")}
     
-    # Save bot response
-    conn = get_db_connection()
+    # Stop waiting (and stop the upstream stream) if the browser goes away
+    cancel = CancelToken()
     try:
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO messages (role, content) VALUES (?, ?)", ("assistant", bot_msg))
-        conn.commit()
-    finally:
-        conn.close()
+        with DisconnectWatcher(request.environ, cancel):
+            # Copied context keeps request_id/user on log records from the helper thread
+            results = run_cancellable(cancel, copy_current_request_context(complete), cancel)
+    except RequestCancelled:
+        return client_gone("chat")
+    
+    answers = {}
+    with span("postprocess", "code wrapper"):
+        for bot_id, result in results.items():
+            bot_msg = result.text
+            # Add truncation warning if message was cut
+            if truncated:
+                bot_msg = f"⚠️ Your message was truncated to {MAX_MESSAGE_CHARS:,} characters due to length limits.\n\n" + bot_msg
+            answers[bot_id] = wrap_code_blocks(bot_msg)
+    
+    # Queue bot response(s), tagged with the bot that produced them, plus token usage
+    with span("db-write", "queued"):
+        message_writer.enqueue_messages(current_user.dn, [("assistant", answer, bot_id) for bot_id, answer in answers.items()])
+        message_writer.enqueue_usage(current_user.dn, [
+            usage_row(current_user.username, "chat", bot_id, result, histories[bot_id], current_user.dn, routes[bot_id].tier)
+            for bot_id, result in results.items()
+        ])
+    note_queued_write()
     
-    return jsonify({"response": bot_msg})
+    if not compare:
+        return jsonify({"response": answers[ai_model], "tier": routes[ai_model].tier, "model": results[ai_model].model})
+    
+    return jsonify({
+        "compare": True,
+        "responses": [
+            {"ai_model": bot_id, "name": bot_manager.get_bot(bot_id).get_display_name(), "response": answer,
+             "tier": routes[bot_id].tier, "model": results[bot_id].model}
+            for bot_id, answer in answers.items()
+        ]
+    })
+
+# --- Batch completions ---
+BATCH_DIR = os.getenv('BATCH_DIR', os.path.join(os.path.dirname(__file__), 'batches'))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 5000))
+batch_runner = BatchRunner(bot_manager, parse_limits(os.getenv('BATCH_LIMITS', '')))
+
+def batch_results_path(batch_id):
+    """Results file of one of the current user's batches"""
+    user_dir = re.sub(r'[^A-Za-z0-9_.-]', '_', current_user.username)
+    return os.path.join(BATCH_DIR, user_dir, f"{batch_id}.jsonl")
+
+def batch_urls(batch_id):
+    return {"status_url": url_for('chat_batch_status', batch_id=batch_id),
+            "results_url": url_for('chat_batch_results', batch_id=batch_id)}
+
+@app.route("/chat/batch", methods=["POST"])
+@login_required
+@limiter.limit("5 per minute")
+def chat_batch():
+    """
+    Start a JSONL batch as a background job in this worker.
+
+    Body is JSONL (or a multipart 'file'). Returns 202 with the batch_id;
+    poll /chat/batch/<id> for progress and fetch /chat/batch/<id>/results.
+    Re-posting with ?batch_id=<id> after an interrupted run skips the
+    items that already succeeded.
+    """
+    batch_id = request.args.get('batch_id') or uuid.uuid4().hex
+    if not re.fullmatch(r'[A-Za-z0-9_-]{1,64}', batch_id):
+        return jsonify({"error": "Invalid batch_id"}), 400
+
+    upload_file = request.files.get('file')
+    body = upload_file.read().decode('utf-8') if upload_file else request.get_data(as_text=True)
+    default_bot = request.args.get('ai_model') or bot_manager.default_bot_id
+    try:
+        items = load_items(body.splitlines(), default_bot)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not items:
+        return jsonify({"error": "No items in batch"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Batch too large ({len(items)} items, max {BATCH_MAX_ITEMS})"}), 400
+    unknown = sorted({item["ai_model"] for item in items if not bot_manager.is_bot_available(item["ai_model"])})
+    if unknown:
+        return jsonify({"error": f"Bots not available: {', '.join(unknown)}"}), 400
+
+    username, user_dn = current_user.username, current_user.dn
+
+    def record_usage(r):
+        message_writer.enqueue_usage(user_dn, [usage_row(username, "batch", r["ai_model"], ChatResult(
+            text="", model=r["model"], prompt_tokens=r["prompt_tokens"],
+            completion_tokens=r["completion_tokens"], total_tokens=r["total_tokens"],
+            upstream_ms=r["upstream_ms"], ok=r["ok"]), user_dn=user_dn)])
+
+    try:
+        status = batch_runner.start(batch_id, items, batch_results_path(batch_id), on_result=record_usage)
+    except BatchBusy:
+        return jsonify({"error": "Batch is already running", "batch_id": batch_id, **batch_urls(batch_id)}), 409
+    logger.info("Batch %s: %d items, %d already finished", batch_id, len(items), status["skipped"])
+
+    return jsonify({**status, **batch_urls(batch_id)}), 202, {
+        "X-Batch-ID": batch_id, "Location": url_for('chat_batch_status', batch_id=batch_id)}
+
+@app.route("/chat/batch/<batch_id>", methods=["GET"])
+@login_required
+def chat_batch_status(batch_id):
+    """Progress of one of the current user's batches"""
+    if not re.fullmatch(r'[A-Za-z0-9_-]{1,64}', batch_id):
+        abort(404)
+    status = read_batch_status(batch_results_path(batch_id))
+    if status is None:
+        return jsonify({"error": "Unknown batch"}), 404
+    return jsonify({**status, **batch_urls(batch_id)})
+
+@app.route("/chat/batch/<batch_id>/results", methods=["GET"])
+@login_required
+def chat_batch_results(batch_id):
+    """JSONL results written so far (complete once the status is "finished")"""
+    if not re.fullmatch(r'[A-Za-z0-9_-]{1,64}', batch_id):
+        abort(404)
+    path = batch_results_path(batch_id)
+    if not os.path.exists(path):
+        return jsonify({"error": "Unknown batch"}), 404
+    return send_file(path, mimetype="application/x-ndjson", max_age=0)
 
 @app.route("/upload", methods=["POST"])
 @login_required
 @limiter.limit("10 per minute")  # Add rate limiting for uploads
+@admitted
+@profiled
 def upload():
     if "screendump" not in request.files:
         return jsonify({"response": "No file uploaded."})
@@ -394,45 +810,189 @@ def upload():
     
     # Save file
     file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(file_path)
+    with span("file-save"):
+        file.save(file_path)
     
     # Analyze image with Mistral Vision
+    vision_result = None
     try:
         bot = bot_manager.get_bot('mistral')
+        g.bot = 'mistral'
         if bot and bot.is_available:
-            response_text = bot.analyze_image(
-                file_path, 
-                prompt="Analyze this screenshot. Describe what you see, identify any text, UI elements, code, or other relevant content."
-            )
+            cancel = CancelToken()
+            with DisconnectWatcher(request.environ, cancel):
+                vision_result = run_cancellable(
+                    cancel, bot.analyze_image_result, file_path,
+                    prompt="Analyze this screenshot. Describe what you see, identify any text, UI elements, code, or other relevant content.",
+                    cancel=cancel
+                )
+            response_text = vision_result.text
         else:
             response_text = f"Screenshot '{file.filename}' received and saved (vision analysis not available)."
+    except RequestCancelled:
+        return client_gone("upload")
     except Exception as e:
-        logger.error(f"Error analyzing image: {str(e)}")
+        logger.error("Error analyzing image: %s", e)
         response_text = f"Screenshot '{file.filename}' received and saved, but analysis failed: {str(e)}"
     
-    # Save message to database
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO messages (role, content) VALUES (?, ?)", ("user", f"[Uploaded screenshot: {file.filename}]"))
-        cursor.execute("INSERT INTO messages (role, content) VALUES (?, ?)", ("assistant", response_text))
-        conn.commit()
-    finally:
-        conn.close()
+    # Queue messages for the database
+    with span("db-write", "queued"):
+        message_writer.enqueue_messages(current_user.dn, [
+            ("user", f"[Uploaded screenshot: {file.filename}]", None),
+            ("assistant", response_text, "mistral"),
+        ])
+        if vision_result:
+            message_writer.enqueue_usage(current_user.dn, [
+                usage_row(current_user.username, "upload", "mistral", vision_result, user_dn=current_user.dn)
+            ])
+    note_queued_write()
     
     return jsonify({"response": response_text})
 
 @app.route("/history", methods=["GET"])
 @login_required
+@profiled
 def history():
-    conn = get_db_connection()
+    """Recent messages with raw content and a pre-rendered HTML fragment (see message_renderer.py)"""
+    with span("db-read", "recent messages"):
+        rows = load_recent_messages(50)
+    with span("render", "message fragments"):
+        history = [{"role": role, "content": content, "provider": provider,
+                    "html": fragment_cache.render(role, content)}
+                   for role, content, provider in rows]
+    return jsonify({"history": history})
+
+@app.route("/history/export", methods=["GET"])
+@login_required
+@limiter.limit("5 per minute")
+def history_export():
+    """
+    Download the current user's whole history as NDJSON (chat_export.py format)
+    
+    Streamed from a database cursor, so size is not limited by memory.
+    ?gzip=1 returns a .ndjson.gz file, ?usage=1 adds the user's token usage rows.
+    """
+    user_dn = current_user.dn
+    # Rows this worker still has queued belong in the export
+    message_writer.wait_until_written(user_dn)
+    wait_for_queued_writes()
+    types = ("message", "usage") if request.args.get("usage") == "1" else ("message",)
+    chunks = ndjson_chunks(export_records(chat_store, user_dn, types))
+    filename = f"chat-history-{secure_filename(current_user.username)}-{time.strftime('%Y%m%d')}.ndjson"
+    mimetype = "application/x-ndjson"
+    if request.args.get("gzip") == "1":
+        chunks, filename, mimetype = gzip_chunks(chunks), filename + ".gz", "application/gzip"
+    logger.info("History export started (%s)", ",".join(types))
+    return Response(chunks, mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.route("/admin/usage", methods=["GET"])
+@login_required
+@admin_required
+def usage():
+    """Token usage aggregates, e.g. /admin/usage?group_by=user,day&days=30"""
+    group_by = [col.strip() for col in request.args.get("group_by", "user,bot").split(",") if col.strip()]
+    days = request.args.get("days", 7, type=int)
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT role, content FROM messages ORDER BY id DESC LIMIT 50")
-        history = [{"role": role, "content": content} for role, content in reversed(cursor.fetchall())]
-        return jsonify({"history": history})
-    finally:
-        conn.close()
+        rows = aggregate_usage(chat_store.connections(), group_by, days=days,
+                               user=request.args.get("user"), bot=request.args.get("bot"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"group_by": group_by, "days": days, "usage": rows})
+
+@app.route("/admin/admission", methods=["GET"])
+@login_required
+@admin_required
+def admission_status():
+    """Admission queue depth, running requests and rejection counters (all workers)"""
+    if admission is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **admission.snapshot()})
+
+@app.route("/admin/fragment-cache", methods=["GET"])
+@login_required
+@admin_required
+def fragment_cache_status():
+    """Rendered message fragment cache of the worker answering this request"""
+    return jsonify(fragment_cache.stats())
+
+@app.route("/admin/conversation-cache", methods=["GET"])
+@login_required
+@admin_required
+def conversation_cache_status():
+    """Hit rate and size of the conversation cache (this worker only)"""
+    return jsonify(conversation_cache.stats())
+
+@app.route("/admin/memory", methods=["GET"])
+@login_required
+@admin_required
+def memory_status():
+    """Private/PSS/RSS memory of every worker, recycle limit and tracemalloc state"""
+    return jsonify(memory_monitor.stats())
+
+@app.route("/admin/memory/allocations", methods=["GET"])
+@login_required
+@admin_required
+def memory_allocations():
+    """
+    Top tracemalloc allocations of the worker answering, e.g.
+    /admin/memory/allocations?limit=20&key_type=traceback&compare=1
+    (compare=1: growth since this worker's previous snapshot)
+    """
+    try:
+        return jsonify(memory_monitor.top_allocations(
+            limit=request.args.get("limit", 20, type=int),
+            key_type=request.args.get("key_type", "lineno"),
+            compare=request.args.get("compare") == "1",
+        ))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": f"{e} in worker {os.getpid()}; set MEMORY_TRACEMALLOC or POST /admin/memory/tracemalloc"}), 409
+
+@app.route("/admin/memory/tracemalloc", methods=["POST"])
+@login_required
+@admin_required
+def memory_tracemalloc():
+    """Start (?action=start&frames=N) or stop (?action=stop) tracemalloc in the worker answering"""
+    action = request.args.get("action", "start")
+    if action == "start":
+        changed = memory_monitor.start_tracing(request.args.get("frames", 1, type=int))
+    elif action == "stop":
+        changed = memory_monitor.stop_tracing()
+    else:
+        return jsonify({"error": "action must be start or stop"}), 400
+    return jsonify({"pid": os.getpid(), "action": action, "changed": changed})
+
+@app.route("/admin/cancellations", methods=["GET"])
+@login_required
+@admin_required
+def cancellations():
+    """Requests cancelled because the client disconnected (all workers)"""
+    return jsonify(cancellation_stats())
+
+@app.route("/admin/profiles", methods=["GET"])
+@login_required
+@admin_required
+def profiles():
+    limit = request.args.get("limit", 50, type=int)
+    return jsonify({
+        "enabled": request_profiler.enabled,
+        "sample_rate": request_profiler.sample_rate,
+        "profiles": request_profiler.list_captures(limit=limit)
+    })
+
+@app.route("/admin/profiles/<name>", methods=["GET"])
+@login_required
+@admin_required
+def profile_download(name):
+    # ?format=txt for the readable call tree, default is the pstats dump
+    ext = ".txt" if request.args.get("format") == "txt" else ".prof"
+    path = request_profiler.capture_path(name, ext)
+    if not path:
+        abort(404)
+    return send_file(path, mimetype="text/plain" if ext == ".txt" else "application/octet-stream",
+                     as_attachment=(ext == ".prof"))
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=False, ssl_context=('cert.pem','key.pem'))
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Memory Monitor
+Per-worker memory tracking, allocation snapshots and memory-based recycling
+
+Workers record their memory in a shared table (created at import, i.e. in
+the gunicorn master with preload_app) every MEMORY_CHECK_EVERY requests,
+so one admin request shows all workers. The recycle threshold uses private
+memory (pages not shared copy-on-write with the preloaded master): RSS
+also counts the inherited app pages, which cost nothing extra per worker.
+
+Allocation tracking uses tracemalloc, off by default because it slows
+allocations. Start it per worker with MEMORY_TRACEMALLOC=<frames> or on
+demand through /admin/memory/tracemalloc.
+"""
+
+import os
+import time
+import threading
+import tracemalloc
+import multiprocessing
+from typing import Any, Dict, Optional
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Fields per worker in the shared table
+_FIELDS = ("pid", "rss", "pss", "private", "peak_private", "requests", "updated", "recycling")
+
+# tracemalloc statistic groupings accepted by top_allocations()
+KEY_TYPES = ("lineno", "filename", "traceback")
+
+
+def read_memory(pid: Optional[int] = None) -> Dict[str, int]:
+    """
+    Resident, proportional and private memory of a process in bytes
+
+    Uses /proc/<pid>/smaps_rollup (Linux 4.14+), then /proc/<pid>/statm
+    (RSS only, private = RSS), then the peak RSS from getrusage for the
+    current process.
+
+    Args:
+        pid: Process id (default: current process)
+
+    Returns:
+        dict: "rss", "pss" and "private" in bytes (0 if unknown)
+    """
+    proc = f"/proc/{pid or 'self'}"
+    try:
+        values = {}
+        with open(f"{proc}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    values[parts[0].rstrip(":")] = int(parts[1]) * 1024
+        return {
+            "rss": values.get("Rss", 0),
+            "pss": values.get("Pss", 0),
+            "private": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+        }
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(f"{proc}/statm") as f:
+            rss = int(f.read().split()[1]) * PAGE_SIZE
+        return {"rss": rss, "pss": rss, "private": rss}
+    except (OSError, ValueError, IndexError):
+        pass
+    if pid is None or pid == os.getpid():
+        import resource
+        # Peak, not current; KiB on Linux
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return {"rss": rss, "pss": rss, "private": rss}
+    return {"rss": 0, "pss": 0, "private": 0}
+
+
+class MemoryMonitor:
+    """Shared per-worker memory table plus tracemalloc helpers for this process"""
+
+    def __init__(self, max_private_mb: int = 1024, check_every: int = 10, tracemalloc_frames: int = 0,
+                 slots: int = 64):
+        """
+        Initialize memory monitor (before forking workers)
+
+        Args:
+            max_private_mb: Recycle a worker whose private memory exceeds this; 0 disables
+            check_every: Requests between memory readings in a worker
+            tracemalloc_frames: Start tracemalloc with this many frames in each worker; 0 = off
+            slots: Maximum number of workers tracked
+        """
+        self.max_private = max_private_mb * 1024 * 1024
+        self.check_every = max(1, check_every)
+        self.tracemalloc_frames = tracemalloc_frames
+        self.slots = slots
+        self._table = multiprocessing.RawArray("q", slots * len(_FIELDS))
+        self._table_lock = multiprocessing.Lock()
+        self._recycled = multiprocessing.RawValue("q", 0)
+
+        self._pid: Optional[int] = None
+        self._requests = 0
+        self._recycling = False
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._snapshot_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "MemoryMonitor":
+        """
+        Build monitor from environment variables
+
+        Returns:
+            MemoryMonitor: Configured monitor
+        """
+        return cls(
+            max_private_mb=int(os.getenv("WORKER_MAX_MEMORY_MB", 1024)),
+            check_every=int(os.getenv("MEMORY_CHECK_EVERY", 10)),
+            tracemalloc_frames=int(os.getenv("MEMORY_TRACEMALLOC", 0)),
+        )
+
+    # --- shared table (call with self._table_lock held) ---
+
+    def _row(self, index: int) -> Dict[str, int]:
+        base = index * len(_FIELDS)
+        return dict(zip(_FIELDS, self._table[base:base + len(_FIELDS)]))
+
+    def _slot_for(self, pid: int) -> Optional[int]:
+        free = None
+        for i in range(self.slots):
+            slot_pid = self._table[i * len(_FIELDS)]
+            if slot_pid == pid:
+                return i
+            if slot_pid == 0 and free is None:
+                free = i
+        return free
+
+    def _store(self, pid: int, memory: Dict[str, int], requests: int, recycling: bool) -> None:
+        with self._table_lock:
+            index = self._slot_for(pid)
+            if index is None:
+                return
+            previous = self._row(index)
+            peak = max(memory["private"], previous["peak_private"] if previous["pid"] == pid else 0)
+            base = index * len(_FIELDS)
+            self._table[base:base + len(_FIELDS)] = [
+                pid, memory["rss"], memory["pss"], memory["private"], peak, requests, int(time.time()),
+                1 if recycling else 0,
+            ]
+
+    def forget(self, pid: int) -> None:
+        """Drop a worker from the table (gunicorn child_exit hook, runs in the master)"""
+        with self._table_lock:
+            for i in range(self.slots):
+                if self._table[i * len(_FIELDS)] == pid:
+                    base = i * len(_FIELDS)
+                    self._table[base:base + len(_FIELDS)] = [0] * len(_FIELDS)
+
+    # --- worker side ---
+
+    def worker_started(self) -> None:
+        """Record the new worker and start tracemalloc if configured (post_fork hook)"""
+        self._pid = os.getpid()
+        self._requests = 0
+        self._recycling = False
+        self._snapshot = None
+        if self.tracemalloc_frames > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(self.tracemalloc_frames)
+        self._store(os.getpid(), read_memory(), 0, False)
+
+    def request_finished(self) -> bool:
+        """
+        Count a request and check memory every check_every requests
+
+        Returns:
+            bool: True if the worker exceeded the limit and should be recycled
+        """
+        if self._pid != os.getpid():
+            # No post_fork hook ran (e.g. app not preloaded)
+            self.worker_started()
+        self._requests += 1
+        if self._requests % self.check_every:
+            return False
+        memory = read_memory()
+        recycle = bool(self.max_private) and memory["private"] > self.max_private
+        self._store(os.getpid(), memory, self._requests, recycle)
+        if recycle and not self._recycling:
+            self._recycling = True
+            with self._table_lock:
+                self._recycled.value += 1
+        return recycle
+
+    # --- tracemalloc ---
+
+    def start_tracing(self, frames: int = 1) -> bool:
+        """
+        Start tracemalloc in this process
+
+        Returns:
+            bool: False if it was already running
+        """
+        if tracemalloc.is_tracing():
+            return False
+        tracemalloc.start(max(1, frames))
+        return True
+
+    def stop_tracing(self) -> bool:
+        """
+        Stop tracemalloc in this process and drop the stored snapshot
+
+        Returns:
+            bool: False if it was not running
+        """
+        with self._snapshot_lock:
+            self._snapshot = None
+        if not tracemalloc.is_tracing():
+            return False
+        tracemalloc.stop()
+        return True
+
+    def top_allocations(self, limit: int = 20, key_type: str = "lineno", compare: bool = False) -> Dict[str, Any]:
+        """
+        Largest live allocations in this process
+
+        Args:
+            limit: Number of entries
+            key_type: "lineno", "filename" or "traceback"
+            compare: Report growth since the previous snapshot instead of totals
+
+        Returns:
+            dict: Traced totals and top entries (size/count, and their diffs when comparing)
+
+        Raises:
+            RuntimeError: If tracemalloc is not running
+            ValueError: On unknown key_type
+        """
+        if key_type not in KEY_TYPES:
+            raise ValueError(f"Unknown key_type '{key_type}'. Choose from: {', '.join(KEY_TYPES)}")
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running")
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        with self._snapshot_lock:
+            previous, self._snapshot = self._snapshot, snapshot
+
+        if compare and previous is not None:
+            stats = snapshot.compare_to(previous, key_type)[:limit]
+            top = [{"where": _where(stat.traceback, key_type), "size": stat.size, "size_diff": stat.size_diff,
+                    "count": stat.count, "count_diff": stat.count_diff} for stat in stats]
+        else:
+            stats = snapshot.statistics(key_type)[:limit]
+            top = [{"where": _where(stat.traceback, key_type), "size": stat.size, "count": stat.count}
+                   for stat in stats]
+
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "pid": os.getpid(),
+            "traced_bytes": current,
+            "traced_peak_bytes": peak,
+            "frames": tracemalloc.get_traceback_limit(),
+            "compared": compare and previous is not None,
+            "top": top,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Memory of all workers plus this process
+
+        Returns:
+            dict: Limits, this process's current memory and tracemalloc state, and one row per worker
+        """
+        with self._table_lock:
+            workers = [row for row in (self._row(i) for i in range(self.slots)) if row["pid"]]
+            recycled = self._recycled.value
+        for row in workers:
+            row["recycling"] = bool(row["recycling"])
+        traced = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else None
+        return {
+            "limits": {"max_private_bytes": self.max_private, "check_every": self.check_every},
+            "recycled": recycled,
+            "this_worker": {
+                "pid": os.getpid(),
+                **read_memory(),
+                "tracemalloc": {"tracing": traced is not None,
+                                "traced_bytes": traced[0] if traced else None,
+                                "traced_peak_bytes": traced[1] if traced else None},
+            },
+            "workers": sorted(workers, key=lambda row: row["private"], reverse=True),
+        }
+
+
+def _where(traceback: tracemalloc.Traceback, key_type: str) -> Any:
+    """Readable location: "file:line", file name, or list of frames (innermost last)"""
+    if key_type == "filename":
+        return traceback[0].filename
+    if key_type == "traceback":
+        return [f"{frame.filename}:{frame.lineno}" for frame in traceback]
+    return f"{traceback[0].filename}:{traceback[0].lineno}"
+
+
+# Global singleton instance
+_memory_monitor: Optional[MemoryMonitor] = None
+
+
+def get_memory_monitor() -> MemoryMonitor:
+    """
+    Get global memory monitor instance (singleton)
+
+    Returns:
+        MemoryMonitor: Global monitor configured from environment
+    """
+    global _memory_monitor
+    if _memory_monitor is None:
+        _memory_monitor = MemoryMonitor.from_env()
+    return _memory_monitor
+
+
+def forget_worker(pid: int) -> None:
+    """
+    Remove an exited worker from the table (gunicorn child_exit hook)
+
+    No-op if the monitor was not created before forking.
+    """
+    if _memory_monitor is not None:
+        _memory_monitor.forget(pid)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Message Renderer
+Server-side pre-rendering of stored messages into HTML fragments
+
+A Python port of the browser's message-parser.js / code-detector.js path
+(appendMessage() and the pasted-code branch of sendMessage()). /history
+returns one fragment per message, so a page load inserts ready markup
+instead of parsing every message in JavaScript. Fragments hold only
+escaped content and fixed markup; things that differ per page (code
+block numbers, ids, click handlers) are filled in by the client.
+
+Syntax highlighting stays in the browser: the Prism grammars (including
+the Cisco one) exist only in JavaScript, and the client highlights a
+block once it scrolls into view. Prism token classes do not depend on
+the theme, so a theme switch never invalidates a fragment.
+
+Fragments are cached per worker by a hash of role and content. Rendering
+is a pure function of both, so entries never go stale; RENDER_VERSION is
+part of the key and must be bumped whenever the markup changes.
+"""
+
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Bump when the generated markup changes; old cache entries are then never hit again
+RENDER_VERSION = 1
+
+# Language names accepted by getPrismLanguage() in code-detector.js
+PRISM_LANGUAGES = {
+    "html": "markup", "xml": "markup", "js": "javascript", "py": "python", "python": "python",
+    "cpp": "cpp", "c": "c", "java": "java", "css": "css", "json": "json", "bash": "bash",
+    "sh": "bash", "shell": "bash", "sql": "sql", "cisco": "cisco", "ios": "cisco",
+    "plaintext": "plaintext", "text": "plaintext", "": "plaintext",
+}
+
+# Fence languages that are re-checked for Cisco config (models often label it wrongly)
+CISCO_CANDIDATES = ("", "plaintext", "text", "bash", "shell")
+
+FENCE = re.compile(r"^\s*```\s*(.*)$")
+PROMPT = re.compile(r"^[\w.-]+[#>]", re.M | re.A)
+PROMPT_WITH_SPACE = re.compile(r"^[\w.-]+[#>]\s", re.M | re.A)
+CONFIG_COMMANDS = re.compile(
+    r"^(interface|switchport|ip address|router|crypto|access-list|!\s|vlan|hostname|enable|line vty|line console)",
+    re.M)
+CSS_RULE = re.compile(r"[#.]\w+\s*\{", re.A)
+
+
+def escape_html(text: str) -> str:
+    """Same escaping as escapeHtml() in message-parser.js"""
+    return (text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            .replace('"', "&quot;").replace("'", "&#039;"))
+
+
+def parse_message(text: str) -> List[Dict[str, str]]:
+    """
+    Split a message into text and fenced code blocks (parseMessage() in message-parser.js)
+
+    Args:
+        text: Message content
+
+    Returns:
+        list: {"type": "text", "content"} and {"type": "code", "language", "content"} dicts
+    """
+    blocks: List[Dict[str, str]] = []
+    in_code = False
+    lang = "plaintext"
+    code_lines: List[str] = []
+    text_lines: List[str] = []
+
+    def flush_text() -> None:
+        content = "\n".join(text_lines).strip()
+        if content:
+            blocks.append({"type": "text", "content": content})
+        text_lines.clear()
+
+    def flush_code() -> None:
+        nonlocal lang
+        if code_lines:
+            blocks.append({"type": "code", "language": lang or "plaintext", "content": "\n".join(code_lines)})
+            code_lines.clear()
+            lang = "plaintext"
+
+    for line in re.sub(r"\r\n?", "\n", text).split("\n"):
+        fence = FENCE.match(line)
+        if fence:
+            if not in_code:
+                flush_text()
+                lang = fence.group(1).strip()
+                in_code = True
+            else:
+                flush_code()
+                in_code = False
+            continue
+        (code_lines if in_code else text_lines).append(line)
+
+    if in_code:
+        flush_code()
+    else:
+        flush_text()
+    return blocks
+
+
+def prism_language(lang: str) -> str:
+    """Prism grammar name for a fence language (getPrismLanguage())"""
+    return PRISM_LANGUAGES.get(lang.lower(), "plaintext")
+
+
+def detect_cisco_in_content(content: str) -> Optional[str]:
+    """'cisco' if a code block looks like IOS config or CLI output (detectCiscoInContent())"""
+    lower = content.lower()
+    if (PROMPT.search(lower) or "interface " in lower or "switchport " in lower or "ip address" in lower
+            or "gigabitethernet" in lower or "fastethernet" in lower or "ethernet" in lower
+            or ("vlan" in lower and "!" in content)):
+        return "cisco"
+    return None
+
+
+def detect_cisco_config(value: str) -> bool:
+    """True if pasted text is Cisco IOS config (detectCiscoConfig())"""
+    lower = value.lower()
+    has_config_commands = CONFIG_COMMANDS.search(value)
+    has_keywords = ("interface " in lower or "switchport " in lower or "ip address" in lower
+                    or "gigabitethernet" in lower or "fastethernet" in lower or ("vlan" in lower and "!" in value))
+    return bool(has_config_commands and (PROMPT_WITH_SPACE.search(value) or has_keywords))
+
+
+def detect_language(value: str) -> Optional[str]:
+    """
+    Language of a pasted message (detectLanguage() in code-detector.js)
+
+    Returns:
+        str: Language name, or None if the message is not code
+    """
+    if re.search(r"^\s*```", value, re.M):
+        blocks = parse_message(value)
+        if blocks and blocks[0]["type"] == "code":
+            return blocks[0]["language"] or "javascript"
+        return None
+    lower = value.lower()
+    if detect_cisco_config(value):
+        return "cisco"
+    if "<!doctype" in lower or "<html" in lower or "<head" in lower or "</html>" in lower:
+        return "html"
+    if CSS_RULE.search(value) or ("{" in value and "}" in value and ":" in value and ";" in value
+                                  and len(value.split("\n")) > 2):
+        return "css"
+    if ("def " in value and ":" in value) or ("import " in value and "import {" not in value) \
+            or "print(" in value or "self." in value:
+        return "python"
+    if "SELECT " in value or "INSERT INTO" in value or "CREATE TABLE" in value:
+        return "sql"
+    return None
+
+
+def is_pasted_code(text: str) -> bool:
+    """True if the chat UI shows a user message in the pasted code panel (see sendMessage())"""
+    lower = text.lower()
+    cisco = (PROMPT.search(text) or "interface " in lower or "switchport " in lower or "ip address" in lower
+             or ("vlan" in lower and "!" in text))
+    return "```" in text or bool(cisco and len(text.split("\n")) > 3)
+
+
+def _code_block(panel: str, label: str, lang: str, content: str) -> str:
+    prism = prism_language(lang)
+    return (f'<div class="codeblock" data-panel="{panel}">'
+            f'<div class="code-header"><span class="code-language">{escape_html(label.upper())}</span>'
+            f'<button class="copy-btn">Copy</button></div>'
+            f'<div class="copy-feedback">Copied!</div>'
+            f'<pre class="language-{prism}"><code class="language-{prism}">{escape_html(content)}</code></pre></div>')
+
+
+def render_message(role: str, content: str) -> str:
+    """
+    HTML fragment of one stored message
+
+    Top-level elements are chat entries (div.message) and code blocks
+    (div.codeblock with data-panel "output" or "input"), each code block
+    directly after the chat entry that links to it. The client numbers
+    the code blocks and moves them into their panel.
+
+    Args:
+        role: "user" or "assistant"
+        content: Message content as stored
+
+    Returns:
+        str: Sanitized HTML (all content escaped)
+    """
+    role = "user" if role == "user" else "assistant"
+    if role == "user" and is_pasted_code(content.strip()):
+        text = content.strip()
+        lang = detect_language(text) or ""
+        return ('<div class="message user">Code input ← <span class="code-indicator"></span></div>'
+                + _code_block("input", lang or "plaintext", lang, text))
+
+    parts = []
+    for block in parse_message(content):
+        if block["type"] == "text":
+            parts.append(f'<div class="message {role}">{escape_html(block["content"]).replace(chr(10), "<br>")}</div>')
+            continue
+        lang = block["language"]
+        if lang in CISCO_CANDIDATES:
+            lang = detect_cisco_in_content(block["content"]) or lang or "plaintext"
+        parts.append('<div class="message assistant">Code output → <span class="code-indicator"></span></div>')
+        # Same as the client: a ``` inside a block must not read as a fence when copied back
+        parts.append(_code_block("output", lang, lang, block["content"].replace("```", "``\\`")))
+    return "".join(parts)
+
+
+class FragmentCache:
+    """LRU of rendered fragments by content hash, bounded by total size"""
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        """
+        Initialize fragment cache
+
+        Args:
+            max_bytes: Approximate memory budget per worker; 0 renders every time
+        """
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[bytes, str]" = OrderedDict()
+        self._bytes = 0
+        self._pid = os.getpid()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls) -> "FragmentCache":
+        """
+        Build cache from environment variables
+
+        Returns:
+            FragmentCache: Configured cache
+        """
+        return cls(max_bytes=int(float(os.getenv("FRAGMENT_CACHE_MB", 16)) * 1024 * 1024))
+
+    def _local(self) -> None:
+        """Drop entries inherited through fork (call with self._lock held)"""
+        if self._pid != os.getpid():
+            self._entries.clear()
+            self._bytes = 0
+            self._pid = os.getpid()
+            self._stats = dict.fromkeys(self._stats, 0)
+
+    def render(self, role: str, content: str) -> str:
+        """
+        Cached render_message()
+
+        Args:
+            role: "user" or "assistant"
+            content: Message content as stored
+
+        Returns:
+            str: HTML fragment
+        """
+        key = hashlib.sha1(f"{RENDER_VERSION}\0{role}\0{content}".encode("utf-8", "surrogatepass")).digest()
+        with self._lock:
+            self._local()
+            fragment = self._entries.get(key)
+            if fragment is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return fragment
+            self._stats["misses"] += 1
+
+        fragment = render_message(role, content)
+        size = len(fragment) + 100
+        if size > self.max_bytes:
+            return fragment
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = fragment
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= len(evicted) + 100
+                    self._stats["evictions"] += 1
+        return fragment
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Counters of this worker since it started
+
+        Returns:
+            dict: pid, entries, bytes, max_bytes, render version and hits/misses/evictions
+        """
+        with self._lock:
+            self._local()
+            return {
+                "pid": os.getpid(),
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "render_version": RENDER_VERSION,
+                **self._stats,
+            }
+
+
+# Global singleton instance
+_fragment_cache: Optional[FragmentCache] = None
+
+
+def get_fragment_cache() -> FragmentCache:
+    """
+    Get global fragment cache instance (singleton)
+
+    Returns:
+        FragmentCache: Global cache configured from environment
+    """
+    global _fragment_cache
+    if _fragment_cache is None:
+        _fragment_cache = FragmentCache.from_env()
+    return _fragment_cache
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Message Writer
+Write-behind persistence for chat messages and usage rows
+
+Request handlers enqueue rows and return immediately. A background thread
+per worker process writes everything queued in one transaction per shard
+of the chat store every flush interval (or sooner when the batch threshold
+is reached). Readers use read_view() to see rows that are queued but not
+yet committed; they never wait for a flush, which may be stuck on a busy
+database for the whole busy timeout. Listeners (the conversation cache)
+are told when messages are queued and when they are committed.
+
+A row that cannot be written (say a lone surrogate in the content, which
+SQLite cannot encode) is logged and dropped, so it never blocks the rows
+queued behind it. Rows failing because the database is busy stay queued.
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from chat_store import ChatStore
+from usage_store import insert_usage
+
+logger = logging.getLogger(__name__)
+
+
+def utc_timestamp() -> str:
+    """Current time in SQLite CURRENT_TIMESTAMP format (UTC)"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+
+class MessageWriter:
+    """Batches message/usage inserts into periodic transactions"""
+
+    def __init__(self, store: ChatStore, flush_interval: float = 0.2, max_batch: int = 200):
+        """
+        Initialize message writer
+
+        Args:
+            store: Chat store the rows are written to
+            flush_interval: Seconds between background flushes
+            max_batch: Queue length that triggers an immediate flush
+        """
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        # Guards _pending/_in_flight/_ids/_views; only held for list operations
+        self._pending_lock = threading.Lock()
+        # Held for a whole flush, so flushes don't overlap; readers never take it
+        self._flush_lock = threading.RLock()
+        # (kind, user_dn, row) entries
+        self._pending: List[Tuple[str, Optional[str], tuple]] = []
+        self._in_flight: List[Tuple[str, Optional[str], tuple]] = []
+        # id(entry) -> (entry, message id, view generation at commit) of committed messages
+        # that an open read view may still hold; the entry is kept so its id is not reused
+        self._ids: Dict[int, Tuple[tuple, int, int]] = {}
+        # Generations of the open read views
+        self._views: Set[int] = set()
+        self._view_generation = 0
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        # Shard index -> connection, owned by the thread that opened them
+        self._conns: Dict[int, sqlite3.Connection] = {}
+        self._conns_owner: Optional[int] = None
+        self._listeners: List[Any] = []
+
+    def add_listener(self, listener: Any) -> None:
+        """
+        Register an object notified of message writes
+
+        Listeners implement any of:
+        - messages_queued(user_dn, rows): runs under the queue lock as rows
+          are queued, so it is atomic with respect to read_view()
+        - messages_inserted(cursor, rows): runs inside the shard transaction
+          with (message_id, content, user_dn) rows, e.g. to index them
+        - messages_committed(user_dns): runs after each shard commit
+        - messages_dropped(user_dns): queued messages of these users could
+          not be written and were discarded
+
+        Args:
+            listener: ConversationCache, VectorIndex, ...
+        """
+        self._listeners.append(listener)
+
+    def _running(self) -> bool:
+        return self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()
+
+    def _ensure_thread(self) -> None:
+        """Start the writer thread in this process (lazily, so it starts post-fork), or restart it"""
+        if self._running():
+            return
+        with self._pending_lock:
+            if self._running():
+                return
+            if self._pid != os.getpid():
+                if self._pid is not None:
+                    # Forked from a process that had queued rows: those belong to the parent
+                    self._pending, self._in_flight, self._conns = [], [], {}
+                    self._ids, self._views = {}, set()
+                atexit.register(self.stop)
+            elif self._thread is not None:
+                logger.error("Message writer thread died, restarting it")
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+            self._thread.start()
+
+    def enqueue_messages(self, user_dn: Optional[str], rows: List[Tuple[str, str, Optional[str]]]) -> None:
+        """
+        Queue message rows for insertion
+
+        Args:
+            user_dn: Owner of the conversation (selects the shard)
+            rows: (role, content, provider) tuples, in conversation order
+        """
+        stamp = utc_timestamp()
+        self._enqueue([("messages", user_dn, (role, content, provider, stamp, user_dn))
+                       for role, content, provider in rows])
+
+    def enqueue_usage(self, user_dn: Optional[str], rows: List[tuple]) -> None:
+        """
+        Queue usage rows for insertion
+
+        Args:
+            user_dn: User the requests belong to (selects the shard)
+            rows: Tuples from usage_store.usage_row()
+        """
+        self._enqueue([("usage", user_dn, row) for row in rows])
+
+    def _enqueue(self, entries: List[Tuple[str, Optional[str], tuple]]) -> None:
+        if not entries:
+            return
+        self._ensure_thread()
+        with self._pending_lock:
+            self._pending.extend(entries)
+            full = len(self._pending) >= self.max_batch
+            if self._listeners:
+                queued: Dict[Optional[str], List[Tuple[str, str, Optional[str]]]] = {}
+                for kind, dn, row in entries:
+                    if kind == "messages":
+                        queued.setdefault(dn, []).append(row[:3])
+                for dn, rows in queued.items():
+                    for listener in self._listeners:
+                        if hasattr(listener, "messages_queued"):
+                            listener.messages_queued(dn, rows)
+        if full:
+            self._wake.set()
+
+    @contextmanager
+    def read_view(self, user_dn: Optional[str]) -> Iterator["ReadView"]:
+        """
+        Consistent view over committed and queued messages of one user
+
+        The queued rows are taken when the context opens. Rows the writer
+        commits while the caller reads the database are matched by message
+        id, so the read plus ReadView.queued() contain every message exactly
+        once. Only the queue lock is taken, never the flush lock.
+
+        Args:
+            user_dn: Owner of the conversation
+
+        Yields:
+            ReadView: Call queued() with the ids the database read returned
+        """
+        with self._pending_lock:
+            self._view_generation += 1
+            generation = self._view_generation
+            self._views.add(generation)
+            entries = [entry for entry in self._in_flight + self._pending
+                       if entry[0] == "messages" and entry[1] == user_dn]
+            for entry in entries:
+                # Committed but still in flight: this view needs its id too
+                if id(entry) in self._ids:
+                    self._ids[id(entry)] = self._ids[id(entry)][:2] + (generation,)
+        try:
+            yield ReadView(self, entries)
+        finally:
+            with self._pending_lock:
+                self._views.discard(generation)
+                self._prune_ids()
+
+    def _prune_ids(self) -> None:
+        """Forget message ids no open view or in-flight entry needs (call with _pending_lock held)"""
+        oldest = min(self._views, default=None)
+        in_flight = {id(entry) for entry in self._in_flight}
+        self._ids = {key: value for key, value in self._ids.items()
+                     if key in in_flight or (oldest is not None and value[2] >= oldest)}
+
+    def wait_until_written(self, user_dn: Optional[str], timeout: float = 1.0) -> bool:
+        """
+        Flush now and wait until no messages of a user are queued in this process
+
+        Args:
+            user_dn: Owner of the conversation
+            timeout: Maximum seconds to wait
+
+        Returns:
+            bool: False if rows were still queued at the timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._pending_lock:
+                queued = any(kind == "messages" and dn == user_dn for kind, dn, _ in self._in_flight + self._pending)
+            if not queued:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            self._wake.set()
+            time.sleep(0.01)
+
+    def _connection(self, shard: int) -> sqlite3.Connection:
+        """This thread's connection to a shard (sqlite3 connections are bound to the opening thread)"""
+        if self._conns_owner != threading.get_ident():
+            # Opened by a writer thread that has died; they can't be used or closed from here
+            self._conns, self._conns_owner = {}, threading.get_ident()
+        conn = self._conns.get(shard)
+        if conn is None:
+            conn = self._conns[shard] = self.store.connect(shard)
+        return conn
+
+    def _notify(self, hook: str, user_dns: set) -> None:
+        """Call an after-transaction hook; a failing listener must not fail the write"""
+        for listener in self._listeners:
+            if hasattr(listener, hook):
+                try:
+                    getattr(listener, hook)(user_dns)
+                except Exception:
+                    logger.exception("Message writer listener %s.%s failed", type(listener).__name__, hook)
+
+    def _write_shard(self, shard: int, entries: List[Tuple[str, Optional[str], tuple]]) -> None:
+        """Write one shard's rows in one transaction"""
+        conn = self._connection(shard)
+        try:
+            cursor = conn.cursor()
+            messages = [entry for entry in entries if entry[0] == "messages"]
+            usage = [row for kind, _, row in entries if kind == "usage"]
+            inserted = []
+            for _, _, row in messages:
+                # One by one for the ids (listeners and read views match rows by id)
+                cursor.execute(
+                    "INSERT INTO messages (role, content, provider, timestamp, user_dn) VALUES (?, ?, ?, ?, ?)",
+                    row
+                )
+                inserted.append((cursor.lastrowid, row[1], row[4]))
+            if inserted:
+                for listener in self._listeners:
+                    if hasattr(listener, "messages_inserted"):
+                        listener.messages_inserted(cursor, inserted)
+            if usage:
+                insert_usage(cursor, usage)
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                conn.close()
+                self._conns.pop(shard, None)
+            raise
+        if messages:
+            with self._pending_lock:
+                for entry, (message_id, _, _) in zip(messages, inserted):
+                    self._ids[id(entry)] = (entry, message_id, self._view_generation)
+            self._notify("messages_committed", {dn for kind, dn, _ in entries if kind == "messages"})
+
+    def _write_rows(self, shard: int, entries: List[Tuple[str, Optional[str], tuple]],
+                    failed: list, dropped: list) -> None:
+        """Write a shard's rows one transaction each after the batch failed on a bad row"""
+        for entry in entries:
+            try:
+                self._write_shard(shard, [entry])
+            except sqlite3.OperationalError:
+                failed.append(entry)
+            except Exception as e:
+                kind, dn, row = entry
+                logger.error("Dropping %s row that cannot be written (shard %d, user %s): %s; row: %.300r",
+                             kind, shard, dn, e, row)
+                dropped.append(entry)
+
+    def flush(self) -> int:
+        """
+        Write all queued rows, one transaction per shard
+
+        Returns:
+            int: Number of rows written (rows of shards that were busy stay
+                queued, rows that cannot be written are dropped)
+        """
+        with self._flush_lock:
+            with self._pending_lock:
+                self._in_flight, self._pending = self._in_flight + self._pending, []
+                batch = list(self._in_flight)
+            if not batch:
+                return 0
+
+            failed: List[Tuple[str, Optional[str], tuple]] = []
+            dropped: List[Tuple[str, Optional[str], tuple]] = []
+            done = set()
+            try:
+                by_shard: Dict[int, List[Tuple[str, Optional[str], tuple]]] = {}
+                for entry in batch:
+                    by_shard.setdefault(self.store.shard_for(entry[1]), []).append(entry)
+
+                for shard, entries in by_shard.items():
+                    try:
+                        self._write_shard(shard, entries)
+                    except sqlite3.OperationalError as e:
+                        # Locked, busy, disk full: nothing wrong with the rows
+                        logger.error("Write-behind flush of %d rows to shard %d failed, will retry: %s",
+                                     len(entries), shard, e)
+                        failed.extend(entries)
+                    except Exception as e:
+                        logger.error("Write-behind flush of %d rows to shard %d failed, writing them one by one: %s",
+                                     len(entries), shard, e)
+                        self._write_rows(shard, entries, failed, dropped)
+                    done.update(id(entry) for entry in entries)
+            finally:
+                with self._pending_lock:
+                    # Keep order: failed rows (and any not attempted) go back in front of newer rows
+                    self._pending = failed + [e for e in batch if id(e) not in done] + self._pending
+                    self._in_flight = []
+                    self._prune_ids()
+                dropped_dns = {dn for kind, dn, _ in dropped if kind == "messages"}
+                if dropped_dns:
+                    self._notify("messages_dropped", dropped_dns)
+            return len(batch) - len(failed) - len(dropped)
+
+    def _run(self) -> None:
+        """Background loop: flush on interval or when woken"""
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Rows stay queued; the next round retries them
+                logger.exception("Write-behind flush failed")
+        # sqlite3 connections are bound to the thread that opened them
+        self._close_connection()
+
+    def _close_connection(self) -> None:
+        with self._flush_lock:
+            if self._conns_owner == threading.get_ident():
+                for conn in self._conns.values():
+                    try:
+                        conn.close()
+                    except sqlite3.Error as e:
+                        logger.warning("Closing write-behind connection failed: %s", e)
+            self._conns, self._conns_owner = {}, None
+
+    def stop(self) -> None:
+        """Stop the background thread and write everything still queued"""
+        if self._pid != os.getpid():
+            # atexit/hooks inherited from another process; nothing of ours to flush
+            return
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+            if self._thread.is_alive():
+                logger.error("Message writer thread did not stop; skipping final flush")
+                return
+        self._thread = None
+        if self.flush() == 0 and self._pending:
+            logger.error("Dropping %d unwritten rows at shutdown", len(self._pending))
+        self._close_connection()
+
+
+class ReadView:
+    """Messages of one user that were queued when a read view opened"""
+
+    def __init__(self, writer: MessageWriter, entries: List[Tuple[str, Optional[str], tuple]]):
+        self._writer = writer
+        self._entries = entries
+
+    def queued(self, read_ids: Iterable[int]) -> List[Tuple[str, str, Optional[str]]]:
+        """
+        Queued rows missing from a database read made inside the view
+
+        Args:
+            read_ids: Message ids the read returned
+
+        Returns:
+            list: (role, content, provider) rows, oldest first
+        """
+        read_ids = set(read_ids)
+        with self._writer._pending_lock:
+            ids = {key: value[1] for key, value in self._writer._ids.items()}
+        return [entry[2][:3] for entry in self._entries if ids.get(id(entry)) not in read_ids]
+
+
+# Global singleton instance
+_message_writer: Optional[MessageWriter] = None
+
+
+def get_message_writer(store: Optional[ChatStore] = None) -> MessageWriter:
+    """
+    Get global message writer instance (singleton)
+
+    Args:
+        store: Chat store (defaults to chat_store.get_chat_store())
+
+    Returns:
+        MessageWriter: Global writer configured from environment
+    """
+    global _message_writer
+    if _message_writer is None:
+        if store is None:
+            from chat_store import get_chat_store
+            store = get_chat_store()
+        _message_writer = MessageWriter(
+            store,
+            flush_interval=float(os.getenv("WRITE_BEHIND_INTERVAL", "0.2")),
+            max_batch=int(os.getenv("WRITE_BEHIND_BATCH", "200")),
+        )
+    return _message_writer
+
+
+def shutdown_message_writer() -> None:
+    """
+    Flush queued rows before the process exits
+
+    No-op if the writer has not been created in this process.
+    """
+    if _message_writer is not None:
+        _message_writer.stop()
@@ -5,8 +5,12 @@ Handles all Mistral AI specific logic and API communication
 """
 
 import os
+import time
+import importlib.util
 from typing import List, Dict, Optional
-from base_bot import BaseBot
+from base_bot import BaseBot, ChatResult
+from cancellation import RequestCancelled, count, read_sse_completion
+from server_timing import span
 
 
 class MistralBot(BaseBot):
@@ -22,7 +26,16 @@ class MistralBot(BaseBot):
         super().__init__("Mistral AI")
         self.api_key = api_key or os.getenv("MISTRAL_API_KEY")
         self.client = None
+        self._client_pid = None
         self.default_model = "mistral-small-latest"
+        # Model per tier, picked per request by model_router.py
+        self.models = {
+            "fast": os.getenv("MISTRAL_MODEL_FAST", self.default_model),
+            "large": os.getenv("MISTRAL_MODEL_LARGE", "mistral-large-latest"),
+        }
+        self.vision_model = "pixtral-12b-2409"
+        # Override to point at a proxy or the local benchmark stub server
+        self.api_url = os.getenv("MISTRAL_API_URL", "https://api.mistral.ai").rstrip("/")
         
         # Try to initialize immediately
         self.initialize()
@@ -38,39 +51,60 @@ class MistralBot(BaseBot):
             self._is_available = False
             return False
         
+        # Only check that the SDK is installed. Importing it takes ~300 ms and
+        # its HTTP client must not be shared across forks, so the client is
+        # created on first use in each worker (see _get_client)
         try:
-            from mistralai.client import MistralClient
-            from mistralai.models.chat_completion import ChatMessage
-            self.client = MistralClient(api_key=self.api_key)
+            if importlib.util.find_spec("mistralai") is None:
+                self._is_available = False
+                return False
             self._is_available = True
             return True
-        except ImportError:
-            self._is_available = False
-            return False
         except Exception as e:
             self._is_available = False
             return False
     
-    def chat_complete(self, messages: List[Dict[str, str]], model: str = None) -> str:
+    def _get_client(self):
+        """
+        Get the Mistral SDK client for the current process
+        
+        Returns:
+            MistralClient: Client created lazily, recreated after a fork
+        """
+        if self.client is None or self._client_pid != os.getpid():
+            from mistralai.client import MistralClient
+            self.client = MistralClient(api_key=self.api_key, endpoint=self.api_url)
+            self._client_pid = os.getpid()
+        return self.client
+    
+    def reset_connections(self) -> None:
+        """Forget the SDK client so the worker opens its own connections"""
+        self.client = None
+        self._client_pid = None
+    
+    def chat_complete_result(self, messages: List[Dict[str, str]], model: str = None,
+                             cancel=None) -> ChatResult:
         """
         Send chat completion request to Mistral AI
         
         Args:
             messages: List of message dicts with 'role' and 'content'
             model: Model name (uses default if None)
+            cancel: Optional CancelToken; streams the completion and stops when cancelled
             
         Returns:
-            str: Bot's response text
+            ChatResult: Response text with token usage and upstream timing
             
         Raises:
             RuntimeError: If bot is not initialized
+            RequestCancelled: If cancel was set before the completion finished
         """
         if not self.is_available:
             raise RuntimeError(f"{self.name} is not available. Check API key.")
         
+        model_name = model or self.default_model
+        started = time.perf_counter()
         try:
-            model_name = model or self.default_model
-            
             from mistralai.models.chat_completion import ChatMessage
             
             # Convert dict messages to ChatMessage objects
@@ -79,16 +113,46 @@ class MistralBot(BaseBot):
                 for msg in messages
             ]
             
-            response = self.client.chat(
-                model=model_name,
-                messages=messages_objs
-            )
+            with span("upstream", f"{self.name} {model_name}"):
+                if cancel is not None:
+                    return self._stream_result(messages_objs, model_name, cancel, started)
+                
+                response = self._get_client().chat(
+                    model=model_name,
+                    messages=messages_objs
+                )
             
-            return response.choices[0].message.content
+            usage = response.usage.model_dump() if getattr(response, "usage", None) else None
+            return ChatResult.from_usage(
+                response.choices[0].message.content, response.model or model_name,
+                usage, (time.perf_counter() - started) * 1000
+            )
             
+        except RequestCancelled:
+            raise
         except Exception as e:
             error_msg = f"Error communicating with {self.name}: {str(e)}"
-            return f"❌ {error_msg}"
+            return ChatResult.error(f"❌ {error_msg}", model_name, (time.perf_counter() - started) * 1000)
+    
+    def _stream_result(self, messages_objs, model_name: str, cancel, started: float) -> ChatResult:
+        """Streamed completion that closes the upstream response once cancel is set"""
+        stream = self._get_client().chat_stream(model=model_name, messages=messages_objs)
+        parts = []
+        usage = None
+        try:
+            for chunk in stream:
+                if cancel.cancelled:
+                    count("upstream_streams_closed")
+                    raise RequestCancelled(cancel.reason)
+                model_name = chunk.model or model_name
+                if chunk.usage:
+                    usage = chunk.usage.model_dump()
+                for choice in chunk.choices:
+                    parts.append(choice.delta.content or "")
+        finally:
+            # Exits the SDK's httpx stream context, closing the connection
+            stream.close()
+        return ChatResult.from_usage("".join(parts), model_name, usage, (time.perf_counter() - started) * 1000)
     
     def get_model_info(self) -> Dict[str, any]:
         """Get Mistral AI model information"""
@@ -98,7 +162,8 @@ class MistralBot(BaseBot):
             "default_model": self.default_model,
             "provider": "Mistral AI",
             "icon": "🤖",
-            "supports_vision": True
+            "supports_vision": True,
+            "models": dict(self.models)
         }
     
     def analyze_image(self, image_path: str, prompt: str = "What do you see in this image?") -> str:
@@ -112,6 +177,24 @@ class MistralBot(BaseBot):
         Returns:
             str: Analysis result
         """
+        return self.analyze_image_result(image_path, prompt).text
+    
+    def analyze_image_result(self, image_path: str, prompt: str = "What do you see in this image?",
+                             cancel=None) -> ChatResult:
+        """
+        Analyze an image using Mistral Vision API
+        
+        Args:
+            image_path: Path to image file
+            prompt: Question to ask about the image
+            cancel: Optional CancelToken; streams the answer and stops when cancelled
+            
+        Returns:
+            ChatResult: Analysis text with token usage and upstream timing
+            
+        Raises:
+            RequestCancelled: If cancel was set before the analysis finished
+        """
         if not self.is_available:
             raise RuntimeError(f"{self.name} is not available. Check API key.")
         
@@ -136,7 +219,7 @@ class MistralBot(BaseBot):
             }
             
             payload = {
-                "model": "pixtral-12b-2409",
+                "model": self.vision_model,
                 "messages": [
                     {
                         "role": "user",
@@ -154,22 +237,37 @@ class MistralBot(BaseBot):
                 ]
             }
             
-            response = requests.post(
-                "https://api.mistral.ai/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=60
-            )
+            if cancel is not None:
+                payload["stream"] = True
             
+            started = time.perf_counter()
+            with span("upstream", f"{self.name} {self.vision_model}"):
+                response = requests.post(
+                    f"{self.api_url}/v1/chat/completions",
+                    headers=headers,
+                    json=payload,
+                    timeout=60,
+                    stream=cancel is not None
+                )
+                upstream_ms = (time.perf_counter() - started) * 1000
+                
+                if response.status_code == 200 and cancel is not None:
+                    return read_sse_completion(response, self.vision_model, cancel, started)
             if response.status_code == 200:
                 result = response.json()
-                return result['choices'][0]['message']['content']
+                return ChatResult.from_usage(
+                    result['choices'][0]['message']['content'], self.vision_model,
+                    result.get('usage'), upstream_ms
+                )
             else:
-                return f"❌ API Error: {response.status_code} - {response.text}"
+                return ChatResult.error(f"❌ API Error: {response.status_code} - {response.text}",
+                                        self.vision_model, upstream_ms)
             
+        except RequestCancelled:
+            raise
         except Exception as e:
             error_msg = f"Error analyzing image with {self.name}: {str(e)}"
-            return f"❌ {error_msg}"
+            return ChatResult.error(f"❌ {error_msg}", self.vision_model)
     
     def get_display_name(self) -> str:
         """Get display name for UI"""
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Model Router
+Picks a model tier per chat request from cheap request features
+
+Each bot declares a model catalog in get_model_info()["models"], e.g.
+{"fast": "gpt-4o-mini", "large": "gpt-4o"}. Short questions without code
+go to the fast tier; long messages, code and long conversations go to the
+large tier. Users can force a tier per request.
+"""
+
+import os
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from base_bot import BaseBot
+
+TIERS = ("fast", "large")
+
+
+@dataclass
+class Route:
+    """Tier and model chosen for one bot, with the reasons (for logs/metrics)"""
+    tier: str
+    model: Optional[str]
+    reasons: List[str] = field(default_factory=list)
+    overridden: bool = False
+
+
+class ModelRouter:
+    """Classifies chat requests into model tiers"""
+
+    def __init__(self, detect_language: Callable[[str], str], large_min_chars: int = 1500,
+                 code_min_chars: int = 300, large_history_chars: int = 12000):
+        """
+        Initialize model router
+
+        Args:
+            detect_language: Language detector returning 'plaintext' for non-code
+            large_min_chars: Messages at least this long use the large tier
+            code_min_chars: Messages with code at least this long use the large tier
+            large_history_chars: Conversations with this much history use the large tier
+        """
+        self.detect_language = detect_language
+        self.large_min_chars = large_min_chars
+        self.code_min_chars = code_min_chars
+        self.large_history_chars = large_history_chars
+
+    @classmethod
+    def from_env(cls, detect_language: Callable[[str], str]) -> "ModelRouter":
+        """
+        Build router from environment variables
+
+        Returns:
+            ModelRouter: Configured router
+        """
+        return cls(
+            detect_language,
+            large_min_chars=int(os.getenv("ROUTER_LARGE_MIN_CHARS", 1500)),
+            code_min_chars=int(os.getenv("ROUTER_CODE_MIN_CHARS", 300)),
+            large_history_chars=int(os.getenv("ROUTER_LARGE_HISTORY_CHARS", 12000)),
+        )
+
+    def has_code(self, message: str) -> bool:
+        """
+        True for fenced code or pasted code without fences
+
+        detect_language() also matches prose ("from", "where"), so unfenced
+        text only counts as code if at least three lines, and a quarter of
+        all lines, look like code (bodies often match no keyword).
+        """
+        if "```" in message:
+            return True
+        lines = [line for line in message.splitlines() if line.strip()]
+        code_lines = sum(1 for line in lines if self.detect_language(line) != "plaintext")
+        return code_lines >= 3 and code_lines * 4 >= len(lines)
+
+    def classify(self, message: str, history: List[Dict[str, str]]) -> Route:
+        """
+        Pick a tier from message length, code presence and history size
+
+        Args:
+            message: Current user message
+            history: Earlier messages sent along (system prompt excluded)
+
+        Returns:
+            Route: Tier with reasons (model not yet resolved)
+        """
+        reasons = []
+        if len(message) >= self.large_min_chars:
+            reasons.append(f"message {len(message)} chars")
+        if len(message) >= self.code_min_chars and self.has_code(message):
+            reasons.append("code")
+        history_chars = sum(len(m.get("content") or "") for m in history)
+        if history_chars >= self.large_history_chars:
+            reasons.append(f"history {history_chars} chars")
+        return Route(tier="large" if reasons else "fast", model=None, reasons=reasons or ["short, no code"])
+
+    def select(self, bot: BaseBot, route: Route, override: Optional[str] = None) -> Route:
+        """
+        Resolve a tier to the bot's model, applying a user override
+
+        Args:
+            bot: Bot that will serve the request
+            route: Result of classify()
+            override: "fast" or "large" to force a tier, None/"auto" to keep the classification
+
+        Returns:
+            Route: Copy with model set; None (the bot's default model) if the
+                bot declares no catalog or no model for the tier
+        """
+        tier, overridden = route.tier, False
+        if override in TIERS:
+            tier, overridden = override, override != route.tier
+        catalog = bot.get_model_info().get("models") or {}
+        # An empty MISTRAL_MODEL_LARGE= etc. means "not configured", not model ""
+        return Route(tier=tier, model=catalog.get(tier) or None, reasons=list(route.reasons), overridden=overridden)
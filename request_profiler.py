@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Request Profiler
+Opt-in per-request profiling for slow Flask routes
+Runs selected requests under cProfile and writes the dumps to logs/profiles/
+
+Work a request hands to helper threads (upstream calls, compare fan-out,
+large-input chunks) is profiled too: tasks wrapped with profile_task()
+run under their own profiler, merged into the request's capture.
+"""
+
+import os
+import io
+import time
+import random
+import pstats
+import cProfile
+import threading
+import logging
+import contextvars
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE_DIR = os.path.join(os.path.dirname(__file__), "logs", "profiles")
+
+
+class _Capture:
+    """Profilers of helper-thread tasks belonging to one captured request"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.profilers: List[cProfile.Profile] = []
+        self.closed = False
+
+    def add(self, profiler: cProfile.Profile) -> None:
+        with self._lock:
+            # Tasks still running when the capture was saved (e.g. after a cancel) are left out
+            if not self.closed:
+                self.profilers.append(profiler)
+
+    def close(self) -> List[cProfile.Profile]:
+        with self._lock:
+            self.closed = True
+            return list(self.profilers)
+
+
+_active: "contextvars.ContextVar[Optional[_Capture]]" = contextvars.ContextVar("request_profile", default=None)
+
+
+def profile_task(func: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Wrap func so that, run in a helper thread during a captured request, it is profiled into that capture
+
+    Args:
+        func: Callable submitted to an executor
+
+    Returns:
+        callable: func itself if no capture is running in this context
+    """
+    capture = _active.get()
+    if capture is None:
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _active.set(capture)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+: one profiler per interpreter, already covering this thread
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _active.reset(token)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            capture.add(profiler)
+            _active.reset(token)
+    return wrapper
+
+
+class RequestProfiler:
+    """Captures cProfile dumps for sampled or explicitly flagged requests"""
+
+    def __init__(self, enabled: bool = False, sample_rate: float = 0.0,
+                 profile_dir: str = DEFAULT_PROFILE_DIR, max_captures: int = 200):
+        """
+        Initialize request profiler
+
+        Args:
+            enabled: Master switch, nothing is wrapped when False
+            sample_rate: Fraction (0.0-1.0) of requests to profile automatically
+            profile_dir: Directory the dumps are written to
+            max_captures: Oldest captures beyond this count are deleted
+        """
+        self.enabled = enabled
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.profile_dir = profile_dir
+        self.max_captures = max_captures
+        # cProfile can only have one active profiler per thread, and
+        # sys.setprofile is per-thread, so concurrent captures are serialized
+        self._lock = threading.Lock()
+
+        if self.enabled:
+            os.makedirs(self.profile_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "RequestProfiler":
+        """
+        Build profiler from environment variables
+
+        Returns:
+            RequestProfiler: Configured profiler
+        """
+        return cls(
+            enabled=os.getenv("PROFILING_ENABLED", "false").lower() == "true",
+            sample_rate=float(os.getenv("PROFILING_SAMPLE_RATE", "0")),
+            profile_dir=os.getenv("PROFILING_DIR", DEFAULT_PROFILE_DIR),
+            max_captures=int(os.getenv("PROFILING_MAX_CAPTURES", "200")),
+        )
+
+    def should_profile(self, flagged: bool) -> bool:
+        """
+        Decide whether the current request is captured
+
+        Args:
+            flagged: True if an admin explicitly asked for a profile
+
+        Returns:
+            bool: True if the request should run under the profiler
+        """
+        if not self.enabled:
+            return False
+        if flagged:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def run(self, label: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run func under cProfile and write the capture to disk
+
+        Args:
+            label: Short name for the capture (e.g. route path)
+            func: Callable to profile
+
+        Returns:
+            Whatever func returns
+        """
+        if not self._lock.acquire(blocking=False):
+            # Another capture is running in this process; don't queue behind it
+            return func(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        capture = _Capture()
+        token = _active.set(capture)
+        started = time.time()
+        try:
+            profiler.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.disable()
+                self._save(profiler, capture.close(), label, started, time.time() - started)
+        finally:
+            _active.reset(token)
+            self._lock.release()
+
+    def _save(self, profiler: cProfile.Profile, helpers: List[cProfile.Profile], label: str,
+              started: float, duration: float) -> None:
+        """Write .prof (pstats) and .txt (call tree) files for a capture, helper threads merged in"""
+        safe_label = "".join(c if c.isalnum() else "_" for c in label).strip("_") or "root"
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started))
+        name = f"{stamp}-{int(started * 1000) % 1000:03d}-{os.getpid()}-{safe_label}"
+        base = os.path.join(self.profile_dir, name)
+
+        try:
+            text = io.StringIO()
+            stats = pstats.Stats(profiler, stream=text)
+            for helper in helpers:
+                stats.add(helper)
+            # Binary pstats dump: loadable by snakeviz, flameprof, gprof2dot
+            stats.dump_stats(f"{base}.prof")
+
+            # Human-readable call tree sorted by cumulative time
+            text.write(f"# {label} - {duration * 1000:.1f} ms - pid {os.getpid()} - "
+                       f"{len(helpers)} helper thread task(s) merged in\n")
+            if helpers:
+                # The view thread waits while helpers run, so that time is counted in both
+                text.write("# Helper threads run concurrently: cumulative times across threads overlap\n")
+            text.write("\n")
+            stats.sort_stats("cumulative").print_stats(60)
+            stats.print_callees(30)
+            with open(f"{base}.txt", "w") as fh:
+                fh.write(text.getvalue())
+
+            logger.info("Profile captured for %s (%.1f ms): %s", label, duration * 1000, name)
+        except OSError as e:
+            logger.error("Failed to write profile %s: %s", name, e)
+            return
+
+        self._prune()
+
+    def _prune(self) -> None:
+        """Delete the oldest captures beyond max_captures"""
+        captures = self.list_captures(limit=None)
+        for capture in captures[self.max_captures:]:
+            for ext in (".prof", ".txt"):
+                try:
+                    os.remove(os.path.join(self.profile_dir, capture["name"] + ext))
+                except OSError:
+                    pass
+
+    def list_captures(self, limit: Optional[int] = 50) -> List[Dict[str, Any]]:
+        """
+        List recent captures, newest first
+
+        Args:
+            limit: Maximum number of entries (None for all)
+
+        Returns:
+            list: Capture info dicts (name, size, created)
+        """
+        try:
+            entries = [e for e in os.scandir(self.profile_dir) if e.name.endswith(".prof")]
+        except FileNotFoundError:
+            return []
+
+        captures = []
+        for e in entries:
+            try:
+                stat = e.stat()
+            except FileNotFoundError:
+                # Pruned by another worker meanwhile
+                continue
+            captures.append((e.name[:-len(".prof")], stat))
+        captures.sort(key=lambda capture: capture[1].st_mtime, reverse=True)
+        if limit is not None:
+            captures = captures[:limit]
+
+        return [
+            {
+                "name": name,
+                "size": stat.st_size,
+                "created": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stat.st_mtime)),
+            }
+            for name, stat in captures
+        ]
+
+    def capture_path(self, name: str, ext: str) -> Optional[str]:
+        """
+        Resolve a capture file path, refusing anything outside profile_dir
+
+        Args:
+            name: Capture name as returned by list_captures()
+            ext: ".prof" or ".txt"
+
+        Returns:
+            str: Absolute path, or None if invalid/missing
+        """
+        if ext not in (".prof", ".txt") or os.path.basename(name) != name:
+            return None
+        path = os.path.join(self.profile_dir, name + ext)
+        return path if os.path.isfile(path) else None
+
+
+# Global singleton instance
+_request_profiler: Optional[RequestProfiler] = None
+
+
+def get_request_profiler() -> RequestProfiler:
+    """
+    Get global request profiler instance (singleton)
+
+    Returns:
+        RequestProfiler: Global profiler configured from environment
+    """
+    global _request_profiler
+    if _request_profiler is None:
+        _request_profiler = RequestProfiler.from_env()
+    return _request_profiler
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+"""
+Retrieval
+Local vector index over each user's chat history
+
+Every stored message gets a 256-dimensional hashing-trick vector (token
+counts hashed into buckets with a random sign, L2-normalized), written by
+the message writer in the same transaction as the message. No model,
+network or GPU is involved.
+
+For a new question, chat() asks for the user's few older messages with
+the highest cosine similarity. Each worker keeps a user's vectors in
+memory after the first query and only fetches vectors added since, so a
+query over thousands of messages takes milliseconds. With NumPy installed
+a user's vectors are one float32 matrix and a query is a single
+matrix-vector product plus argpartition; without it, scoring reads only
+the query's non-zero buckets, each as one strided column, which is fine
+for a few thousand messages but grows with query length times history
+(see benchmarks/retrieval_bench.py).
+
+Messages stored without a vector (older versions, import, rebalance) are
+indexed by a background thread the first time their user is looked up;
+the request itself only reads.
+
+Usage:
+    python retrieval.py reindex             # vectors for messages stored before indexing existed
+    python retrieval.py query --user "CN=alice,CN=Users,DC=example,DC=local" "vlan trunk config"
+"""
+
+import os
+import re
+import math
+import zlib
+import heapq
+import queue
+import sqlite3
+import logging
+import argparse
+import threading
+from array import array
+from itertools import repeat
+from operator import add, mul
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    # Scoring falls back to plain Python, fine for a few thousand messages per user
+    np = None
+
+from chat_store import ChatStore
+
+logger = logging.getLogger(__name__)
+
+# Vector size; changing it requires `python retrieval.py reindex` on a fresh table
+DIM = 256
+
+# Words that say nothing about the topic of a message
+STOPWORDS = frozenset("""
+a an and are as at be but by can could do does for from had has have how i if in into is it its me my no not
+of on or our please so than that the their them then there these they this to was we were what when where which
+who why will with would you your yes ok thanks thank hi hello
+""".split())
+
+TOKEN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+(?:\.\d+)*")
+CAMEL = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+# Only the start of huge pastes is embedded; it says enough about the topic
+EMBED_MAX_CHARS = 20000
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-case word and identifier tokens, with snake/camelCase identifiers also split into parts
+
+    Args:
+        text: Message content
+
+    Returns:
+        list: Tokens without stopwords and one-character tokens
+    """
+    tokens = []
+    for word in TOKEN.findall(text[:EMBED_MAX_CHARS]):
+        lower = word.lower()
+        if len(lower) > 1 and lower not in STOPWORDS:
+            tokens.append(lower)
+        parts = [p.lower() for piece in word.split("_") for p in CAMEL.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if len(p) > 1 and p not in STOPWORDS)
+    return tokens
+
+
+def embed(text: str) -> Optional[array]:
+    """
+    Hashing-trick vector of a text
+
+    Args:
+        text: Message content
+
+    Returns:
+        array: DIM float32 values with unit length, or None if the text has no usable tokens
+    """
+    vector = [0.0] * DIM
+    for token, count in Counter(tokenize(text)).items():
+        h = zlib.crc32(token.encode("utf-8"))
+        # Sublinear term frequency; the sign bit keeps collisions from only adding up
+        vector[h % DIM] += (1.0 + math.log(count)) * (1 if h & 0x80000000 else -1)
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0:
+        return None
+    return array("f", (v / norm for v in vector))
+
+
+class _UserVectors:
+    """One user's vectors in worker memory"""
+
+    __slots__ = ("ids", "matrix", "count", "max_id")
+
+    def __init__(self):
+        self.ids = array("q")
+        # Row-major (n, DIM) float32 matrix, as stored in message_vectors. With NumPy
+        # it has spare rows so topping up does not copy it; without, it is a flat array.
+        self.matrix = np.empty((0, DIM), dtype=np.float32) if np is not None else array("f")
+        self.count = 0
+        self.max_id = 0
+
+    def add(self, rows: Sequence[Tuple[int, bytes]]) -> None:
+        rows = [(message_id, blob) for message_id, blob in rows if len(blob) == DIM * 4]
+        if not rows:
+            return
+        if np is None:
+            for _, blob in rows:
+                self.matrix.frombytes(blob)
+        else:
+            needed = self.count + len(rows)
+            if needed > len(self.matrix):
+                grown = np.empty((max(needed, 2 * len(self.matrix), 64), DIM), dtype=np.float32)
+                grown[:self.count] = self.matrix[:self.count]
+                self.matrix = grown
+            block = np.frombuffer(b"".join(blob for _, blob in rows), dtype=np.float32)
+            self.matrix[self.count:needed] = block.reshape(len(rows), DIM)
+        for message_id, _ in rows:
+            self.ids.append(message_id)
+        self.count += len(rows)
+        self.max_id = max(self.max_id, max(message_id for message_id, _ in rows))
+
+    @property
+    def size(self) -> int:
+        matrix_bytes = self.matrix.nbytes if np is not None else len(self.matrix) * 4
+        return matrix_bytes + len(self.ids) * 8
+
+    def search(self, query: array, k: int) -> List[Tuple[float, int]]:
+        """Top-k (score, message_id) by cosine similarity (vectors are unit length)"""
+        if not self.count or k <= 0:
+            return []
+        if np is not None:
+            scores = self.matrix[:self.count] @ np.frombuffer(query, dtype=np.float32)
+            if k < self.count:
+                top = np.argpartition(scores, -k)[-k:]
+            else:
+                top = np.arange(self.count)
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(float(scores[i]), self.ids[i]) for i in top.tolist()]
+
+        scores: Optional[List[float]] = None
+        # The query has few non-zero buckets: only those contribute to the dot product.
+        # Column i is the slice matrix[i::DIM]; map() multiplies and sums it in C.
+        for i, weight in enumerate(query):
+            if not weight:
+                continue
+            column = map(mul, self.matrix[i::DIM], repeat(weight))
+            scores = list(column) if scores is None else list(map(add, scores, column))
+        if scores is None:
+            return []
+        return heapq.nlargest(k, zip(scores, self.ids))
+
+
+class VectorIndex:
+    """Writes message vectors and answers per-user similarity queries"""
+
+    def __init__(self, store: ChatStore, top_k: int = 3, min_score: float = 0.3, max_chars: int = 2000,
+                 cache_bytes: int = 32 * 1024 * 1024):
+        """
+        Initialize vector index
+
+        Args:
+            store: Chat store holding messages and vectors
+            top_k: Older messages added to a chat request; 0 disables retrieval
+            min_score: Minimum cosine similarity for a message to be used
+            max_chars: Retrieved messages are clipped to this length
+            cache_bytes: Memory for cached user vectors per worker
+        """
+        self.store = store
+        self.top_k = top_k
+        self.min_score = min_score
+        self.max_chars = max_chars
+        self.cache_bytes = cache_bytes
+        self._lock = threading.Lock()
+        self._users: "OrderedDict[Optional[str], _UserVectors]" = OrderedDict()
+        self._pid = os.getpid()
+        # Users whose missing vectors this process has indexed (or queued)
+        self._backfilled: Set[Optional[str]] = set()
+        self._backfill_queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._backfill_thread: Optional[threading.Thread] = None
+        # Users whose cached vectors predate a backfill and must be reloaded
+        self._stale: Set[Optional[str]] = set()
+
+    @classmethod
+    def from_env(cls, store: ChatStore) -> "VectorIndex":
+        """
+        Build index from environment variables
+
+        Returns:
+            VectorIndex: Configured index
+        """
+        return cls(
+            store,
+            top_k=int(os.getenv("RETRIEVAL_TOP_K", 3)),
+            min_score=float(os.getenv("RETRIEVAL_MIN_SCORE", 0.3)),
+            max_chars=int(os.getenv("RETRIEVAL_MAX_CHARS", 2000)),
+            cache_bytes=int(float(os.getenv("RETRIEVAL_CACHE_MB", 32)) * 1024 * 1024),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.top_k > 0
+
+    # --- writing (message writer listener) ---
+
+    def messages_inserted(self, cursor: sqlite3.Cursor, rows: List[Tuple[int, str, Optional[str]]]) -> None:
+        """
+        Store vectors for newly inserted messages (inside the writer's transaction)
+
+        Args:
+            cursor: Cursor of the open transaction
+            rows: (message_id, content, user_dn) tuples
+        """
+        vectors = []
+        for message_id, content, user_dn in rows:
+            vector = embed(content)
+            if vector is not None:
+                vectors.append((message_id, user_dn, vector.tobytes()))
+        if vectors:
+            cursor.executemany("INSERT OR IGNORE INTO message_vectors (message_id, user_dn, vector) VALUES (?, ?, ?)",
+                               vectors)
+
+    def index_missing(self, conn: sqlite3.Connection, user_dn: Optional[str] = None, batch_size: int = 500) -> int:
+        """
+        Add vectors for messages stored without one (older versions, import, rebalance)
+
+        Args:
+            conn: Connection to one shard
+            user_dn: Only this user's messages (None: every message in the shard)
+            batch_size: Messages per transaction
+
+        Returns:
+            int: Messages indexed
+        """
+        sql = """SELECT m.id, m.content, m.user_dn FROM messages m
+                 LEFT JOIN message_vectors v ON v.message_id = m.id
+                 WHERE v.message_id IS NULL"""
+        params: Tuple = ()
+        if user_dn is not None:
+            sql += " AND m.user_dn = ?"
+            params = (user_dn,)
+        indexed = 0
+        last_id = 0
+        while True:
+            rows = conn.execute(sql + " AND m.id > ? ORDER BY m.id LIMIT ?", params + (last_id, batch_size)).fetchall()
+            if not rows:
+                return indexed
+            with conn:
+                self.messages_inserted(conn.cursor(), [tuple(row) for row in rows])
+            last_id = rows[-1][0]
+            indexed += len(rows)
+
+    def _schedule_backfill(self, user_dn: Optional[str]) -> None:
+        """Index a user's messages without vectors in the background (call with self._lock held)"""
+        if user_dn in self._backfilled:
+            return
+        self._backfilled.add(user_dn)
+        if self._backfill_thread is None or not self._backfill_thread.is_alive():
+            self._backfill_thread = threading.Thread(target=self._backfill, name="vector-backfill", daemon=True)
+            self._backfill_thread.start()
+        self._backfill_queue.put(user_dn)
+
+    def _backfill(self) -> None:
+        """Background loop: index users queued by _schedule_backfill()"""
+        while True:
+            user_dn = self._backfill_queue.get()
+            try:
+                conn = self.store.connect_for_user(user_dn)
+                try:
+                    indexed = self.index_missing(conn, user_dn)
+                finally:
+                    conn.close()
+                if indexed:
+                    logger.info("Indexed %d messages stored without a vector", indexed)
+            except Exception:
+                logger.exception("Indexing stored messages failed")
+            with self._lock:
+                # Backfilled ids are older than the cached ones, so a top-up would
+                # miss them: the next query reloads (also a query loading right now)
+                self._stale.add(user_dn)
+
+    # --- querying ---
+
+    def _user_vectors(self, user_dn: Optional[str], conn: sqlite3.Connection) -> _UserVectors:
+        """Cached vectors of a user, topped up with rows added since (by any worker)"""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Inherited through fork: the backfill thread stayed in the parent
+                self._users.clear()
+                self._backfilled = set()
+                self._backfill_queue = queue.Queue()
+                self._backfill_thread = None
+                self._stale = set()
+                self._pid = os.getpid()
+            if user_dn in self._stale:
+                self._stale.discard(user_dn)
+                self._users.pop(user_dn, None)
+            entry = self._users.get(user_dn)
+            if entry is None:
+                self._schedule_backfill(user_dn)
+        if entry is None:
+            entry = _UserVectors()
+        rows = conn.execute("SELECT message_id, vector FROM message_vectors WHERE user_dn IS ? AND message_id > ? "
+                            "ORDER BY message_id", (user_dn, entry.max_id)).fetchall()
+        with self._lock:
+            # Another thread may have topped up the same entry meanwhile
+            rows = [tuple(row) for row in rows if row[0] > entry.max_id]
+            entry.add(rows)
+            self._users[user_dn] = entry
+            self._users.move_to_end(user_dn)
+            total = sum(e.size for e in self._users.values())
+            while total > self.cache_bytes and len(self._users) > 1:
+                _, evicted = self._users.popitem(last=False)
+                total -= evicted.size
+        return entry
+
+    def search(self, user_dn: Optional[str], query: str, k: int) -> List[Tuple[float, int]]:
+        """
+        Most similar messages of a user
+
+        Args:
+            user_dn: Owner of the history
+            query: Text to compare against
+            k: Number of results
+
+        Returns:
+            list: (cosine similarity, message_id), best first
+        """
+        vector = embed(query)
+        if vector is None:
+            return []
+        conn = self.store.connect_for_user(user_dn)
+        try:
+            return self._user_vectors(user_dn, conn).search(vector, k)
+        finally:
+            conn.close()
+
+    def retrieve(self, user_dn: Optional[str], query: str, exclude: Iterable[str] = ()) -> List[Dict[str, str]]:
+        """
+        Older messages relevant to a question, oldest first
+
+        Args:
+            user_dn: Owner of the history
+            query: New question
+            exclude: Contents already sent as recent history
+
+        Returns:
+            list: {"role", "content", "timestamp", "score"} dicts, content clipped to max_chars
+        """
+        if not self.enabled:
+            return []
+        exclude = set(exclude)
+        # Recent messages score high too; ask for extra so top_k remain after excluding them
+        hits = [(score, message_id) for score, message_id in self.search(user_dn, query, self.top_k + len(exclude))
+                if score >= self.min_score]
+        if not hits:
+            return []
+        scores = dict((message_id, score) for score, message_id in hits)
+        conn = self.store.connect_for_user(user_dn)
+        try:
+            placeholders = ", ".join("?" * len(scores))
+            rows = conn.execute(f"SELECT id, role, content, timestamp FROM messages WHERE id IN ({placeholders}) "
+                                "ORDER BY id", list(scores)).fetchall()
+        finally:
+            conn.close()
+        found = [row for row in rows if row["content"] not in exclude]
+        best = sorted(found, key=lambda row: scores[row["id"]], reverse=True)[:self.top_k]
+        return [{"role": row["role"], "content": _clip(row["content"], self.max_chars),
+                 "timestamp": row["timestamp"], "score": round(scores[row["id"]], 3)}
+                for row in sorted(best, key=lambda row: row["id"])]
+
+
+def _clip(text: str, max_chars: int) -> str:
+    return text if len(text) <= max_chars else text[:max_chars] + " [...]"
+
+
+def context_block(messages: List[Dict[str, str]]) -> str:
+    """
+    Format retrieved messages for the system prompt
+
+    Args:
+        messages: Result of VectorIndex.retrieve()
+
+    Returns:
+        str: Text block, empty if there are no messages
+    """
+    if not messages:
+        return ""
+    parts = [f"[{m['timestamp']}] {m['role']}: {m['content']}" for m in messages]
+    return ("Earlier messages from this user's history that may be relevant "
+            "(use them only if they help answer the question):\n\n" + "\n\n".join(parts))
+
+
+# Global singleton instance
+_vector_index: Optional[VectorIndex] = None
+
+
+def get_vector_index(store: Optional[ChatStore] = None) -> VectorIndex:
+    """
+    Get global vector index instance (singleton)
+
+    Args:
+        store: Chat store (defaults to chat_store.get_chat_store())
+
+    Returns:
+        VectorIndex: Global index configured from environment
+    """
+    global _vector_index
+    if _vector_index is None:
+        if store is None:
+            from chat_store import get_chat_store
+            store = get_chat_store()
+        _vector_index = VectorIndex.from_env(store)
+    return _vector_index
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Maintain or query the chat history vector index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("reindex", help="add vectors for messages that have none (e.g. after import/rebalance)")
+    query = sub.add_parser("query", help="show a user's messages most similar to a text")
+    query.add_argument("--user", required=True, help="LDAP DN")
+    query.add_argument("-k", type=int, default=5)
+    query.add_argument("text")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from chat_store import store_from_env
+    load_dotenv()
+    store = store_from_env()
+    store.init()
+    index = VectorIndex.from_env(store)
+
+    if args.command == "reindex":
+        for shard, conn in enumerate(store.connections()):
+            print(f"{store.paths[shard]}: {index.index_missing(conn):,} messages indexed")
+        return 0
+
+    # Queries index in the background; a one-off command indexes first instead
+    conn = store.connect_for_user(args.user)
+    try:
+        index.index_missing(conn, args.user)
+    finally:
+        conn.close()
+    for score, message_id in index.search(args.user, args.text, args.k):
+        conn = store.connect_for_user(args.user)
+        try:
+            row = conn.execute("SELECT role, content FROM messages WHERE id = ?", (message_id,)).fetchone()
+        finally:
+            conn.close()
+        print(f"{score:.3f}  #{message_id} {row['role']}: {row['content'][:100]!r}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Server Timing
+Per-request stage durations, sent to the browser as a Server-Timing header
+
+main.py starts a collector for timed routes and turns it into the
+header after the view. Code anywhere in the request (main.py, bots)
+measures a stage with:
+
+    with span("upstream", f"{self.name} {model}"):
+        ...
+
+The collector lives in a context variable. Work handed to helper
+threads (run_cancellable, compare fan-out, large-input chunks) keeps
+recording into it through bind(). Outside a timed request span() does
+nothing beyond one context variable lookup.
+"""
+
+import re
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+_CONTROL = re.compile(r"[\x00-\x1f\x7f]")
+
+_current: "contextvars.ContextVar[Optional[Timings]]" = contextvars.ContextVar("server_timing", default=None)
+
+
+class Timings:
+    """Stage durations of one request, in the order the stages finished"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._entries: List[Dict[str, Any]] = []
+
+    def add(self, name: str, duration_ms: float, desc: Optional[str] = None) -> None:
+        """
+        Record a finished stage (safe from any thread)
+
+        Args:
+            name: Metric name (a token: letters, digits, '-', '_')
+            duration_ms: Duration in milliseconds
+            desc: Optional description, e.g. bot and model
+        """
+        entry = {"name": name, "dur": round(duration_ms, 1)}
+        if desc:
+            entry["desc"] = desc
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Recorded stages as {"name", "dur", "desc"?} dicts"""
+        with self._lock:
+            return list(self._entries)
+
+    def header(self) -> str:
+        """
+        Server-Timing header value, ending with the total time so far
+
+        Returns:
+            str: e.g. 'auth;dur=0.4, upstream;desc="Mistral AI mistral-small-latest";dur=812.3, total;dur=815.0'
+        """
+        entries = self.entries() + [{"name": "total", "dur": round((time.perf_counter() - self.started) * 1000, 1)}]
+        return ", ".join(_metric(entry) for entry in entries)
+
+
+def _metric(entry: Dict[str, Any]) -> str:
+    parts = [entry["name"]]
+    if entry.get("desc"):
+        # Header values must be latin-1 without control characters; desc is a quoted-string
+        desc = entry["desc"].encode("ascii", "replace").decode("ascii")
+        desc = _CONTROL.sub(" ", desc).replace("\\", "\\\\").replace('"', '\\"')
+        parts.append(f'desc="{desc}"')
+    parts.append(f"dur={entry['dur']}")
+    return ";".join(parts)
+
+
+def start() -> Timings:
+    """
+    Start collecting for the current request
+
+    Returns:
+        Timings: New collector, current until finish()
+    """
+    timings = Timings()
+    _current.set(timings)
+    return timings
+
+
+def finish() -> Optional[Timings]:
+    """
+    Stop collecting (call once per request; threads are reused across requests)
+
+    Returns:
+        Timings: The request's collector, or None if none was started
+    """
+    timings = _current.get()
+    _current.set(None)
+    return timings
+
+
+def current() -> Optional[Timings]:
+    """Collector of the current request, if any"""
+    return _current.get()
+
+
+def record(name: str, duration_ms: float, desc: Optional[str] = None) -> None:
+    """Record an already measured stage in the current request (no-op outside one)"""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, duration_ms, desc)
+
+
+@contextmanager
+def span(name: str, desc: Optional[str] = None) -> Iterator[None]:
+    """
+    Measure the enclosed block as a stage of the current request
+
+    The stage is recorded even if the block raises.
+
+    Args:
+        name: Metric name
+        desc: Optional description
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, (time.perf_counter() - started) * 1000, desc)
+
+
+def bind(func: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Wrap func to record into the current request's collector when run in another thread
+
+    Args:
+        func: Callable submitted to an executor
+
+    Returns:
+        callable: func itself if nothing is being collected
+    """
+    timings = _current.get()
+    if timings is None:
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current.set(timings)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return wrapper
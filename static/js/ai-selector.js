@@ -18,6 +18,11 @@
             options.push({value: 'github-copilot', text: '💻 GitHub Copilot'});
         }
 
+        // Ask all configured bots at once (answers shown side by side)
+        if (options.length > 1) {
+            options.push({value: 'compare', text: '⚖️ Compare all'});
+        }
+
         // Clear and populate dropdown
         dropdown.innerHTML = '';
         options.forEach(opt => {
@@ -73,6 +78,23 @@
         dropdown.addEventListener('change', function() {
             localStorage.setItem('selectedAIModel', this.value);
         });
+
+        initTierSelector();
+    }
+
+    // Model tier: "auto" lets the server route, "fast"/"large" force a tier
+    function initTierSelector() {
+        const tierDropdown = document.getElementById('tier-dropdown');
+        if (!tierDropdown) return;
+
+        const savedTier = localStorage.getItem('selectedTier');
+        if (savedTier && tierDropdown.querySelector(`option[value="${savedTier}"]`)) {
+            tierDropdown.value = savedTier;
+        }
+
+        tierDropdown.addEventListener('change', function() {
+            localStorage.setItem('selectedTier', this.value);
+        });
     }
 
     // Add CSS animation
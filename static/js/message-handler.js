@@ -7,6 +7,70 @@ let pastedCodeCounter = 0;
 // DOM elements (initialized in ui-handlers.js)
 let chat, codeOutput, pastedCodeOutput, input;
 
+function linkCodeIndicator(codeTag, targetId, panelId) {
+    // Clicking "Code #N" scrolls its panel to the block and flashes it
+    codeTag.dataset.targetId = targetId;
+    codeTag.onclick = () => {
+        const targetBlock = document.getElementById(targetId);
+        if (targetBlock) {
+            const panel = document.getElementById(panelId);
+            const blockOffset = targetBlock.offsetTop - panel.offsetTop;
+            panel.scrollTo({
+                top: blockOffset,
+                behavior: 'smooth'
+            });
+            
+            // Add ripple effect
+            targetBlock.classList.add('highlight');
+            setTimeout(() => {
+                targetBlock.classList.remove('highlight');
+            }, 1000);
+        }
+    };
+}
+
+function attachCopyButton(copyBtn, feedback, getText) {
+    copyBtn.addEventListener('click', () => {
+        navigator.clipboard.writeText(getText())
+            .then(() => {
+                feedback.classList.add('show');
+                setTimeout(() => feedback.classList.remove('show'), 2000);
+            });
+    });
+}
+
+function highlightCode(code) {
+    if (typeof Prism !== 'undefined' && Prism.highlightElement) {
+        requestAnimationFrame(() => {
+            try {
+                Prism.highlightElement(code);
+            } catch(e) { /* ignore */ }
+        });
+    }
+}
+
+// Restored history can hold many blocks: highlight each once it scrolls into view
+const lazyHighlighter = typeof IntersectionObserver !== 'undefined'
+    ? new IntersectionObserver(entries => {
+        entries.forEach(entry => {
+            if (entry.isIntersecting) {
+                lazyHighlighter.unobserve(entry.target);
+                delete entry.target.dataset.lazyHighlight;
+                highlightCode(entry.target);
+            }
+        });
+    }, {rootMargin: '200px'})
+    : null;
+
+function highlightWhenVisible(code) {
+    if (!lazyHighlighter) {
+        highlightCode(code);
+        return;
+    }
+    code.dataset.lazyHighlight = '1';
+    lazyHighlighter.observe(code);
+}
+
 function appendMessage(role, text, isImage = false) {
     if (!text || text.trim() === '') return;
 
@@ -28,25 +92,7 @@ function appendMessage(role, text, isImage = false) {
             const codeTag = document.createElement('span');
             codeTag.className = 'code-indicator';
             codeTag.textContent = `📝 Code #${currentBlockNumber}`;
-            codeTag.dataset.targetId = `code-block-${currentBlockNumber}`;
-            codeTag.onclick = () => {
-                const targetBlock = document.getElementById(`code-block-${currentBlockNumber}`);
-                if (targetBlock) {
-                    // Scroll to the code block in the right panel
-                    const codeOutput = document.getElementById('code-output');
-                    const blockOffset = targetBlock.offsetTop - codeOutput.offsetTop;
-                    codeOutput.scrollTo({
-                        top: blockOffset,
-                        behavior: 'smooth'
-                    });
-                    
-                    // Add ripple effect
-                    targetBlock.classList.add('highlight');
-                    setTimeout(() => {
-                        targetBlock.classList.remove('highlight');
-                    }, 1000);
-                }
-            };
+            linkCodeIndicator(codeTag, `code-block-${currentBlockNumber}`, 'code-output');
             indicator.appendChild(document.createTextNode('Code output → '));
             indicator.appendChild(codeTag);
             chat.appendChild(indicator);
@@ -102,13 +148,7 @@ function appendMessage(role, text, isImage = false) {
             feedback.className = 'copy-feedback';
             feedback.textContent = 'Copied!';
 
-            copyBtn.addEventListener('click', () => {
-                navigator.clipboard.writeText(block.content)
-                    .then(() => {
-                        feedback.classList.add('show');
-                        setTimeout(() => feedback.classList.remove('show'), 2000);
-                    });
-            });
+            attachCopyButton(copyBtn, feedback, () => block.content);
 
             header.appendChild(langLabel);
             header.appendChild(copyBtn);
@@ -120,13 +160,7 @@ function appendMessage(role, text, isImage = false) {
             codeOutput.appendChild(wrapper);
             document.getElementById('right-panel').classList.add('visible');
 
-            if (typeof Prism !== 'undefined' && Prism.highlightElement) {
-                requestAnimationFrame(() => {
-                    try {
-                        Prism.highlightElement(code);
-                    } catch(e) { /* ignore */ }
-                });
-            }
+            highlightCode(code);
         } else if (block.type === 'image') {
             const img = document.createElement('img');
             img.className = 'screenshot';
@@ -173,25 +207,7 @@ async function sendMessage() {
         const codeTag = document.createElement('span');
         codeTag.className = 'code-indicator';
         codeTag.textContent = `📝 Code #${currentPastedNumber}`;
-        codeTag.dataset.targetId = `pasted-code-${currentPastedNumber}`;
-        codeTag.onclick = () => {
-            const targetBlock = document.getElementById(`pasted-code-${currentPastedNumber}`);
-            if (targetBlock) {
-                // Scroll to the code block in the left panel
-                const pastedOutput = document.getElementById('pasted-code-output');
-                const blockOffset = targetBlock.offsetTop - pastedOutput.offsetTop;
-                pastedOutput.scrollTo({
-                    top: blockOffset,
-                    behavior: 'smooth'
-                });
-                
-                // Add ripple effect
-                targetBlock.classList.add('highlight');
-                setTimeout(() => {
-                    targetBlock.classList.remove('highlight');
-                }, 1000);
-            }
-        };
+        linkCodeIndicator(codeTag, `pasted-code-${currentPastedNumber}`, 'pasted-code-output');
         
         indicator.appendChild(document.createTextNode('Code input ← '));
         indicator.appendChild(codeTag);
@@ -205,31 +221,50 @@ async function sendMessage() {
     // Get selected AI model
     const aiModelDropdown = document.getElementById('ai-model-dropdown');
     const selectedModel = aiModelDropdown ? aiModelDropdown.value : 'mistral';
+    const tierDropdown = document.getElementById('tier-dropdown');
+    const selectedTier = tierDropdown ? tierDropdown.value : 'auto';
 
     try {
         // Create abort controller for timeout
         const controller = new AbortController();
         const timeoutId = setTimeout(() => controller.abort(), 300000); // 5 minute timeout
 
+        const compare = selectedModel === 'compare';
         const res = await fetch('/chat', {
             method: 'POST',
             headers: {'Content-Type': 'application/json'},
             body: JSON.stringify({
                 message: msg,
-                ai_model: selectedModel
+                ai_model: compare ? undefined : selectedModel,
+                compare: compare,
+                tier: selectedTier
             }),
             signal: controller.signal
         });
 
         clearTimeout(timeoutId);
 
+        if (res.status === 429 || res.status === 503) {
+            // Admission control: server says when to retry
+            const busy = await res.json().catch(() => null);
+            appendMessage('assistant', busy && busy.response ? busy.response : `⏳ Server busy (HTTP ${res.status}). Please retry shortly.`);
+            return;
+        }
+
         if (!res.ok) {
             const errorText = await res.text();
             throw new Error(`HTTP ${res.status}: ${errorText || res.statusText}`);
         }
 
         const data = await res.json();
-        appendMessage('assistant', data.response);
+        if (data.compare) {
+            // One labelled answer per bot, in the order the server returns them
+            data.responses.forEach(answer => {
+                appendMessage('assistant', `${answer.name}:\n\n${answer.response}`);
+            });
+        } else {
+            appendMessage('assistant', data.response);
+        }
     } catch(err) {
         if (err.name === 'AbortError') {
             appendMessage('assistant', '⏱️ Request timeout - The AI is taking too long to respond. Please try again with a shorter message.');
@@ -258,6 +293,12 @@ async function uploadScreenshotFile(file) {
 
         clearTimeout(timeoutId);
 
+        if (res.status === 429 || res.status === 503) {
+            const busy = await res.json().catch(() => null);
+            appendMessage('assistant', busy && busy.response ? busy.response : `⏳ Server busy (HTTP ${res.status}). Please retry shortly.`);
+            return;
+        }
+
         if (!res.ok) {
             const errorText = await res.text();
             throw new Error(`HTTP ${res.status}: ${errorText || res.statusText}`);
@@ -304,13 +345,7 @@ function addPastedCode(content, language, counter) {
     feedback.className = 'copy-feedback';
     feedback.textContent = 'Copied!';
 
-    copyBtn.addEventListener('click', () => {
-        navigator.clipboard.writeText(content)
-            .then(() => {
-                feedback.classList.add('show');
-                setTimeout(() => feedback.classList.remove('show'), 2000);
-            });
-    });
+    attachCopyButton(copyBtn, feedback, () => content);
 
     header.appendChild(langLabel);
     header.appendChild(copyBtn);
@@ -331,13 +366,69 @@ function addPastedCode(content, language, counter) {
     pastedCodeOutput.appendChild(wrapper);
 
     // Use same highlighting method as right panel for consistency
-    if (typeof Prism !== 'undefined' && Prism.highlightElement) {
-        requestAnimationFrame(() => {
-            try {
-                Prism.highlightElement(code);
-            } catch(e) { /* ignore */ }
-        });
-    }
+    highlightCode(code);
 
     pastedCodeOutput.scrollTop = pastedCodeOutput.scrollHeight;
 }
+
+function appendRenderedMessage(html) {
+    // Insert a fragment pre-rendered by the server (message_renderer.py): chat entries
+    // go to the chat, each code block after its entry is numbered and moved to its panel
+    const template = document.createElement('template');
+    template.innerHTML = html;
+    const chatHeight = chat.offsetHeight;
+    let codeTag = null;
+
+    Array.from(template.content.children).forEach(el => {
+        if (!el.classList.contains('codeblock')) {
+            codeTag = el.querySelector('.code-indicator');
+            chat.appendChild(el);
+            return;
+        }
+        const pasted = el.dataset.panel === 'input';
+        const number = pasted ? ++pastedCodeCounter : ++codeBlockCounter;
+        const panelId = pasted ? 'pasted-code-output' : 'code-output';
+        el.id = pasted ? `pasted-code-${number}` : `code-block-${number}`;
+        el.style.maxHeight = `${chatHeight}px`;
+        if (pasted) el.style.marginBottom = '15px';
+
+        const langLabel = el.querySelector('.code-language');
+        if (pasted) langLabel.textContent = `#${number} ${langLabel.textContent}`;
+        if (codeTag) {
+            codeTag.textContent = `📝 Code #${number}`;
+            linkCodeIndicator(codeTag, el.id, panelId);
+            codeTag = null;
+        }
+
+        const pre = el.querySelector('pre');
+        const code = el.querySelector('code');
+        pre.style.maxHeight = `${chatHeight - 40}px`;
+        // Output blocks show ``` as ``\`; copy the original text
+        attachCopyButton(el.querySelector('.copy-btn'), el.querySelector('.copy-feedback'),
+            () => pasted ? code.textContent : code.textContent.replace(/``\\`/g, '```'));
+
+        (pasted ? pastedCodeOutput : codeOutput).appendChild(el);
+        document.getElementById(pasted ? 'input-panel' : 'right-panel').classList.add('visible');
+        highlightWhenVisible(code);
+    });
+}
+
+async function loadHistory() {
+    // Restore the conversation on page load; messages without a fragment are parsed here
+    try {
+        const res = await fetch('/history');
+        if (!res.ok) return;
+        const data = await res.json();
+        data.history.forEach(message => {
+            if (message.html) {
+                appendRenderedMessage(message.html);
+            } else {
+                appendMessage(message.role, message.content);
+            }
+        });
+    } catch(err) {
+        // Start with an empty chat
+        return;
+    }
+    chat.scrollTop = chat.scrollHeight;
+}
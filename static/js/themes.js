@@ -227,7 +227,8 @@ function applyTheme(themeName) {
     // Re-highlight all code blocks
     setTimeout(() => {
         if (typeof Prism !== 'undefined') {
-            document.querySelectorAll('pre code').forEach(block => {
+            // Blocks still waiting for lazy highlighting are done when they scroll into view
+            document.querySelectorAll('pre code:not([data-lazy-highlight])').forEach(block => {
                 // Remove existing highlighting
                 block.removeAttribute('class');
                 block.className = block.parentElement.className.replace('line-numbers', '').trim();
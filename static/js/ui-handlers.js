@@ -12,6 +12,9 @@ function initializeUI() {
 
     // Initialize themes
     initThemes();
+
+    // Restore earlier messages from server-rendered fragments
+    loadHistory();
     
     // Scroll chat to bottom on load - multiple attempts to ensure it works
     const scrollToBottom = () => {
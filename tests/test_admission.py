@@ -0,0 +1,101 @@
+import os
+import time
+import signal
+import threading
+
+import pytest
+
+import admission
+from admission import AdmissionController, AdmissionRejected
+
+
+def test_user_over_cap_is_rejected_without_waiting():
+    controller = AdmissionController(max_inflight=8, per_user=2, max_wait=5)
+    controller.acquire("alice")
+    controller.acquire("alice")
+
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("alice")
+    assert rejected.value.reason == "user"
+    assert time.monotonic() - started < 0.5
+    # Other users are not affected
+    controller.acquire("bob")
+
+
+def test_waiting_request_is_admitted_when_a_slot_frees():
+    controller = AdmissionController(max_inflight=1, per_user=1, max_wait=5)
+    token = controller.acquire("alice")
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(controller.acquire("bob")))
+    waiter.start()
+    time.sleep(0.1)
+    assert not admitted
+
+    controller.release(token, 100)
+    waiter.join(timeout=2)
+    assert admitted and controller.snapshot()["running"] == 1
+
+
+def test_worker_killed_while_waiting_does_not_block_others():
+    controller = AdmissionController(max_inflight=1, per_user=1, max_wait=30)
+    token = controller.acquire("alice")
+    pid = os.fork()
+    if pid == 0:
+        try:
+            controller.acquire("bob")
+        finally:
+            os._exit(0)
+    time.sleep(0.2)
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+    controller.release_pid(pid)
+
+    controller.release(token)
+    controller.acquire("carol")
+
+
+def test_lock_of_dead_worker_is_released_by_child_exit(monkeypatch):
+    monkeypatch.setattr(admission, "LOCK_TIMEOUT", 0.2)
+    controller = AdmissionController(max_inflight=4, per_user=2)
+    pid = os.fork()
+    if pid == 0:
+        # Die inside the critical section
+        with controller._locked():
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("alice")
+    assert rejected.value.reason == "busy"
+
+    controller.release_pid(pid)
+    controller.acquire("alice")
+
+
+def test_sync_workers_shed_instead_of_queuing(monkeypatch):
+    monkeypatch.setenv("GUNICORN_WORKERS", "3")
+    monkeypatch.setenv("GUNICORN_THREADS", "1")
+    monkeypatch.delenv("ADMISSION_MAX_QUEUE", raising=False)
+    monkeypatch.delenv("ADMISSION_MAX_INFLIGHT", raising=False)
+    controller = AdmissionController.from_env()
+    assert (controller.max_inflight, controller.max_queue) == (2, 0)
+
+    controller.acquire("alice")
+    token = controller.acquire("bob")
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire("carol")
+    assert rejected.value.reason == "busy"
+    assert time.monotonic() - started < 0.5
+
+    # A free slot is still taken right away
+    controller.release(token)
+    controller.acquire("carol")
+    assert controller.snapshot()["running"] == 2
+
+
+def test_threaded_workers_keep_a_queue(monkeypatch):
+    monkeypatch.setenv("GUNICORN_THREADS", "4")
+    monkeypatch.delenv("ADMISSION_MAX_QUEUE", raising=False)
+    assert AdmissionController.from_env().max_queue == 32
@@ -0,0 +1,102 @@
+import json
+import time
+import threading
+
+import pytest
+
+from base_bot import ChatResult
+from batch_runner import BatchBusy, BatchRunner, ResultWriter, _is_locked, read_status, write_status
+
+
+class SlowManager:
+    """Stands in for BotManager; records how many completions run at once"""
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.release = threading.Event()
+        self.release.set()
+        self._lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def chat_result(self, bot_id, messages, model=None):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            self.release.wait()
+            time.sleep(self.delay)
+            return ChatResult(text=messages[-1]["content"].upper(), model="stub", total_tokens=3)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def items(prefix, count):
+    return [{"id": f"{prefix}{i}", "message": f"q{i}", "ai_model": "mistral"} for i in range(count)]
+
+
+def wait_done(path, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = read_status(path)
+        # The job writes its final status, then releases the results file
+        if status and status["state"] != "running" and not _is_locked(path):
+            return status
+        time.sleep(0.01)
+    raise AssertionError("batch did not finish")
+
+
+def test_background_batch_writes_results_and_status(tmp_path):
+    path = str(tmp_path / "b1.jsonl")
+    seen = []
+    runner = BatchRunner(SlowManager(), {"mistral": 2})
+
+    status = runner.start("b1", items("a", 5), path, on_result=seen.append)
+
+    assert status["state"] == "running"
+    status = wait_done(path)
+    assert (status["state"], status["ok"], status["failed"], status["skipped"]) == ("finished", 5, 0, 0)
+    with open(path) as fh:
+        results = [json.loads(line) for line in fh]
+    assert sorted(r["id"] for r in results) == sorted(r["id"] for r in seen) == [f"a{i}" for i in range(5)]
+
+    # Resuming skips what already succeeded
+    runner.start("b1", items("a", 6), path)
+    assert wait_done(path)["skipped"] == 5
+
+
+def test_running_batch_is_not_started_twice(tmp_path):
+    path = str(tmp_path / "b2.jsonl")
+    manager = SlowManager()
+    manager.release.clear()
+    runner = BatchRunner(manager)
+
+    runner.start("b2", items("a", 2), path)
+    try:
+        with pytest.raises(BatchBusy):
+            runner.start("b2", items("a", 2), path)
+    finally:
+        manager.release.set()
+    assert wait_done(path)["state"] == "finished"
+
+
+def test_limits_are_shared_by_concurrent_batches(tmp_path):
+    manager = SlowManager()
+    runner = BatchRunner(manager, {"mistral": 2})
+
+    for name in ("x", "y", "z"):
+        runner.start(name, items(name, 4), str(tmp_path / f"{name}.jsonl"))
+    for name in ("x", "y", "z"):
+        assert wait_done(str(tmp_path / f"{name}.jsonl"))["ok"] == 4
+    assert manager.peak == 2
+
+
+def test_running_status_without_lock_reads_interrupted(tmp_path):
+    path = str(tmp_path / "b3.jsonl")
+    writer = ResultWriter(path)
+    write_status(path, {"batch_id": "b3", "state": "running", "total": 3, "skipped": 0, "ok": 1, "failed": 0})
+    assert read_status(path)["state"] == "running"
+
+    writer.close()  # same as the process exiting mid-batch
+    assert read_status(path)["state"] == "interrupted"
@@ -0,0 +1,115 @@
+import ssl
+import time
+import shutil
+import socket
+import threading
+import subprocess
+
+import pytest
+
+from cancellation import CancelToken, DisconnectWatcher
+
+REQUEST = b"POST /chat HTTP/1.1\r\nHost: x\r\nContent-Length: 2\r\n\r\n{}"
+
+
+@pytest.fixture(scope="module")
+def tls_context(tmp_path_factory):
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl not available")
+    directory = tmp_path_factory.mktemp("tls")
+    cert, key = str(directory / "cert.pem"), str(directory / "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                    "-keyout", key, "-out", cert], check=True, capture_output=True)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+def serve_one(context=None):
+    """Accept one connection and read the request like the WSGI server would"""
+    listener = socket.create_server(("127.0.0.1", 0))
+    accepted = {}
+
+    def accept():
+        conn, _ = listener.accept()
+        if context is not None:
+            conn = context.wrap_socket(conn, server_side=True)
+        data = b""
+        while not data.endswith(b"{}"):
+            data += conn.recv(4096)
+        accepted["conn"] = conn
+
+    thread = threading.Thread(target=accept)
+    thread.start()
+    return listener, thread, accepted
+
+
+def connect(port, tls):
+    sock = socket.create_connection(("127.0.0.1", port))
+    if tls:
+        client = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        client.check_hostname = False
+        client.verify_mode = ssl.CERT_NONE
+        sock = client.wrap_socket(sock)
+    sock.sendall(REQUEST)
+    return sock
+
+
+def close_like_browser(client):
+    """Send close_notify, then FIN, without waiting for the server's close_notify"""
+    client.settimeout(0.1)
+    try:
+        client.unwrap()
+    except (ssl.SSLError, OSError):
+        pass
+    client.close()
+
+
+def gone_within(watcher, seconds=2.0):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if watcher.client_gone():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.mark.parametrize("tls", [False, True])
+def test_open_connection_is_not_gone(tls, tls_context):
+    listener, thread, accepted = serve_one(tls_context if tls else None)
+    client = connect(listener.getsockname()[1], tls)
+    thread.join()
+    with DisconnectWatcher({"gunicorn.socket": accepted["conn"]}, CancelToken()) as watcher:
+        assert not gone_within(watcher, 0.3)
+    client.close()
+    accepted["conn"].close()
+    listener.close()
+
+
+@pytest.mark.parametrize("tls", [False, True])
+def test_closed_connection_is_gone(tls, tls_context):
+    listener, thread, accepted = serve_one(tls_context if tls else None)
+    client = connect(listener.getsockname()[1], tls)
+    thread.join()
+    with DisconnectWatcher({"gunicorn.socket": accepted["conn"]}, CancelToken()) as watcher:
+        if tls:
+            # The socket is then readable with the alert's bytes, not at EOF
+            close_like_browser(client)
+        else:
+            client.close()
+        assert gone_within(watcher)
+    accepted["conn"].close()
+    listener.close()
+
+
+def test_watcher_cancels_token_when_tls_client_leaves(tls_context):
+    listener, thread, accepted = serve_one(tls_context)
+    client = connect(listener.getsockname()[1], True)
+    thread.join()
+    token = CancelToken()
+    with DisconnectWatcher({"gunicorn.socket": accepted["conn"]}, token, interval=0.02):
+        close_like_browser(client)
+        assert token.wait(2)
+    assert token.reason == "client disconnected"
+    accepted["conn"].close()
+    listener.close()
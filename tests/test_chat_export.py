@@ -0,0 +1,101 @@
+import io
+import gzip
+
+import pytest
+
+from base_bot import ChatResult
+from chat_export import export_records, gzip_chunks, import_records, ndjson_chunks, open_input
+from chat_store import SQLiteStore, ShardedSQLiteStore
+from message_writer import MessageWriter
+from usage_store import usage_row
+
+# Shards of a 4-shard store: alice 0, bob 3, carol 2
+USERS = {name: f"CN={name},CN=Users,DC=x" for name in ("alice", "bob", "carol")}
+
+
+@pytest.fixture
+def source(tmp_path):
+    store = ShardedSQLiteStore(4, str(tmp_path / "source.db"))
+    store.init()
+    writer = MessageWriter(store, flush_interval=60)
+    for turn in range(5):
+        for name, dn in USERS.items():
+            writer.enqueue_messages(dn, [("user", f"{name} question {turn}", None),
+                                         ("assistant", f"{name} answer {turn} ✓", "mistral")])
+            writer.enqueue_usage(dn, [usage_row(name, "chat", "mistral", ChatResult("", total_tokens=turn),
+                                                user_dn=dn)])
+    writer.flush()
+    writer.stop()
+    return store
+
+
+def history(store, dn):
+    return [(r["role"], r["content"]) for r in export_records(store, dn, types=("message",))]
+
+
+def export_file(store, tmp_path, **kwargs):
+    """Exported NDJSON, gzipped like `export -o file.gz`"""
+    path = tmp_path / "export.ndjson.gz"
+    with open(path, "wb") as out:
+        for chunk in gzip_chunks(ndjson_chunks(export_records(store, **kwargs), chunk_bytes=256)):
+            out.write(chunk)
+    return str(path)
+
+
+@pytest.mark.parametrize("target_shards", [1, 2, 4])
+def test_round_trip_through_gzip_into_any_shard_count(source, tmp_path, target_shards):
+    # Small batches, so every shard's cursor is read in several round trips
+    path = export_file(source, tmp_path, batch_size=3)
+    target = (SQLiteStore(str(tmp_path / "target.db")) if target_shards == 1
+              else ShardedSQLiteStore(target_shards, str(tmp_path / "target.db")))
+
+    with open_input(path) as lines:
+        counts = import_records(target, lines, batch_size=7)
+
+    assert counts == {"message": 30, "usage": 15}
+    for dn in USERS.values():
+        assert history(target, dn) == history(source, dn)
+        assert len(history(target, dn)) == 10
+        assert ([r["total_tokens"] for r in export_records(target, dn, types=("usage",))]
+                == [0, 1, 2, 3, 4])
+
+
+def test_export_covers_every_shard_in_id_order(source):
+    records = list(export_records(source, batch_size=2))
+
+    assert [r["type"] for r in records] == ["message"] * 30 + ["usage"] * 15
+    for dn in USERS.values():
+        contents = [r["content"] for r in records if r["type"] == "message" and r["user_dn"] == dn]
+        name = dn[3:dn.index(",")]
+        assert contents[:2] == [f"{name} question 0", f"{name} answer 0 ✓"]
+        assert contents[-1] == f"{name} answer 4 ✓"
+
+
+def test_user_export_contains_only_that_user(source):
+    records = list(export_records(source, USERS["bob"]))
+
+    assert len(records) == 15
+    assert {r["user_dn"] for r in records} == {USERS["bob"]}
+
+
+def test_open_input_reads_plain_and_gzip(tmp_path):
+    line = '{"type": "message", "role": "user", "content": "hi", "user_dn": null}\n'
+    (tmp_path / "plain.ndjson").write_text(line)
+    with gzip.open(tmp_path / "packed.ndjson", "wt") as fh:
+        fh.write(line)
+
+    for name in ("plain.ndjson", "packed.ndjson"):
+        with open_input(str(tmp_path / name)) as lines:
+            assert list(lines) == [line]
+
+
+@pytest.mark.parametrize("bad", ['{"type": "message", "role": "user"', '{"type": "chat"}', '[1, 2]', "plain text"])
+def test_malformed_line_stops_the_import_after_earlier_batches(tmp_path, bad):
+    store = SQLiteStore(str(tmp_path / "target.db"))
+    good = [f'{{"type": "message", "role": "user", "content": "m{i}", "user_dn": "x"}}\n' for i in range(3)]
+
+    with pytest.raises(ValueError, match="Line 5"):
+        import_records(store, io.StringIO("".join(good[:2]) + "\n" + good[2] + bad + "\n"), batch_size=2)
+
+    # The first full batch was committed; the batch with the bad line was not
+    assert [r["content"] for r in export_records(store, types=("message",))] == ["m0", "m1"]
@@ -0,0 +1,73 @@
+import sqlite3
+
+import pytest
+
+from chat_export import export_records
+from chat_store import SQLiteStore, ShardedSQLiteStore, claim_legacy_rows
+
+ALICE = "CN=alice,CN=Users,DC=x"
+BOB = "CN=bob,CN=Users,DC=x"
+
+
+def dn_for_user(username):
+    return f"CN={username},CN=Users,DC=x"
+
+
+def create_legacy_db(path):
+    """Schema and rows as written before per-user history"""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+    CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, role TEXT NOT NULL, content TEXT NOT NULL,
+                           timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, provider TEXT);
+    CREATE TABLE usage (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        user TEXT, endpoint TEXT NOT NULL, bot TEXT NOT NULL, model TEXT, prompt_tokens INTEGER,
+                        completion_tokens INTEGER, total_tokens INTEGER, history_messages INTEGER,
+                        history_chars INTEGER, upstream_ms REAL, ok INTEGER NOT NULL DEFAULT 1);
+    INSERT INTO messages (role, content) VALUES ('user', 'old question'), ('assistant', 'old answer');
+    INSERT INTO usage (user, endpoint, bot, total_tokens) VALUES ('alice', 'chat', 'mistral', 10),
+                                                               ('bob', 'chat', 'mistral', 20);
+    """)
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture(params=["sqlite", "sharded"])
+def legacy_store(request, tmp_path):
+    if request.param == "sqlite":
+        store = SQLiteStore(str(tmp_path / "chat.db"))
+    else:
+        store = ShardedSQLiteStore(4, str(tmp_path / "chat.db"))
+    # Legacy rows live in the file the old version used: shard 0
+    create_legacy_db(store.paths[0])
+    store.init()
+    return store
+
+
+def messages_of(store, user_dn):
+    return [r["content"] for r in export_records(store, user_dn, types=("message",))]
+
+
+def usage_of(store, user_dn):
+    return [r["total_tokens"] for r in export_records(store, user_dn, types=("usage",))]
+
+
+def test_usage_rows_get_their_owner_back(legacy_store):
+    claimed = claim_legacy_rows(legacy_store, dn_for_user)
+
+    assert claimed == {"messages": 0, "usage": 2}
+    assert usage_of(legacy_store, ALICE) == [10]
+    assert usage_of(legacy_store, BOB) == [20]
+    # Nobody owns the old shared history unless configured
+    assert messages_of(legacy_store, ALICE) == []
+
+
+@pytest.mark.parametrize("owner, other", [(ALICE, BOB), (BOB, ALICE)])
+def test_legacy_owner_receives_old_history(legacy_store, owner, other):
+    claimed = claim_legacy_rows(legacy_store, dn_for_user, owner_dn=owner)
+
+    assert claimed == {"messages": 2, "usage": 2}
+    assert messages_of(legacy_store, owner) == ["old question", "old answer"]
+    assert messages_of(legacy_store, other) == []
+    # Running again on the next start changes nothing
+    assert claim_legacy_rows(legacy_store, dn_for_user, owner_dn=owner) == {"messages": 0, "usage": 0}
+    assert messages_of(legacy_store, owner) == ["old question", "old answer"]
@@ -0,0 +1,43 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import gunicorn_config
+from conversation_cache import ConversationCache
+
+ALICE = "CN=alice,CN=Users,DC=x"
+
+
+def in_worker(func):
+    """Run func in a forked process like a gunicorn worker; returns its exit code"""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os._exit(func())
+        except BaseException:
+            os._exit(99)
+    return os.waitpid(pid, 0)[1] >> 8
+
+
+def test_write_in_another_worker_invalidates_preloaded_cache():
+    cache = ConversationCache(max_bytes=1024 * 1024, slots=16)
+    cache.put(ALICE, [("user", "hi", None)], complete=True, version=cache.version(ALICE))
+    assert cache.get(ALICE, 10) is not None
+
+    assert in_worker(lambda: cache.messages_queued(ALICE, [("user", "from another worker", None)]) or 0) == 0
+
+    assert cache.get(ALICE, 10) is None
+
+
+@pytest.mark.parametrize("preload_app, workers, enabled", [(True, 3, True), (False, 3, False), (False, 1, True)])
+def test_cache_needs_preloaded_workers(monkeypatch, preload_app, workers, enabled):
+    monkeypatch.setenv("CONVERSATION_CACHE_MB", "64")
+    server = SimpleNamespace(cfg=SimpleNamespace(preload_app=preload_app, workers=workers))
+
+    def worker():
+        gunicorn_config.post_fork(server, SimpleNamespace(pid=os.getpid()))
+        # What main.py does next when it is imported in the worker
+        return int(ConversationCache.from_env().enabled)
+
+    assert in_worker(worker) == int(enabled)
@@ -0,0 +1,67 @@
+import re
+
+from base_bot import ChatResult
+from large_input import LargeInputProcessor, clip_message, extract_instruction, split_text
+
+
+class EchoManager:
+    """Bot manager stub: answers with the partial-answer tags (P1, P2, ...) found in the prompt"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def chat_result(self, bot_id, messages, model=None, cancel=None):
+        prompt = messages[-1]["content"]
+        self.prompts.append(prompt)
+        return ChatResult(text=" ".join(re.findall(r"\bP\d+\b", prompt)), model="stub")
+
+
+def test_split_text_prefers_strong_boundaries_and_loses_nothing():
+    config = "\n!\n".join(f"interface Gi0/{i}\n description port {i}\n switchport mode access" for i in range(40))
+
+    chunks = split_text(config, 300)
+
+    assert "".join(chunks) == config
+    assert all(len(chunk) <= 300 for chunk in chunks)
+    assert all(chunk.endswith("\n!\n") for chunk in chunks[:-1])
+
+
+def test_split_text_cuts_text_without_boundaries():
+    assert split_text("x" * 25, 10) == ["x" * 10, "x" * 10, "x" * 5]
+    assert split_text("short", 10) == ["short"]
+
+
+def test_extract_instruction_takes_short_first_and_last_paragraphs():
+    dump = "log line\n" * 500
+    assert extract_instruction(f"Why does this fail?\n\n{dump}\n\nOnly look at errors.") == \
+        "Why does this fail?\n...\nOnly look at errors."
+    assert extract_instruction(dump) == "Analyse this input and summarize the important findings."
+
+
+def test_clip_message_never_grows_the_text():
+    text = "a" * 1500
+    for max_chars in (-30, 0, 1, 200, 1000):
+        assert len(clip_message(text, max_chars)) < len(text)
+
+
+def test_reduce_covers_every_partial_answer_when_they_cannot_be_paired():
+    manager = EchoManager()
+    processor = LargeInputProcessor(manager, chunk_chars={"mistral": 2000})
+    partials = [f"P{i} " + "finding " * 185 for i in range(1, 41)]
+    spent = []
+
+    result = processor._reduce("mistral", [], partials, "Find errors", 60000, 40, None, spent)
+
+    assert result.ok
+    # The last prompt is the reduce: all 40 partial answers reached it, directly or merged
+    assert set(re.findall(r"\bP\d+\b", manager.prompts[-1])) == {f"P{i}" for i in range(1, 41)}
+    assert len(spent) == len(manager.prompts)
+
+
+def test_reduce_sends_one_prompt_when_partials_fit():
+    manager = EchoManager()
+    processor = LargeInputProcessor(manager, chunk_chars={"mistral": 2000})
+
+    processor._reduce("mistral", [], ["P1 ok", "P2 ok"], "Find errors", 5000, 2, None, [])
+
+    assert len(manager.prompts) == 1 and "P1 ok" in manager.prompts[0] and "P2 ok" in manager.prompts[0]
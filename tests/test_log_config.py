@@ -0,0 +1,56 @@
+import os
+import json
+import time
+import signal
+import logging
+
+import log_config
+
+
+def test_forked_worker_only_enqueues(tmp_path):
+    log_config.setup_logging(str(tmp_path / "master"))
+    try:
+        pid = os.fork()
+        if pid == 0:
+            # What a worker does when it imports main.py without preload_app
+            log_config.setup_logging(str(tmp_path / "worker"))
+            logging.getLogger("worker").warning("from worker")
+            log_config.flush_logging()
+            os._exit(0)
+        os.waitpid(pid, 0)
+    finally:
+        log_config.stop_logging()
+
+    assert not (tmp_path / "worker").exists()
+    with open(tmp_path / "master" / "azikiai.log") as fh:
+        records = [json.loads(line) for line in fh]
+    assert [(r["msg"], r["pid"]) for r in records if r["logger"] == "worker"] == [("from worker", pid)]
+
+
+def test_worker_killed_while_logging_does_not_block_others(tmp_path):
+    log_config.setup_logging(str(tmp_path))
+    try:
+        killed = os.fork()
+        if killed == 0:
+            while True:
+                logging.getLogger("killed").warning("x" * 10000)
+        time.sleep(0.2)
+        os.kill(killed, signal.SIGKILL)
+        os.waitpid(killed, 0)
+
+        pid = os.fork()
+        if pid == 0:
+            logging.getLogger("worker").warning("after the kill")
+            log_config.flush_logging()
+            os._exit(0)
+        started = time.monotonic()
+        os.waitpid(pid, 0)
+        assert time.monotonic() - started < 5
+        logging.getLogger("master").warning("master too")
+    finally:
+        log_config.stop_logging()
+
+    with open(tmp_path / "azikiai.log") as fh:
+        records = [json.loads(line) for line in fh]
+    assert ("after the kill", pid) in [(r["msg"], r["pid"]) for r in records]
+    assert "master too" in [r["msg"] for r in records]
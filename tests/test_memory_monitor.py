@@ -0,0 +1,105 @@
+import io
+import os
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+import gunicorn_config
+import memory_monitor
+from memory_monitor import MemoryMonitor, read_memory
+
+MB = 1024 * 1024
+
+SMAPS_ROLLUP = """\
+55d0c0a00000-7ffd1b9f6000 ---p 00000000 00:00 0                          [rollup]
+Rss:              204800 kB
+Pss:              102400 kB
+Pss_Anon:          81920 kB
+Shared_Clean:      81920 kB
+Shared_Dirty:      20480 kB
+Private_Clean:      2048 kB
+Private_Dirty:    100352 kB
+Swap:                  0 kB
+"""
+
+
+def fake_proc(monkeypatch, files):
+    """Serve /proc/self/<name> from files; other names are missing"""
+    def fake_open(path, *args, **kwargs):
+        name = os.path.basename(path)
+        if name not in files:
+            raise FileNotFoundError(path)
+        return io.StringIO(files[name])
+    monkeypatch.setattr(memory_monitor, "open", fake_open, raising=False)
+
+
+def test_smaps_rollup_private_is_clean_plus_dirty(monkeypatch):
+    fake_proc(monkeypatch, {"smaps_rollup": SMAPS_ROLLUP})
+
+    assert read_memory() == {"rss": 200 * MB, "pss": 100 * MB, "private": 100 * MB}
+
+
+def test_statm_fallback_counts_rss_as_private(monkeypatch):
+    fake_proc(monkeypatch, {"statm": "50000 2560 300 10 0 4000 0\n"})
+
+    rss = 2560 * memory_monitor.PAGE_SIZE
+    assert read_memory() == {"rss": rss, "pss": rss, "private": rss}
+
+
+def test_real_reading_is_plausible():
+    memory = read_memory()
+    assert 0 < memory["private"] <= memory["rss"]
+
+
+@pytest.fixture
+def private_mb(monkeypatch):
+    """Set the private memory the monitor reads, in MB"""
+    reading = {"private": 0}
+    monkeypatch.setattr(memory_monitor, "read_memory",
+                        lambda pid=None: {"rss": reading["private"] * 2, "pss": reading["private"],
+                                          "private": reading["private"]})
+
+    def set_private(mb):
+        reading["private"] = mb * MB
+    return set_private
+
+
+def test_recycles_only_above_the_limit_and_only_on_check_requests(private_mb):
+    monitor = MemoryMonitor(max_private_mb=512, check_every=3)
+    monitor.worker_started()
+
+    private_mb(512)
+    assert [monitor.request_finished() for _ in range(3)] == [False, False, False]
+    private_mb(513)
+    # Readings are taken every third request only
+    assert [monitor.request_finished() for _ in range(3)] == [False, False, True]
+    assert [monitor.request_finished() for _ in range(3)] == [False, False, True]
+
+    stats = monitor.stats()
+    assert stats["recycled"] == 1
+    assert stats["workers"][0]["recycling"] and stats["workers"][0]["peak_private"] == 513 * MB
+
+
+def test_zero_limit_never_recycles(private_mb):
+    monitor = MemoryMonitor(max_private_mb=0, check_every=1)
+    private_mb(100000)
+    assert not any(monitor.request_finished() for _ in range(5))
+
+
+def post_request(monitor, monkeypatch, requests):
+    monkeypatch.setattr(memory_monitor, "_memory_monitor", monitor)
+    worker = SimpleNamespace(pid=os.getpid(), alive=True, log=logging.getLogger("test"))
+    for _ in range(requests):
+        gunicorn_config.post_request(worker, None, {}, None)
+    return worker
+
+
+def test_post_request_stops_a_worker_over_the_limit(private_mb, monkeypatch):
+    private_mb(2048)
+    assert not post_request(MemoryMonitor(max_private_mb=1024, check_every=1), monkeypatch, 1).alive
+
+
+def test_post_request_keeps_a_worker_under_the_limit(private_mb, monkeypatch):
+    private_mb(1000)
+    assert post_request(MemoryMonitor(max_private_mb=1024, check_every=1), monkeypatch, 20).alive
@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import subprocess
+from html.parser import HTMLParser
+
+from message_renderer import FragmentCache, render_message
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ATTACK = '<script>alert("x")</script><img src=x onerror=alert(1)>'
+
+
+class Elements(HTMLParser):
+    """Top-level elements and every tag name of a fragment"""
+
+    def __init__(self, html):
+        super().__init__()
+        self.depth = 0
+        self.top = []
+        self.tags = []
+        self.feed(html)
+
+    def handle_starttag(self, tag, attrs):
+        if self.depth == 0:
+            self.top.append(dict(attrs).get("class", tag))
+        self.tags.append(tag)
+        self.depth += 1
+
+    def handle_endtag(self, tag):
+        self.depth -= 1
+
+
+def test_content_is_escaped():
+    for role, content in [("user", ATTACK), ("assistant", ATTACK), ("assistant", f"```\n{ATTACK}\n```"),
+                          ("user", f"```python\n{ATTACK}\n```")]:
+        html = render_message(role, content)
+        assert set(Elements(html).tags) <= {"div", "span", "button", "pre", "code", "br"}
+        assert "&lt;script&gt;" in html
+
+
+def test_one_entry_per_text_block_and_code_block():
+    assert Elements(render_message("assistant", "Hello")).top == ["message assistant"]
+    assert Elements(render_message("assistant", "Try:\n```python\nprint(1)\n```\nDone")).top == [
+        "message assistant", "message assistant", "codeblock", "message assistant"]
+    assert Elements(render_message("user", "```sql\nSELECT 1;\n```")).top == ["message user", "codeblock"]
+
+
+def test_cache_returns_the_rendered_fragment():
+    cache = FragmentCache()
+    assert cache.render("user", ATTACK) == cache.render("user", ATTACK) == render_message("user", ATTACK)
+    assert cache.stats()["hits"] == 1
+
+
+HISTORY_REQUEST = """
+import json
+import main
+user = "CN=alice,CN=Users,DC=x"
+main.message_writer.enqueue_messages(user, [("user", "hi", None), ("user", %(attack)r, None),
+                                            ("assistant", "See:\\n```python\\nprint(1)\\n```", "mistral")])
+client = main.app.test_client()
+with client.session_transaction() as session:
+    session["_user_id"] = user
+    session["_fresh"] = True
+response = client.get("/history")
+main.message_writer.stop()
+print(json.dumps(response.get_json()))
+"""
+
+
+def test_history_returns_one_escaped_fragment_per_message(tmp_path):
+    env = dict(os.environ, LDAP_HOST="localhost", LDAP_BASE_DN="DC=x", SECRET_KEY="test", MISTRAL_API_KEY="test",
+               LOG_DIR=str(tmp_path / "logs"), CHAT_DB_PATH=str(tmp_path / "chat.db"),
+               BATCH_DIR=str(tmp_path / "batches"), UPLOAD_FOLDER=str(tmp_path / "uploads"),
+               RATELIMIT_ENABLED="false")
+    result = subprocess.run([sys.executable, "-c", HISTORY_REQUEST % {"attack": ATTACK}], cwd=REPO, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert (tmp_path / "logs" / "azikiai.log").exists()
+
+    history = json.loads(result.stdout.strip().splitlines()[-1])["history"]
+
+    assert [message["content"] for message in history][:2] == ["hi", ATTACK]
+    assert [Elements(message["html"]).top for message in history] == [
+        ["message user"], ["message user"], ["message assistant", "message assistant", "codeblock"]]
+    assert "<script" not in "".join(message["html"] for message in history)
@@ -0,0 +1,145 @@
+import time
+import threading
+
+import pytest
+
+from chat_store import SQLiteStore
+from conversation_cache import ConversationCache
+from message_writer import MessageWriter
+
+ALICE = "CN=alice,CN=Users,DC=x"
+
+# A lone surrogate: valid in a Python str, not encodable as UTF-8 for SQLite
+UNENCODABLE = "broken \ud800 paste"
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / "chat.db"))
+    store.init()
+    return store
+
+
+def stored(store):
+    conn = store.connect(0)
+    try:
+        return [row["content"] for row in conn.execute("SELECT content FROM messages ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def test_unwritable_row_is_dropped_and_later_rows_commit(store):
+    writer = MessageWriter(store, flush_interval=0.01)
+    try:
+        writer.enqueue_messages(ALICE, [("user", "before", None), ("user", UNENCODABLE, None),
+                                        ("assistant", "after", "mistral")])
+        assert writer.wait_until_written(ALICE, timeout=5)
+        writer.enqueue_messages(ALICE, [("user", "later", None)])
+        assert writer.wait_until_written(ALICE, timeout=5)
+        assert writer._thread.is_alive()
+    finally:
+        writer.stop()
+    assert stored(store) == ["before", "after", "later"]
+
+
+def test_dropped_rows_leave_the_conversation_cache(store):
+    cache = ConversationCache(max_bytes=1024 * 1024, slots=16)
+    writer = MessageWriter(store, flush_interval=60)
+    writer.add_listener(cache)
+    cache.put(ALICE, [], complete=True, version=cache.version(ALICE))
+    writer.enqueue_messages(ALICE, [("user", "fine", None), ("user", UNENCODABLE, None)])
+    assert [row[1] for row in cache.get(ALICE, 10)] == ["fine", UNENCODABLE]
+
+    writer.flush()
+
+    assert cache.get(ALICE, 10) is None
+    writer.stop()
+    assert stored(store) == ["fine"]
+
+
+def test_dead_writer_thread_is_restarted(store):
+    writer = MessageWriter(store, flush_interval=0.01)
+    writer.enqueue_messages(ALICE, [("user", "first", None)])
+    assert writer.wait_until_written(ALICE, timeout=5)
+
+    # Simulate the thread dying with its connections still open
+    writer._close_connection = lambda: None
+    writer._stopping = True
+    writer._thread.join(timeout=5)
+    writer._stopping = False
+    del writer._close_connection
+    assert not writer._thread.is_alive() and writer._conns
+
+    writer.enqueue_messages(ALICE, [("user", "second", None)])
+    try:
+        assert writer.wait_until_written(ALICE, timeout=5)
+    finally:
+        writer.stop()
+    assert stored(store) == ["first", "second"]
+
+
+def test_busy_database_keeps_rows_queued(store):
+    writer = MessageWriter(store, flush_interval=60)
+    blocker = store.connect(0)
+    blocker.execute("PRAGMA busy_timeout = 0")
+    blocker.execute("BEGIN IMMEDIATE")
+    conn = writer._connection(0)
+    conn.execute("PRAGMA busy_timeout = 0")
+    writer.enqueue_messages(ALICE, [("user", "waits", None)])
+
+    assert writer.flush() == 0
+    blocker.rollback()
+    blocker.close()
+    assert writer.flush() == 1
+    writer.stop()
+    assert stored(store) == ["waits"]
+
+
+def read_history(store, writer, user_dn, between=lambda: None):
+    """What main.load_recent_messages() does: database rows plus rows still queued"""
+    with writer.read_view(user_dn) as view:
+        between()
+        conn = store.connect(0)
+        try:
+            fetched = conn.execute("SELECT id, content FROM messages WHERE user_dn = ? ORDER BY id",
+                                   (user_dn,)).fetchall()
+        finally:
+            conn.close()
+        queued = view.queued(row["id"] for row in fetched)
+    return [row["content"] for row in fetched] + [row[1] for row in queued]
+
+
+def test_read_view_does_not_wait_for_a_flush_on_a_busy_database(store):
+    writer = MessageWriter(store, flush_interval=60)
+    blocker = store.connect(0)
+    blocker.execute("BEGIN IMMEDIATE")
+    conn = writer._connection(0)
+    conn.execute("PRAGMA busy_timeout = 2000")
+    writer.enqueue_messages(ALICE, [("user", "waits", None)])
+    flushing = threading.Thread(target=writer.flush)
+    flushing.start()
+    time.sleep(0.1)
+
+    started = time.monotonic()
+    with writer.read_view(ALICE) as view:
+        assert [row[1] for row in view.queued([])] == ["waits"]
+    assert time.monotonic() - started < 0.5
+
+    blocker.rollback()
+    blocker.close()
+    flushing.join()
+    writer.stop()
+
+
+def test_rows_committed_during_a_read_are_returned_once(store):
+    writer = MessageWriter(store, flush_interval=60)
+    writer.enqueue_messages(ALICE, [("user", "one", None)])
+    writer.flush()
+    writer.enqueue_messages(ALICE, [("user", "two", None)])
+
+    # Committed after the view opened but before the database read
+    assert read_history(store, writer, ALICE, between=writer.flush) == ["one", "two"]
+    writer.enqueue_messages(ALICE, [("user", "three", None)])
+    assert read_history(store, writer, ALICE) == ["one", "two", "three"]
+    writer.stop()
+    assert writer._ids == {}
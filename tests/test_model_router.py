@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+
+import pytest
+
+from mistral_bot import MistralBot
+from model_router import ModelRouter, Route
+
+CODE_STARTS = ("def ", "import ", "return ", "for ", "class ")
+
+
+def detect_language(line):
+    return "python" if line.strip().startswith(CODE_STARTS) else "plaintext"
+
+
+def stub_bot(models):
+    """All select() reads from a bot"""
+    return SimpleNamespace(get_model_info=lambda: {"name": "Stub", "models": models})
+
+
+@pytest.fixture
+def router():
+    return ModelRouter(detect_language, large_min_chars=1500, code_min_chars=300, large_history_chars=12000)
+
+
+@pytest.mark.parametrize("length, tier", [(1499, "fast"), (1500, "large")])
+def test_message_length_boundary(router, length, tier):
+    assert router.classify("a" * length, []).tier == tier
+
+
+def test_code_needs_the_minimum_length(router):
+    code = "```python\nprint(1)\n```"
+    assert router.classify(code, []).tier == "fast"
+    padded = code + "\n" + "# comment\n" * ((300 - len(code)) // 10 + 1)
+    assert router.classify(padded, []).reasons == ["code"]
+
+
+def test_unfenced_code_needs_three_code_lines_and_a_quarter_of_all_lines(router):
+    code = "import os\ndef main():\n    return os.getcwd()\n"
+    assert router.has_code(code)
+    assert not router.has_code("import os\ndef main():\n")
+    assert not router.has_code(code + "prose line\n" * 10)
+
+
+@pytest.mark.parametrize("history_chars, tier", [(11999, "fast"), (12000, "large")])
+def test_history_boundary(router, history_chars, tier):
+    history = [{"role": "user", "content": "a" * (history_chars - 1)}, {"role": "assistant", "content": "b"}]
+    assert router.classify("hi", history).tier == tier
+
+
+def test_thresholds_from_env(monkeypatch):
+    monkeypatch.setenv("ROUTER_LARGE_MIN_CHARS", "10")
+    monkeypatch.setenv("ROUTER_CODE_MIN_CHARS", "5")
+    monkeypatch.setenv("ROUTER_LARGE_HISTORY_CHARS", "20")
+    router = ModelRouter.from_env(detect_language)
+
+    assert (router.large_min_chars, router.code_min_chars, router.large_history_chars) == (10, 5, 20)
+    assert router.classify("a" * 10, []).tier == "large"
+    assert router.classify("hi", [{"role": "user", "content": "a" * 20}]).tier == "large"
+
+
+def test_select_resolves_the_tier_model_and_override(router):
+    bot = stub_bot({"fast": "small-model", "large": "big-model"})
+    route = router.classify("hi", [])
+
+    assert router.select(bot, route).model == "small-model"
+    assert router.select(bot, route, "auto") == Route("fast", "small-model", ["short, no code"], False)
+    forced = router.select(bot, route, "large")
+    assert (forced.model, forced.overridden) == ("big-model", True)
+    assert not router.select(bot, route, "fast").overridden
+
+
+@pytest.mark.parametrize("models", [None, {}, {"fast": "small-model"}, {"fast": "small-model", "large": ""}])
+def test_unconfigured_tier_falls_back_to_the_default_model(router, models):
+    assert router.select(stub_bot(models), Route("large", None), "large").model is None
+
+
+def test_bot_models_from_env(monkeypatch, router):
+    monkeypatch.setenv("MISTRAL_MODEL_FAST", "open-mistral-nemo")
+    monkeypatch.setenv("MISTRAL_MODEL_LARGE", "")
+    bot = MistralBot(api_key="test")
+
+    assert router.select(bot, router.classify("hi", [])).model == "open-mistral-nemo"
+    assert router.select(bot, router.classify("a" * 2000, [])).model is None
@@ -0,0 +1,42 @@
+import os
+import pstats
+
+from cancellation import CancelToken, run_cancellable
+from request_profiler import RequestProfiler
+
+
+def busy_helper():
+    total = 0
+    for i in range(100000):
+        total += i
+    return total
+
+
+def test_helper_thread_work_is_merged_into_capture(tmp_path):
+    profiler = RequestProfiler(enabled=True, profile_dir=str(tmp_path))
+
+    result = profiler.run("/chat", lambda: run_cancellable(CancelToken(), busy_helper))
+
+    assert result == busy_helper()
+    (capture,) = profiler.list_captures()
+    stats = pstats.Stats(os.path.join(str(tmp_path), capture["name"] + ".prof"))
+    assert any(func == "busy_helper" for _, _, func in stats.stats)
+    with open(os.path.join(str(tmp_path), capture["name"] + ".txt")) as fh:
+        assert "1 helper thread task(s)" in fh.readline()
+
+
+def test_list_captures_skips_files_deleted_meanwhile(tmp_path, monkeypatch):
+    profiler = RequestProfiler(enabled=True, profile_dir=str(tmp_path))
+    profiler.run("/history", busy_helper)
+    profiler.run("/history", busy_helper)
+    first, second = sorted(e.name for e in os.scandir(str(tmp_path)) if e.name.endswith(".prof"))
+
+    real_scandir = os.scandir
+
+    def scandir_then_delete(path):
+        entries = list(real_scandir(path))
+        os.remove(os.path.join(path, first))
+        return entries
+
+    monkeypatch.setattr(os, "scandir", scandir_then_delete)
+    assert [c["name"] + ".prof" for c in profiler.list_captures()] == [second]
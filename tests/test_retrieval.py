@@ -0,0 +1,106 @@
+import time
+import random
+import threading
+
+import pytest
+
+import retrieval
+from chat_store import SQLiteStore
+from message_writer import MessageWriter
+from retrieval import VectorIndex, _UserVectors, embed
+
+ALICE = "CN=alice,CN=Users,DC=x"
+
+HISTORY = [
+    ("user", "How do I configure a VLAN trunk on a Cisco switch port?", None),
+    ("assistant", "Use switchport mode trunk and switchport trunk allowed vlan on the interface.", "mistral"),
+    ("user", "What is a good recipe for banana bread?", None),
+    ("assistant", "Mash three ripe bananas, mix with flour, sugar, butter and an egg, then bake.", "mistral"),
+]
+
+
+@pytest.fixture(params=["numpy", "python"], autouse=True)
+def scoring(request, monkeypatch):
+    """Run every test with NumPy scoring and with the plain-Python fallback"""
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(retrieval, "np", None)
+    return request.param
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / "chat.db"))
+    store.init()
+    return store
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_retrieves_relevant_message_written_by_the_writer(store):
+    index = VectorIndex(store, top_k=1, min_score=0.1)
+    writer = MessageWriter(store, flush_interval=60)
+    writer.add_listener(index)
+    writer.enqueue_messages(ALICE, HISTORY)
+    writer.flush()
+    writer.stop()
+
+    found = index.retrieve(ALICE, "allowed vlan list on a trunk interface")
+
+    assert [message["content"] for message in found] == [HISTORY[1][1]]
+
+
+def test_messages_without_vectors_are_indexed_off_the_request_thread(store):
+    # Written without the index as a listener, like rows from an older version
+    writer = MessageWriter(store, flush_interval=60)
+    writer.enqueue_messages(ALICE, HISTORY)
+    writer.flush()
+    writer.stop()
+
+    index = VectorIndex(store, top_k=1, min_score=0.1)
+    indexed_in = []
+    release = threading.Event()
+    index_missing = index.index_missing
+
+    def slow_index_missing(conn, user_dn=None, batch_size=500):
+        indexed_in.append(threading.current_thread())
+        release.wait(5)
+        return index_missing(conn, user_dn, batch_size)
+    index.index_missing = slow_index_missing
+
+    # The request does not wait for the backfill: nothing is indexed yet
+    assert index.retrieve(ALICE, "mashed bananas with flour and butter") == []
+    release.set()
+    wait_for(lambda: index.retrieve(ALICE, "mashed bananas with flour and butter"))
+
+    assert len(indexed_in) == 1 and indexed_in[0] is not threading.current_thread()
+    assert index.retrieve(ALICE, "mashed bananas with flour and butter")[0]["content"] == HISTORY[3][1]
+
+
+def test_top_k_is_ordered_and_topped_up_in_place():
+    rng = random.Random(7)
+    vectors = [embed(" ".join(rng.choice(["vlan", "trunk", "ospf", "flask", "docker", "queue"])
+                              for _ in range(rng.randint(2, 8)))) for _ in range(150)]
+    entry = _UserVectors()
+    # Several top-ups, the way each request fetches only the rows added since
+    for start in range(0, 150, 40):
+        entry.add([(i + 1, vectors[i].tobytes()) for i in range(start, min(start + 40, 150))])
+    entry.add([(999, b"short")])
+    query = embed("trunk vlan ospf")
+
+    found = entry.search(query, 10)
+
+    expected = sorted(((sum(q * v for q, v in zip(query, vectors[i])), i + 1) for i in range(150)),
+                      key=lambda hit: -hit[0])
+    assert [score for score, _ in found] == pytest.approx([score for score, _ in expected[:10]], abs=1e-5)
+    # Ties may come in either order, but every hit has its own score
+    scores = dict((message_id, score) for score, message_id in expected)
+    assert all(score == pytest.approx(scores[message_id], abs=1e-5) for score, message_id in found)
+    assert entry.max_id == 150 and entry.count == 150
+    assert len(entry.search(query, 500)) == 150
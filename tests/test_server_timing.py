@@ -0,0 +1,112 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import server_timing
+from server_timing import Timings, bind, span
+
+# RFC 8941-style metric: token, then ;param=token-or-quoted-string
+METRIC = re.compile(r'[!#$%&\'*+.^_`|~\w-]+(;[\w-]+=([!#$%&\'*+.^_`|~\w-]+|"([^"\\\x00-\x1f\x7f]|\\.)*"))*')
+
+
+def parse(header):
+    """(name, desc, dur) per metric; fails the test on a malformed metric"""
+    metrics = []
+    for metric in header.split(", "):
+        assert METRIC.fullmatch(metric), metric
+        params = dict(re.findall(r';([\w-]+)=("(?:[^"\\]|\\.)*"|[^;]*)', metric))
+        desc = params.get("desc")
+        if desc is not None:
+            desc = re.sub(r"\\(.)", r"\1", desc[1:-1])
+        metrics.append((metric.split(";")[0], desc, float(params["dur"])))
+    return metrics
+
+
+@pytest.fixture(autouse=True)
+def no_request():
+    yield
+    server_timing.finish()
+
+
+def test_header_lists_stages_then_total():
+    timings = Timings()
+    timings.add("auth", 0.44)
+    timings.add("upstream", 812.345, "Mistral AI mistral-small-latest")
+
+    metrics = parse(timings.header())
+
+    assert metrics[:2] == [("auth", None, 0.4), ("upstream", "Mistral AI mistral-small-latest", 812.3)]
+    assert metrics[2][0] == "total" and metrics[2][1] is None
+
+
+@pytest.mark.parametrize("desc, sent", [
+    ('model "large"', 'model "large"'),
+    ("C:\\models\\m", "C:\\models\\m"),
+    ("línea\ntwo\r\x00", "l?nea two  "),
+    ("mixed \\\" end\\", "mixed \\\" end\\"),
+])
+def test_desc_is_a_valid_quoted_string(desc, sent):
+    timings = Timings()
+    timings.add("upstream", 1, desc)
+
+    header = timings.header()
+
+    header.encode("latin-1")
+    assert parse(header)[0] == ("upstream", sent, 1.0)
+
+
+def test_span_records_even_when_the_block_raises():
+    timings = server_timing.start()
+    with pytest.raises(RuntimeError):
+        with span("upstream", "failing"):
+            raise RuntimeError
+    assert [(e["name"], e["desc"]) for e in timings.entries()] == [("upstream", "failing")]
+
+
+def test_span_outside_a_request_records_nothing():
+    with span("db-read"):
+        pass
+    server_timing.record("queue", 5)
+    assert server_timing.current() is None
+
+
+def test_bound_helper_thread_spans_land_in_their_own_request():
+    executor = ThreadPoolExecutor(max_workers=2)
+    ready = threading.Barrier(2)
+    collected = {}
+
+    def upstream(desc):
+        with span("upstream", desc):
+            pass
+
+    def request(name):
+        timings = server_timing.start()
+        ready.wait()
+        # The same pool threads serve both requests
+        futures = [executor.submit(bind(upstream), f"{name} {i}") for i in range(4)]
+        for future in futures:
+            future.result()
+        collected[name] = timings
+        server_timing.finish()
+
+    threads = [threading.Thread(target=request, args=(name,)) for name in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    executor.shutdown()
+
+    for name in ("a", "b"):
+        assert sorted(e["desc"] for e in collected[name].entries()) == [f"{name} {i}" for i in range(4)]
+
+
+def test_unbound_helper_thread_records_nothing():
+    timings = server_timing.start()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(lambda: server_timing.record("upstream", 1)).result()
+    assert timings.entries() == []
+    assert bind(len) is not len
+    server_timing.finish()
+    assert bind(len) is len
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from chat_store import ShardedSQLiteStore
+from usage_store import aggregate_usage, insert_usage
+
+# Shards of a 4-shard store: alice 0, bob 3 (1 and 2 stay empty)
+ALICE = "CN=alice,CN=Users,DC=x"
+BOB = "CN=bob,CN=Users,DC=x"
+
+NOW = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+LONG_AGO = "2000-01-01 00:00:00"
+
+
+def row(user, dn, bot, model, total, upstream_ms, ok=1, history=(0, 0), timestamp=NOW):
+    """insert_usage() row; prompt and completion tokens split total 3:1"""
+    return (user, "chat", bot, model, total * 3 // 4, total // 4, total, history[0], history[1],
+            upstream_ms, ok, timestamp, dn, "fast")
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ShardedSQLiteStore(4, str(tmp_path / "chat.db"))
+    store.init()
+    rows = {
+        ALICE: [row("alice", ALICE, "mistral", "small", 100, 200.0, history=(2, 40)),
+                row("alice", ALICE, "mistral", "small", 300, 400.0, history=(4, 80)),
+                row("alice", ALICE, "github-copilot", "gpt-4o", 1000, None, ok=0),
+                row("alice", ALICE, "mistral", "small", 5000, 100.0, timestamp=LONG_AGO)],
+        BOB: [row("bob", BOB, "mistral", "small", 200, 900.0, history=(6, 120))],
+    }
+    for dn, user_rows in rows.items():
+        conn = store.connect_for_user(dn)
+        with conn:
+            insert_usage(conn.cursor(), user_rows)
+        conn.close()
+    return store
+
+
+def aggregate(store, group_by, **kwargs):
+    conns = store.connections()
+    try:
+        return aggregate_usage(conns, group_by, **kwargs)
+    finally:
+        for conn in conns:
+            conn.close()
+
+
+def test_group_split_across_shards_is_merged(store):
+    rows = aggregate(store, ["bot", "model"])
+
+    assert [(r["bot"], r["model"]) for r in rows] == [("github-copilot", "gpt-4o"), ("mistral", "small")]
+    mistral = rows[1]
+    assert (mistral["requests"], mistral["errors"]) == (3, 0)
+    assert (mistral["prompt_tokens"], mistral["completion_tokens"], mistral["total_tokens"]) == (450, 150, 600)
+    # Averages come from the merged sums, not from averaging per-shard averages
+    assert mistral["avg_upstream_ms"] == 500.0
+    assert mistral["max_upstream_ms"] == 900.0
+    assert (mistral["avg_history_messages"], mistral["avg_history_chars"]) == (4.0, 80)
+
+
+def test_grouped_by_user_biggest_spender_first(store):
+    rows = aggregate(store, ["user"])
+
+    assert [(r["user"], r["requests"], r["total_tokens"], r["errors"]) for r in rows] == [
+        ("alice", 3, 1400, 1), ("bob", 1, 200, 0)]
+    # Only alice's mistral requests were timed
+    assert rows[0]["avg_upstream_ms"] == 300.0
+
+
+def test_totals_without_grouping_skip_empty_shards_and_old_rows(store):
+    assert aggregate(store, []) == [{
+        "requests": 4, "errors": 1, "prompt_tokens": 1200, "completion_tokens": 400, "total_tokens": 1600,
+        "avg_history_messages": 3.0, "avg_history_chars": 60, "avg_upstream_ms": 500.0, "max_upstream_ms": 900.0,
+    }]
+    assert aggregate(store, [], days=100000)[0]["requests"] == 5
+
+
+def test_filters_and_unknown_group(store):
+    assert [r["bot"] for r in aggregate(store, ["bot"], user="bob")] == ["mistral"]
+    assert [r["user"] for r in aggregate(store, ["user"], bot="github-copilot")] == ["alice"]
+    with pytest.raises(ValueError, match="Cannot group by"):
+        aggregate(store, ["user; DROP TABLE usage"])
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Usage Store
+Per-request token usage and upstream latency accounting in SQLite
+One row per upstream completion, aggregated per user/bot/model/day
+"""
+
+import time
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional
+
+from base_bot import ChatResult
+
+# Columns callers may group by, mapped to their SQL expression
+GROUP_COLUMNS = {
+    "user": "user",
+    "bot": "bot",
+    "model": "model",
+    "endpoint": "endpoint",
+    "tier": "tier",
+    "day": "date(timestamp)",
+}
+
+
+def init_usage_table(cursor: sqlite3.Cursor) -> None:
+    """
+    Create usage table and indexes if missing
+
+    Args:
+        cursor: Cursor on the chat history database
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS usage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        user TEXT,
+        user_dn TEXT,
+        endpoint TEXT NOT NULL,
+        bot TEXT NOT NULL,
+        model TEXT,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        total_tokens INTEGER,
+        history_messages INTEGER,
+        history_chars INTEGER,
+        upstream_ms REAL,
+        ok INTEGER NOT NULL DEFAULT 1,
+        tier TEXT
+    )
+    """)
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(usage)")}
+    if "user_dn" not in columns:
+        # Needed to route rows to the user's shard (see chat_store.py)
+        cursor.execute("ALTER TABLE usage ADD COLUMN user_dn TEXT")
+    if "tier" not in columns:
+        # Model tier chosen by model_router.py ("fast"/"large"); NULL when not routed
+        cursor.execute("ALTER TABLE usage ADD COLUMN tier TEXT")
+    # Aggregates are always filtered by time, usually per user or bot
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_timestamp ON usage (timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_user_timestamp ON usage (user, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_bot_timestamp ON usage (bot, timestamp)")
+
+
+def usage_row(user: Optional[str], endpoint: str, bot: str, result: ChatResult,
+              history: Optional[List[Dict[str, str]]] = None, user_dn: Optional[str] = None,
+              tier: Optional[str] = None) -> tuple:
+    """
+    Build a usage row for insert_usage()
+
+    Args:
+        user: Username (None for CLI/batch runs without a user)
+        endpoint: Route that triggered the request ("chat", "upload", "batch")
+        bot: Bot identifier
+        result: Completion result
+        history: Messages sent upstream (for history size columns)
+        user_dn: LDAP DN of the user
+        tier: Model tier that served the request (chat only)
+
+    Returns:
+        tuple: Row values in insert_usage() column order
+    """
+    history = history or []
+    return (
+        user, endpoint, bot, result.model,
+        result.prompt_tokens, result.completion_tokens, result.total_tokens,
+        len(history), sum(len(m.get("content") or "") for m in history),
+        result.upstream_ms, 1 if result.ok else 0,
+        # Time of the request, not of the (possibly deferred) insert
+        time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+        user_dn, tier,
+    )
+
+
+def insert_usage(cursor: sqlite3.Cursor, rows: Iterable[tuple]) -> None:
+    """
+    Insert usage rows (caller commits, so they can share the chat transaction)
+
+    Args:
+        cursor: Cursor on the chat history database
+        rows: Tuples from usage_row()
+    """
+    cursor.executemany("""
+        INSERT INTO usage (user, endpoint, bot, model, prompt_tokens, completion_tokens,
+                           total_tokens, history_messages, history_chars, upstream_ms, ok, timestamp, user_dn, tier)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, list(rows))
+
+
+def aggregate_usage(conns: Iterable[sqlite3.Connection], group_by: List[str], days: int = 7,
+                    user: Optional[str] = None, bot: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Aggregate usage over the last N days
+
+    Args:
+        conns: Connections to every shard of the chat store
+        group_by: Any of "user", "bot", "model", "endpoint", "tier", "day"
+        days: Look-back window in days
+        user: Only this user
+        bot: Only this bot
+
+    Returns:
+        list: One dict per group with request/token/latency totals, biggest spenders first
+
+    Raises:
+        ValueError: On unknown group_by column
+    """
+    unknown = [col for col in group_by if col not in GROUP_COLUMNS]
+    if unknown:
+        raise ValueError(f"Cannot group by {', '.join(unknown)}. Choose from: {', '.join(GROUP_COLUMNS)}")
+
+    select_groups = [f"{GROUP_COLUMNS[col]} AS {col}" for col in group_by]
+    where = ["timestamp >= datetime('now', ?)"]
+    params: List[Any] = [f"-{int(days)} days"]
+    if user:
+        where.append("user = ?")
+        params.append(user)
+    if bot:
+        where.append("bot = ?")
+        params.append(bot)
+
+    # Sums only, so groups split across shards can be merged before averaging
+    sql = f"""
+        SELECT {', '.join(select_groups + [''])}
+               COUNT(*) AS requests,
+               SUM(1 - ok) AS errors,
+               COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+               COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+               COALESCE(SUM(total_tokens), 0) AS total_tokens,
+               COALESCE(SUM(history_messages), 0) AS history_messages,
+               COALESCE(SUM(history_chars), 0) AS history_chars,
+               COALESCE(SUM(upstream_ms), 0) AS upstream_ms,
+               COUNT(upstream_ms) AS timed_requests,
+               MAX(upstream_ms) AS max_upstream_ms
+        FROM usage
+        WHERE {' AND '.join(where)}
+    """
+    if group_by:
+        sql += f" GROUP BY {', '.join(GROUP_COLUMNS[col] for col in group_by)}"
+
+    merged: Dict[tuple, Dict[str, Any]] = {}
+    for conn in conns:
+        cursor = conn.execute(sql, params)
+        columns = [c[0] for c in cursor.description]
+        for row in cursor.fetchall():
+            entry = dict(zip(columns, row))
+            if not entry["requests"]:
+                continue  # aggregate without GROUP BY over an empty shard
+            key = tuple(entry[col] for col in group_by)
+            if key not in merged:
+                merged[key] = entry
+                continue
+            total = merged[key]
+            for col in ("requests", "errors", "prompt_tokens", "completion_tokens", "total_tokens",
+                        "history_messages", "history_chars", "upstream_ms", "timed_requests"):
+                total[col] += entry[col]
+            total["max_upstream_ms"] = max(filter(None, (total["max_upstream_ms"], entry["max_upstream_ms"])),
+                                           default=None)
+
+    rows = []
+    for entry in merged.values():
+        requests, timed = entry.pop("requests"), entry.pop("timed_requests")
+        history_messages, history_chars = entry.pop("history_messages"), entry.pop("history_chars")
+        upstream_ms, max_upstream_ms = entry.pop("upstream_ms"), entry.pop("max_upstream_ms")
+        entry = {col: entry.pop(col) for col in group_by} | {
+            "requests": requests,
+            **entry,
+            "avg_history_messages": round(history_messages / requests, 1),
+            "avg_history_chars": round(history_chars / requests, 0),
+            "avg_upstream_ms": round(upstream_ms / timed, 1) if timed else None,
+            "max_upstream_ms": round(max_upstream_ms, 1) if max_upstream_ms is not None else None,
+        }
+        rows.append(entry)
+    rows.sort(key=lambda r: r["total_tokens"], reverse=True)
+    return rows